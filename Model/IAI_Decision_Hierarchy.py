@@ -12,31 +12,85 @@ Description: Decision Hierarchy for CODS XAI with MICA parameter support
 
 import os
 import sys
+import csv
+import glob
 import json
 import time
+import argparse
+import importlib
+import contextlib
 import traceback
 from collections import defaultdict
 
-import cv2
-import numpy as np
-from PIL import Image, ImageFile, ImageDraw, ImageFont
-ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-import matplotlib.colors as color
-import matplotlib.pyplot as plt
-from skimage.measure import label, regionprops, find_contours
+# ================================================================================================
+# Startup profiling - where does cold-start time go?
+# ================================================================================================
+class StartupProfile:
+    """Records the wall time of each cold-start step (imports, model loads)."""
+
+    def __init__(self):
+        self.entries = []
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def measure(self, label):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.entries.append((label, time.perf_counter() - start))
+
+    def report(self):
+        total = time.perf_counter() - self._origin
+        lines = [f"{'step':<48}{'seconds':>10}{'share':>8}"]
+        for label, seconds in self.entries:
+            lines.append(f"{label:<48}{seconds:>10.3f}{seconds / total:>8.1%}")
+        lines.append(f"{'total since module import':<48}{total:>10.3f}")
+        return "\n".join(lines)
+
+
+startup_profile = StartupProfile()
+
+with startup_profile.measure("import cv2/numpy/PIL"):
+    import cv2
+    import numpy as np
+    from PIL import Image, ImageFile, ImageDraw
+ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-import tensorflow as tf
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
-import torch
-import torch.nn.functional as F
+with startup_profile.measure("import torch"):
+    import torch
+    import torch.nn.functional as F
 
-from pytorch_grad_cam import GradCAM
-from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
-from pytorch_grad_cam.utils.image import show_cam_on_image as cam_overlay
+with startup_profile.measure("import model.ResNet_models"):
+    from model.ResNet_models import Generator
 
-from model.ResNet_models import Generator
+from stage_cache import StageCache, digest
+from detector_backend import load_detector, artifact_path
+from cods_export import ExportedGenerator, INPUT_SIZE, load_scripted_generator
+from cods_precision import PRECISIONS, autocast, resolve_precision
+from execution_profile import get_profile, apply_torch_profile, apply_channels_last, describe
+from tiled_inference import TILE_MULTIPLE, tiled_logits
+from postprocess import binary_mask, colormap, colormap_lut, mask_map, segmented_overlay
+from output_writer import OutputWriter, encode_image, encode_pil
+from raster_figures import panels, detection_boxes, encode_rgb, load_font
+
+# Heavy frameworks only some stages need (pytorch_grad_cam for the CAM
+# overlays) are imported on first use through
+# _lazy_import; TensorFlow is imported by detector_backend.load_detector.
+_lazy_modules = {}
+
+
+def _lazy_import(name):
+    """Import `name` the first time a stage needs it, recording the cost in startup_profile."""
+    module = _lazy_modules.get(name)
+    if module is None:
+        with startup_profile.measure(f"import {name}"):
+            module = importlib.import_module(name)
+        _lazy_modules[name] = module
+    return module
 
 
 # ================================================================================================
@@ -76,190 +130,159 @@ class DetectionConsolidator:
         """
         if not detections:
             return []
-        
+
+        # Same pipeline on arrays; np.array keeps the bbox dtype, so every IoU and
+        # distance is computed in the same precision as the per-pair scalar math
+        labels, class_ids = np.unique([d['label'] for d in detections], return_inverse=True)
+        return self.consolidate_arrays(
+            np.array([d['bbox'] for d in detections]).reshape(-1, 4),
+            np.array([d['confidence'] for d in detections], dtype=np.float64),
+            class_ids,
+            list(labels),
+        )
+
+    def consolidate_arrays(self, boxes, scores, class_ids, class_names):
+        """
+        Structured-array fast path of consolidate_detections, with the same output.
+
+        Args:
+            boxes: N x 4 array of [x1, y1, x2, y2]
+            scores: N confidences
+            class_ids: N indices into class_names
+            class_names: labels (e.g., "Object's leg")
+
+        Returns:
+            Consolidated list of detections
+        """
+        boxes = np.asarray(boxes)
+        scores = np.asarray(scores, dtype=np.float64)
+        class_ids = np.asarray(class_ids, dtype=np.intp)
+
         # Step 1: Filter by minimum confidence
-        filtered = [d for d in detections if d['confidence'] >= self.min_confidence]
-        
-        if not filtered:
+        keep = scores >= self.min_confidence
+        boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+        if len(scores) == 0:
             return []
-        
-        # Step 2: Apply Non-Maximum Suppression
-        nms_detections = self.non_max_suppression(filtered)
-        
+
+        # Step 2: Apply Non-Maximum Suppression (indices in descending confidence)
+        order = self.nms_indices(boxes, scores)
+
         # Step 3: Group nearby detections (parts of same object)
-        grouped = self.group_nearby_detections(nms_detections)
-        
+        groups = self.group_indices(boxes[order])
+
         # Step 4: Merge groups into single detections
-        consolidated = self.merge_groups(grouped)
-        
-        return consolidated
-    
-    def non_max_suppression(self, detections):
-        """Apply NMS to remove highly overlapping detections"""
-        if len(detections) == 0:
-            return []
-        
-        # Sort by confidence (descending)
-        detections = sorted(detections, key=lambda x: x['confidence'], reverse=True)
-        
-        kept = []
-        suppressed = set()
-        
-        for i, det in enumerate(detections):
-            if i in suppressed:
-                continue
-                
-            kept.append(det)
-            
-            # Suppress overlapping boxes
-            for j in range(i + 1, len(detections)):
-                if j in suppressed:
-                    continue
-                
-                iou = self.calculate_iou(det['bbox'], detections[j]['bbox'])
-                
-                if iou > self.iou_threshold:
-                    suppressed.add(j)
-        
-        return kept
-    
-    def group_nearby_detections(self, detections):
-        """Group detections that are close to each other (likely same object)"""
-        if len(detections) == 0:
-            return []
-        
-        # Calculate centroids
-        centroids = []
-        for det in detections:
-            bbox = det['bbox']
-            cx = (bbox[0] + bbox[2]) / 2
-            cy = (bbox[1] + bbox[3]) / 2
-            centroids.append((cx, cy))
-        
-        # Group by proximity
-        groups = []
-        assigned = set()
-        
-        for i, det in enumerate(detections):
-            if i in assigned:
-                continue
-            
-            # Start new group
-            group = [det]
-            assigned.add(i)
-            
-            # Find nearby detections
-            for j in range(i + 1, len(detections)):
-                if j in assigned:
-                    continue
-                
-                dist = self.euclidean_distance(centroids[i], centroids[j])
-                
-                if dist < self.distance_threshold:
-                    group.append(detections[j])
-                    assigned.add(j)
-            
-            groups.append(group)
-        
-        return groups
-    
-    def merge_groups(self, groups):
-        """Merge each group into a single consolidated detection"""
+        base_labels = [self.extract_base_label(name) for name in class_names]
         consolidated = []
-        
         for group in groups:
-            if not group:
-                continue
-            
-            # Calculate merged bounding box (union of all boxes)
-            merged_bbox = self.merge_bboxes([d['bbox'] for d in group])
-            
-            # Average confidence
-            avg_confidence = np.mean([d['confidence'] for d in group])
-            
-            # Max confidence
-            max_confidence = max([d['confidence'] for d in group])
-            
-            # Determine label (most common or highest confidence)
-            label = self.determine_label(group)
-            
-            # Count parts
+            idx = order[group]
+            group_boxes = boxes[idx]
+            group_scores = scores[idx]
+            group_labels = [base_labels[c] for c in class_ids[idx]]
+
             part_counts = defaultdict(int)
-            for d in group:
-                base_label = self.extract_base_label(d['label'])
+            label_max_conf = defaultdict(float)
+            for base_label, conf in zip(group_labels, group_scores.tolist()):
                 part_counts[base_label] += 1
-            
+                label_max_conf[base_label] = max(label_max_conf[base_label], conf)
+
             consolidated.append({
-                'bbox': merged_bbox,
-                'confidence': max_confidence,
-                'avg_confidence': avg_confidence,
-                'label': label,
-                'part_count': len(group),
+                'bbox': [
+                    group_boxes[:, 0].min(),
+                    group_boxes[:, 1].min(),
+                    group_boxes[:, 2].max(),
+                    group_boxes[:, 3].max()
+                ],
+                'confidence': float(group_scores.max()),
+                'avg_confidence': np.mean(group_scores),
+                'label': self._label_from_parts(label_max_conf),
+                'part_count': len(idx),
                 'parts': dict(part_counts)
             })
-        
+
         # Sort by confidence
         consolidated.sort(key=lambda x: x['confidence'], reverse=True)
-        
+
         return consolidated
+
+    def nms_indices(self, boxes, scores):
+        """Greedy NMS over arrays; returns kept indices in descending confidence order."""
+        # Stable sort keeps the input order among equal confidences, like sorted()
+        order = np.argsort(-scores, kind='stable')
+        sorted_boxes = boxes[order]
+        # Boolean overlap matrix, built in row blocks to bound the float temporaries
+        iou = np.concatenate([
+            self.iou_matrix(sorted_boxes[start:start + 1024], sorted_boxes) > self.iou_threshold
+            for start in range(0, len(order), 1024)
+        ])
+
+        suppressed = np.zeros(len(order), dtype=bool)
+        kept = []
+        for i in range(len(order)):
+            if suppressed[i]:
+                continue
+            kept.append(i)
+            suppressed[i + 1:] |= iou[i, i + 1:]
+
+        return order[kept]
+
+    def group_indices(self, boxes):
+        """Greedy proximity grouping over arrays; returns lists of row indices into `boxes`."""
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2
+        near = np.sqrt((cx[:, None] - cx[None, :])**2 + (cy[:, None] - cy[None, :])**2) < self.distance_threshold
+
+        assigned = np.zeros(len(boxes), dtype=bool)
+        groups = []
+        for i in range(len(boxes)):
+            if assigned[i]:
+                continue
+            members = np.flatnonzero(near[i, i + 1:] & ~assigned[i + 1:]) + i + 1
+            assigned[i] = True
+            assigned[members] = True
+            groups.append([i] + members.tolist())
+
+        return groups
+
+    @staticmethod
+    def iou_matrix(boxes_a, boxes_b):
+        """Pairwise IoU (len(a) x len(b)) of [x1, y1, x2, y2] boxes, in one vectorized step."""
+        x_inter_min = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+        y_inter_min = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+        x_inter_max = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+        y_inter_max = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+
+        overlapping = (x_inter_max >= x_inter_min) & (y_inter_max >= y_inter_min)
+        intersection = np.where(overlapping, (x_inter_max - x_inter_min) * (y_inter_max - y_inter_min), 0)
+
+        area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+        area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+        union = area_a[:, None] + area_b[None, :] - intersection
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, intersection / union, 0.0)
+
+    def non_max_suppression(self, detections):
+        """Apply NMS to remove highly overlapping detections"""
+        if len(detections) == 0:
+            return []
+
+        boxes = np.array([d['bbox'] for d in detections]).reshape(-1, 4)
+        scores = np.array([d['confidence'] for d in detections], dtype=np.float64)
+        return [detections[i] for i in self.nms_indices(boxes, scores)]
+
+    def group_nearby_detections(self, detections):
+        """Group detections that are close to each other (likely same object)"""
+        if len(detections) == 0:
+            return []
+
+        boxes = np.array([d['bbox'] for d in detections]).reshape(-1, 4)
+        return [[detections[i] for i in group] for group in self.group_indices(boxes)]
     
-    def calculate_iou(self, bbox1, bbox2):
-        """Calculate Intersection over Union"""
-        x1_min, y1_min, x1_max, y1_max = bbox1
-        x2_min, y2_min, x2_max, y2_max = bbox2
-        
-        # Calculate intersection
-        x_inter_min = max(x1_min, x2_min)
-        y_inter_min = max(y1_min, y2_min)
-        x_inter_max = min(x1_max, x2_max)
-        y_inter_max = min(y1_max, y2_max)
-        
-        if x_inter_max < x_inter_min or y_inter_max < y_inter_min:
-            return 0.0
-        
-        intersection = (x_inter_max - x_inter_min) * (y_inter_max - y_inter_min)
-        
-        # Calculate union
-        area1 = (x1_max - x1_min) * (y1_max - y1_min)
-        area2 = (x2_max - x2_min) * (y2_max - y2_min)
-        union = area1 + area2 - intersection
-        
-        return intersection / union if union > 0 else 0.0
-    
-    def euclidean_distance(self, point1, point2):
-        """Calculate Euclidean distance between two points"""
-        return np.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
-    
-    def merge_bboxes(self, bboxes):
-        """Merge multiple bounding boxes into one (union)"""
-        x_mins = [bbox[0] for bbox in bboxes]
-        y_mins = [bbox[1] for bbox in bboxes]
-        x_maxs = [bbox[2] for bbox in bboxes]
-        y_maxs = [bbox[3] for bbox in bboxes]
-        
-        return [
-            min(x_mins),
-            min(y_mins),
-            max(x_maxs),
-            max(y_maxs)
-        ]
-    
-    def determine_label(self, group):
-        """Determine the best label for a merged group"""
-        # Count label frequencies
-        label_counts = defaultdict(int)
-        label_max_conf = defaultdict(float)
-        
-        for det in group:
-            base_label = self.extract_base_label(det['label'])
-            label_counts[base_label] += 1
-            label_max_conf[base_label] = max(
-                label_max_conf[base_label], 
-                det['confidence']
-            )
-        
+    @staticmethod
+    def _label_from_parts(label_max_conf):
+        """Label for a group from its {base label: max confidence} (in first-seen order)."""
         # If multiple different parts (>2), call it "Camouflaged object"
-        if len(label_counts) > 2:
+        if len(label_max_conf) > 2:
             return "Camouflaged object"
         
         # Otherwise return most confident label
@@ -277,6 +300,36 @@ class DetectionConsolidator:
 # ================================================================================================
 # Lazy Loading Manager - Singleton pattern for managing resources
 # ================================================================================================
+CODS_MODEL_PATH = "./models/Resnet/Model_50_gen.pth"
+# How the Generator runs (--cods-backend):
+#   auto   frozen TorchScript export (cods_export.py) if it matches the weights, else eager
+#   eager  the PyTorch Generator as loaded from the checkpoint
+#   int8   eager with the calibrated INT8 modules from quantize_cods.py (CPU only)
+#   onnx   ONNX Runtime on the CPU (cods_onnx.py); no Grad-CAM overlays
+CODS_BACKENDS = ("auto", "eager", "int8", "onnx")
+CODS_BACKEND = "auto"
+# Autocast precision of the PyTorch Generator forward (--precision; see cods_precision.py).
+# The exported TorchScript / ONNX graphs are fp32, so bf16 / fp16 use the eager model.
+CODS_PRECISION = "fp32"
+
+# Generator heads the pipeline uses (names from ResNet_models.HEADS). init_pred is never read,
+# so the eager model skips its sal_dec pass; the exported graphs always compute all three.
+INFERENCE_HEADS = ("fix", "ref")
+
+# Full-resolution CODS maps from overlapping tiles (see tiled_inference.py); --tiled / --tile-*
+TILED_INFERENCE = False
+TILE_SIZE = 224
+TILE_OVERLAP = 0.25
+TILE_BATCH = 8
+
+# Detector execution backend (see detector_backend.py); --detector-backend / --detector-threads
+DETECTOR_BACKEND = "saved_model"
+DETECTOR_THREADS = None
+
+# Thread pools / memory format / denormals (see execution_profile.py); None uses the active profile
+EXECUTION_PROFILE = None
+
+
 class LazyResourceManager:
     _instance = None
     _initialized = False
@@ -289,39 +342,163 @@ class LazyResourceManager:
     def __init__(self):
         if not LazyResourceManager._initialized:
             self._cods_model = None
-            self._detect_fn = None
-            self._rd_bl_colormap = None
-            self._bl_gr_rd_bl_colormap = None
+            self._detector = None
             self._output_dirs_created = False
+            self._offramp_layers = False
+            self._cods_checksum = None
+            self._cods_config = None
+            self._cods_precision = None
+            self._tile_cods_model = None
+            self._profile = None
             LazyResourceManager._initialized = True
 
     @property
     def cods_model(self):
+        if self._cods_model is not None and self._cods_config != (CODS_BACKEND, CODS_PRECISION):
+            # Backend or precision switched (iaiDecision(cods_backend=..., precision=...)): reload
+            self._cods_model.disable_offramp_capture()
+            self._cods_model = None
+            self._cods_checksum = None
+            self._tile_cods_model = None
         if self._cods_model is None:
-            self._cods_model = self._load_cods_model()
+            with startup_profile.measure(f"load CODS model ({CODS_BACKEND}, {CODS_PRECISION})"):
+                self._cods_config = (CODS_BACKEND, CODS_PRECISION)
+                self._cods_model = self._load_cods_model()
         return self._cods_model
 
     @property
-    def detect_fn(self):
-        if self._detect_fn is None:
-            self._detect_fn = self._load_tensorflow_model()
-        return self._detect_fn
+    def tile_cods_model(self):
+        """
+        The Generator for --tiled tiles: the loaded one, unless it is an export
+        (fixed 224 px input) and TILE_SIZE differs; then an eager model loaded
+        alongside it.
+        """
+        cods = self.cods_model
+        if not isinstance(cods, ExportedGenerator) or TILE_SIZE == INPUT_SIZE:
+            return cods
+        if self._tile_cods_model is None:
+            print(f"[INFO] The exported Generator only takes {INPUT_SIZE} px inputs; "
+                  f"{TILE_SIZE} px tiles run on the eager model")
+            with startup_profile.measure("load CODS model (eager, for tiles)"):
+                tile_cods, _ = self.load_eager_cods_model()
+                self._tile_cods_model = apply_channels_last(tile_cods, self.execution_profile)
+        return self._tile_cods_model
+
+    @property
+    def cods_precision(self):
+        """The precision the loaded Generator runs at (fp32 if CODS_PRECISION is unsupported here)."""
+        if self._cods_precision is None:
+            _ = self.cods_model
+        return self._cods_precision
+
+    @property
+    def detector(self):
+        """EfficientDet D7 behind the selected backend: detector(image) -> {"boxes", "scores", "classes"}."""
+        if self._detector is None:
+            with startup_profile.measure(f"load EfficientDet D7 ({DETECTOR_BACKEND})"):
+                profile = self.execution_profile
+                self._detector = load_detector(DETECTOR_BACKEND,
+                                               num_threads=DETECTOR_THREADS or profile["tf_intra_threads"],
+                                               inter_op_threads=profile["tf_inter_threads"])
+        return self._detector
+
+    @property
+    def execution_profile(self):
+        """The selected execution profile, its PyTorch settings applied on first access."""
+        if self._profile is None:
+            self._profile = get_profile(EXECUTION_PROFILE)
+            apply_torch_profile(self._profile)
+            print(f"[INFO] Execution profile '{self._profile['name']}': {describe(self._profile)}")
+        return self._profile
+
+    @property
+    def detector_checksum(self):
+        """Identifies the detector backend and its model file (without loading it), for stage cache keys."""
+        path = artifact_path(DETECTOR_BACKEND)
+        st = os.stat(path) if os.path.exists(path) else None
+        return digest(DETECTOR_BACKEND, os.path.abspath(path), st.st_size if st else None,
+                      st.st_mtime_ns if st else None)
+
+    @property
+    def detector_ready(self):
+        """True once the detector has been loaded (without triggering the load)."""
+        return self._detector is not None
 
     @property
     def RdBl(self):
-        if self._rd_bl_colormap is None:
-            self._create_colormaps()
-        return self._rd_bl_colormap
+        """RdBl colormap as a 256 x 4 RGBA uint8 lookup table (postprocess.py)."""
+        return colormap_lut("RdBl")
 
     @property
     def blGrRdBl(self):
-        if self._bl_gr_rd_bl_colormap is None:
-            self._create_colormaps()
-        return self._bl_gr_rd_bl_colormap
+        """blGrRdBl colormap as a 256 x 4 RGBA uint8 lookup table (postprocess.py)."""
+        return colormap_lut("blGrRdBl")
+
+    @property
+    def cods_checksum(self):
+        """Identifies the CODS weights + LoRA adapter version, for stage cache keys."""
+        if self._cods_checksum is None:
+            _ = self.cods_model
+        return self._cods_checksum
 
     def _load_cods_model(self):
-        cods = Generator(channel=32)
-        model_path = "./models/Resnet/Model_50_gen.pth"
+        profile = self.execution_profile
+        device_type = "cuda" if torch.cuda.is_available() else "cpu"
+        self._cods_precision = "fp32"
+        if CODS_PRECISION != "fp32" and CODS_BACKEND == "onnx":
+            print(f"[WARN] The ONNX Runtime Generator runs in fp32; ignoring --precision {CODS_PRECISION}")
+        elif CODS_PRECISION != "fp32" and CODS_BACKEND == "int8":
+            print(f"[WARN] INT8 modules are not autocast; ignoring --precision {CODS_PRECISION}")
+        elif CODS_PRECISION != "fp32":
+            self._cods_precision = resolve_precision(CODS_PRECISION, device_type)
+
+        # Prefer the frozen TorchScript export (cods_export.py) if it was built from these weights
+        if CODS_BACKEND == "auto" and self._cods_precision == "fp32":
+            checksum = self._weights_checksum()
+            cods = load_scripted_generator(checksum, torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+            if cods is not None:
+                self._cods_checksum = checksum
+                self._apply_offramp(cods)
+                return cods
+
+        # ONNX Runtime session (cods_onnx.py); its results carry no Grad-CAMs, so cache them apart
+        if CODS_BACKEND == "onnx":
+            from cods_onnx import load_onnx_generator
+            checksum = self._weights_checksum()
+            # The session's intra-op pool follows the profile's CODS thread budget
+            cods = load_onnx_generator(checksum, num_threads=profile.get("torch_threads"))
+            if cods is not None:
+                self._cods_checksum = digest(checksum, "onnx")
+                self._apply_offramp(cods)
+                return cods
+
+        cods, self._cods_checksum = self.load_eager_cods_model()
+        # INT8 backbone + decoder feature convs (quantize_cods.py); quantized kernels are CPU-only
+        if CODS_BACKEND == "int8" and torch.cuda.is_available():
+            print("[WARN] INT8 modules are CPU-only and this run uses CUDA; using fp32.")
+        elif CODS_BACKEND == "int8":
+            from quantize_cods import load_quantized_modules
+            if load_quantized_modules(cods, self._cods_checksum):
+                self._cods_checksum = digest(self._cods_checksum, "int8")
+        if self._cods_precision != "fp32":
+            self._cods_checksum = digest(self._cods_checksum, self._cods_precision)
+        if CODS_BACKEND != "int8":
+            cods = apply_channels_last(cods, profile)
+        self._apply_offramp(cods)
+        return cods
+
+    def _weights_checksum(self):
+        # The base checkpoint is large and only replaced wholesale: identify it by size/mtime
+        from lora_inference import adapter_checksum
+        st = os.stat(CODS_MODEL_PATH)
+        return digest(os.path.abspath(CODS_MODEL_PATH), st.st_size, st.st_mtime_ns, adapter_checksum())
+
+    def load_eager_cods_model(self):
+        """Build the eager Generator from the checkpoint plus LoRA adapters; returns (model, checksum)."""
+        # Skip the ImageNet initialisation; every weight is overwritten by the checkpoint below
+        cods = Generator(channel=32, pretrained_backbone=False)
+        model_path = CODS_MODEL_PATH
+        checksum = self._weights_checksum()
     
         if torch.cuda.is_available():
             cods.load_state_dict(torch.load(model_path))
@@ -334,30 +511,25 @@ class LazyResourceManager:
         cods = apply_lora_to_model(cods)
     
         cods.eval()
-        return cods
+        return cods, checksum
 
-    def _load_tensorflow_model(self):
-        PATH_TO_SAVED_MODEL = "models/d7_f/saved_model"
-        with tf.device("/CPU:0"):
-            detect_fn = tf.saved_model.load(PATH_TO_SAVED_MODEL)
-        return detect_fn
-
-    def _create_colormaps(self):
-        # RdBl
-        if "RdBl" not in plt.colormaps():
-            RdBl_colors = ["black", "black", "red", "red"]
-            self._rd_bl_colormap = color.LinearSegmentedColormap.from_list("RdBl", RdBl_colors)
-            plt.register_cmap(cmap=self._rd_bl_colormap)
-        else:
-            self._rd_bl_colormap = plt.get_cmap("RdBl")
+    def configure_offramp(self, layers=False):
+        """
+        Turn feature-map (offramp) capture on or off for the CODS model.
+
+        False disables it (the default), None captures every layer in
+        OFFRAMP_LAYERS, a list selects layers by name. Applies immediately if
+        the model is already loaded, otherwise on load.
+        """
+        self._offramp_layers = layers
+        if self._cods_model is not None:
+            self._apply_offramp(self._cods_model)
 
-        # blGrRdBl
-        if "blGrRdBl" not in plt.colormaps():
-            blGrRdBl_colors = ["black", "blue", "green", "red", "red"]
-            self._bl_gr_rd_bl_colormap = color.LinearSegmentedColormap.from_list("blGrRdBl", blGrRdBl_colors)
-            plt.register_cmap(cmap=self._bl_gr_rd_bl_colormap)
+    def _apply_offramp(self, cods):
+        if self._offramp_layers is False:
+            cods.disable_offramp_capture()
         else:
-            self._bl_gr_rd_bl_colormap = plt.get_cmap("blGrRdBl")
+            cods.enable_offramp_capture(layers=self._offramp_layers)
 
     def ensure_output_dirs(self):
         if not self._output_dirs_created:
@@ -366,14 +538,37 @@ class LazyResourceManager:
             self._output_dirs_created = True
 
     def clear_cache(self):
+        if self._cods_model is not None:
+            self._cods_model.disable_offramp_capture()
         self._cods_model = None
-        self._detect_fn = None
+        self._cods_checksum = None
+        self._cods_config = None
+        self._cods_precision = None
+        self._tile_cods_model = None
+        self._detector = None
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
 
 
 resource_manager = LazyResourceManager()
 
+# Per-stage results keyed by each stage's inputs (see stage_cache.py); in memory unless
+# --cache-dir adds the disk tier, --no-cache disables it
+stage_cache = StageCache()
+
+# Encodes and writes the per-image artifacts in the background (see output_writer.py)
+output_writer = OutputWriter()
+
+
+def flush_outputs():
+    """Wait for every queued output file; returns the failed writes as "path: error" strings."""
+    return [f"{path}: {type(error).__name__}: {error}" for path, error in output_writer.flush()]
+
+
+def _note_cache_hit(record, stage):
+    if record is not None:
+        record.setdefault("cache_hits", []).append(stage)
+
 
 # ================================================================================================
 # MICA parameter loading + threshold mapping
@@ -418,67 +613,63 @@ def compute_binary_threshold(mica_params, base_thresh=0.5):
 # ================================================================================================
 def add_label(image, label_text, label_position):
     draw = ImageDraw.Draw(image)
-    try:
-        font = ImageFont.truetype("arial.ttf", 20)
-    except Exception:
-        font = ImageFont.load_default()
+    font = load_font(20)
     draw.text(label_position, label_text, fill="white", font=font, stroke_width=2, stroke_fill="black")
     return image
 
 
 def processFixationMap(fix_image):
-    blGrRdBl = resource_manager.blGrRdBl
-    img_np = np.asarray(fix_image) / 255.0
-
-    if img_np.ndim > 2:
-        img_np = img_np.squeeze()
-        if img_np.ndim > 2:
-            img_np = img_np[:, :, 0]
-
-    return Image.fromarray(blGrRdBl(img_np, bytes=True))
+    """The uint8 fixation map through the blGrRdBl colormap, as an RGBA uint8 array."""
+    return colormap(fix_image, "blGrRdBl")
 
 
 def findAreasOfWeakCamouflage(fix_image):
-    RdBl = resource_manager.RdBl
-    img_np = np.asarray(fix_image) / 255.0
-
-    if img_np.ndim > 2:
-        img_np = img_np.squeeze()
-        if img_np.ndim > 2:
-            img_np = img_np[:, :, 0]
-
-    return Image.fromarray((RdBl(img_np) * 255).astype(np.uint8))
+    """The uint8 fixation map through the RdBl colormap (only weak areas stay non-black), as RGBA uint8."""
+    return colormap(fix_image, "RdBl")
 
 
-def mask_to_border(mask):
-    open_cv_image = cv2.cvtColor(np.asarray(mask), cv2.COLOR_RGB2GRAY)
-    h, w = open_cv_image.shape[:2]
-    border = np.zeros((h, w), dtype=np.uint8)
+# Weak areas smaller than this many pixels are ignored (0 keeps every area; --min-weak-area)
+WEAK_AREA_MIN_AREA = 0
 
-    contours = find_contours(open_cv_image, 1)
-    for contour in contours:
-        for c in contour:
-            x = int(c[0])
-            y = int(c[1])
-            border[x, y] = 255
-
-    return border
 
+def extract_weak_areas(weak_map, min_area=0):
+    """
+    Connected weak-camouflage areas of a weak fixation map, in one pass.
 
-def mask_to_bbox(mask):
-    bboxes = []
-    mask = mask_to_border(mask)
-    lbl = label(mask)
-    props = regionprops(lbl)
+    Every non-black pixel belongs to a weak area; areas are 8-connected components
+    in raster order of their first pixel. Returns arrays `bboxes` (N x 4 as
+    [x1, y1, x2, y2], x2/y2 exclusive), `areas` (N, pixels) and `centroids`
+    (N x 2 as [x, y]), dropping components smaller than `min_area`.
+    """
+    weak_np = np.asarray(weak_map)
+    gray = cv2.cvtColor(weak_np, cv2.COLOR_RGB2GRAY) if weak_np.ndim == 3 else weak_np
+    mask = (gray >= 1).astype(np.uint8)
+
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    # Row 0 is the background
+    ids = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= max(min_area, 1)) + 1
+
+    # OpenCV numbers the components in 2 x 2 block order; put them in raster order
+    # of their first pixel, which lies in the component's top row
+    tops = stats[ids, cv2.CC_STAT_TOP]
+    firsts = [stats[i, cv2.CC_STAT_LEFT]
+              + int(np.argmax(labels[top, stats[i, cv2.CC_STAT_LEFT]:] == i)) for i, top in zip(ids, tops)]
+    ids = ids[np.lexsort((firsts, tops))]
+    stats, centroids = stats[ids], centroids[ids]
+
+    x1 = stats[:, cv2.CC_STAT_LEFT]
+    y1 = stats[:, cv2.CC_STAT_TOP]
+    return {
+        "bboxes": np.stack([x1, y1, x1 + stats[:, cv2.CC_STAT_WIDTH], y1 + stats[:, cv2.CC_STAT_HEIGHT]], axis=1),
+        "areas": stats[:, cv2.CC_STAT_AREA],
+        "centroids": centroids,
+    }
 
-    for prop in props:
-        x1 = prop.bbox[1]
-        y1 = prop.bbox[0]
-        x2 = prop.bbox[3]
-        y2 = prop.bbox[2]
-        bboxes.append([x1, y1, x2, y2])
 
-    return bboxes
+def mask_to_bbox(mask, min_area=0):
+    """[x1, y1, x2, y2] boxes of the weak areas in `mask` (see extract_weak_areas)."""
+    return extract_weak_areas(mask, min_area)["bboxes"].tolist()
 
 
 def overlap(bbox1, bbox2):
@@ -488,25 +679,86 @@ def overlap(bbox1, bbox2):
     return overlap1D(bbox1[:2], bbox2[:2]) and overlap1D(bbox1[2:], bbox2[2:])
 
 
+def overlap_matrix(boxes_a, boxes_b):
+    """Broadcast `overlap` over two sets of [x1, y1, x2, y2] boxes; returns a len(a) x len(b) bool matrix."""
+    return (
+        (boxes_a[:, None, 2] >= boxes_b[None, :, 0]) & (boxes_b[None, :, 2] >= boxes_a[:, None, 0])
+        & (boxes_a[:, None, 3] >= boxes_b[None, :, 1]) & (boxes_b[None, :, 3] >= boxes_a[:, None, 1])
+    )
+
+
 def apply_mask(heatmap, mask):
-    """Apply a binary mask to a heatmap."""
-    if isinstance(heatmap, Image.Image):
-        heatmap = np.asarray(heatmap)
-        trans_heatmap = np.transpose(heatmap)
+    """Apply a binary (0/1 uint8) mask of the same height and width to a uint8 heatmap."""
+    return mask_map(heatmap, mask)
+
+
+# Output pixels per strip in process_prediction; bounds its float working memory
+PREDICTION_STRIP_PIXELS = 1 << 20
+
+
+def _resize_matrix(n_out, n_in, align_corners=False):
+    """(n_out, n_in) bilinear resize weights for one axis, as F.interpolate computes them."""
+    if align_corners:
+        pos = np.arange(n_out) * ((n_in - 1) / max(n_out - 1, 1))
     else:
-        trans_heatmap = np.transpose(heatmap)
+        pos = np.clip((np.arange(n_out) + 0.5) * (n_in / n_out) - 0.5, 0, None)
+    i0 = np.minimum(np.floor(pos).astype(np.int64), n_in - 1)
+    i1 = np.minimum(i0 + 1, n_in - 1)
+    frac = (pos - i0).astype(np.float32)
+    weights = np.zeros((n_out, n_in), dtype=np.float32)
+    np.add.at(weights, (np.arange(n_out), i0), 1 - frac)
+    np.add.at(weights, (np.arange(n_out), i1), frac)
+    return weights
 
-    mask_broadcasted = np.broadcast_to(mask, trans_heatmap.shape)
-    masked_heatmap = mask_broadcasted * trans_heatmap
-    masked_heatmap = np.transpose(masked_heatmap)
-    return masked_heatmap
+
+def _axis_weights(n_out, n_in, via=None):
+    """
+    Resize weights for an axis of n_in logits to n_out pixels. With `via` they
+    compose the former two-step chain (align_corners=True upsample to `via`,
+    then a half-pixel resize), so a single pass gives the same map.
+    """
+    if via is None:
+        return _resize_matrix(n_out, n_in)
+    return _resize_matrix(n_out, via) @ _resize_matrix(via, n_in, align_corners=True)
 
 
-def process_prediction(pred, WW, HH):
-    pred = F.upsample(pred, size=[HH, WW], mode="bilinear", align_corners=False)
-    pred = pred.sigmoid().data.cpu().numpy().squeeze()
-    pred = 255 * (pred - pred.min()) / (pred.max() - pred.min() + 1e-8)
-    return pred.astype(np.uint8)
+def process_prediction(pred, WW, HH, input_size=None):
+    """
+    uint8 HH x WW map of sigmoid(pred), min-max scaled to 0-255, from a 1x1xhxw
+    logit map at any resolution (the decoders' native 1/4 resolution normally).
+
+    The map is resized in one pass (a small matrix product per axis) and built
+    in strips of rows, so no full-size float tensor is ever allocated; only the
+    uint8 result is full size. `input_size` is the model input (H, W) the logits
+    came from: the weights then reproduce the former upsample-to-input,
+    resize-to-image chain. Without it (tiled logits) it is a plain resize.
+    """
+    logit = pred.detach().float().cpu().numpy().reshape(pred.shape[-2:])
+    h, w = logit.shape
+    via_h, via_w = input_size if input_size is not None and tuple(input_size) != (h, w) else (None, None)
+
+    # Rows first (HH x w, small), then each strip across to WW columns
+    rows = logit if (h, via_h) == (HH, None) else _axis_weights(HH, h, via_h) @ logit
+    cols = None if (w, via_w) == (WW, None) else _axis_weights(WW, w, via_w).T
+    strip = max(1, PREDICTION_STRIP_PIXELS // max(WW, 1))
+    strips = range(0, HH, strip)
+
+    def resized(start):
+        part = rows[start:start + strip]
+        return part if cols is None else part @ cols
+
+    # sigmoid is monotonic: the range of the sigmoid map is the sigmoid of the logit range
+    lo, hi = np.inf, -np.inf
+    for start in strips:
+        part = resized(start)
+        lo, hi = min(lo, float(part.min())), max(hi, float(part.max()))
+    lo, hi = (1.0 / (1.0 + np.exp(-np.float32([lo, hi])))).astype(np.float32)
+
+    output = np.empty((HH, WW), dtype=np.uint8)
+    for start in strips:
+        prob = 1.0 / (1.0 + np.exp(-resized(start)))
+        output[start:start + strip] = (255 * (prob - lo) / (hi - lo + 1e-8)).astype(np.uint8)
+    return output
 
 
 def create_segmented_overlay(original_image, rank_map, binary_mask, alpha=0.5):
@@ -525,105 +777,107 @@ def create_segmented_overlay(original_image, rank_map, binary_mask, alpha=0.5):
         else:
             binary_mask = cv2.resize(binary_mask.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST)
     
-    heatmap_colored = cv2.applyColorMap(rank_map, cv2.COLORMAP_JET)
-    mask_3ch = np.stack([binary_mask] * 3, axis=-1).astype(np.float32)
-    blended = original_image.copy().astype(np.float32)
-    blended = blended * (1 - mask_3ch * alpha) + heatmap_colored.astype(np.float32) * (mask_3ch * alpha)
-    
-    return blended.astype(np.uint8)
+    return segmented_overlay(original_image, rank_map, binary_mask, alpha)
+
+
+# ================================================================================================
+# Level bookkeeping
+# ================================================================================================
+def _record_level(record, level, seconds):
+    """Note in `record` that a hierarchy level ran and how long its own work took."""
+    if record is None:
+        return
+    record.setdefault("levels_run", []).append(level)
+    record.setdefault("level_seconds", {})[f"level{level}"] = round(seconds, 4)
 
 
 # ================================================================================================
 # Level Three (WITH CONSOLIDATION)
 # ================================================================================================
-def levelThree(original_image, bbox, message, filename, mica_params):
+def levelThree(original_image, bbox, message, filename, mica_params, record=None, image_digest=None):
     """
     Object part detection with consolidation
+
+    `image_digest` is digest(original_image) when the caller already has it.
     """
-    detect_fn = resource_manager.detect_fn
+    start = time.perf_counter()
+    if record is not None:
+        record["detector_loaded"] = False
 
     y_size, x_size, _ = original_image.shape
     label_map = ["leg", "mouth", "shadow", "tail", "arm", "eye"]
 
-    input_tensor = tf.convert_to_tensor(original_image)[tf.newaxis, ...]
-    detections = detect_fn(input_tensor)
+    # Detections depend only on the image (and the detector version)
+    if image_digest is None:
+        image_digest = digest(original_image)
+    detector_key = digest("detector", image_digest, resource_manager.detector_checksum)
+    detections = stage_cache.get("detector", detector_key)
+    if detections is None:
+        if record is not None:
+            record["detector_loaded"] = not resource_manager.detector_ready
+        detections = resource_manager.detector(original_image)
+        stage_cache.put("detector", detector_key, detections)
+    else:
+        _note_cache_hit(record, "detector")
 
-    # Collect all raw detections
-    raw_detections = []
-    
-    for box1 in bbox:
-        for i, score in enumerate(detections["detection_scores"].numpy()[0]):
-            if score < 0.05:  # Skip very low confidence
-                continue
-                
-            box2 = detections["detection_boxes"].numpy()[0][i]
-            
-            # Check if detection overlaps with weak camouflage region
-            if overlap(
-                [box1["x1"], box1["x2"], box1["y1"], box1["y2"]],
-                [box2[1] * x_size, box2[3] * x_size, box2[0] * y_size, box2[2] * y_size],
-            ):
-                detected_class_idx = int(detections["detection_classes"].numpy()[0][i]) - 1
-                if 0 <= detected_class_idx < len(label_map):
-                    detected_class = label_map[detected_class_idx]
-                else:
-                    detected_class = "unknown"
-                
-                raw_detections.append({
-                    'bbox': [
-                        box2[1] * x_size,  # x1
-                        box2[0] * y_size,  # y1
-                        box2[3] * x_size,  # x2
-                        box2[2] * y_size   # y2
-                    ],
-                    'confidence': float(score),
-                    'label': f"Object's {detected_class}"
-                })
-    
-    # CONSOLIDATE DETECTIONS
+    # CONSOLIDATION PARAMETERS (adjusted by sensitivity)
     sensitivity = mica_params.get("sensitivity", 1.5)
-    
-    # Adjust consolidation parameters based on sensitivity
     iou_threshold = 0.25
     distance_threshold = 100.0 if sensitivity < 1.0 else 50.0
     min_confidence = 0.10
-    
+
+    consolidate_key = digest("consolidate", detector_key, bbox, iou_threshold, distance_threshold, min_confidence)
+    consolidated = stage_cache.get("consolidate", consolidate_key)
+    if consolidated is not None:
+        _note_cache_hit(record, "consolidate")
+        _record_level(record, 3, time.perf_counter() - start)
+        return report_detections(original_image, consolidated, message, filename, record)
+
+    # Detector boxes are normalized [y1, x1, y2, x2]; scale to pixel [x1, y1, x2, y2]
+    scores = detections["scores"]
+    boxes = detections["boxes"]
+    scaled = np.stack([
+        boxes[:, 1] * x_size,
+        boxes[:, 0] * y_size,
+        boxes[:, 3] * x_size,
+        boxes[:, 2] * y_size,
+    ], axis=1)
+    areas = np.array([[b["x1"], b["y1"], b["x2"], b["y2"]] for b in bbox]).reshape(-1, 4)
+
+    # Weak area x detection matrix: confident detections overlapping each weak camouflage region.
+    # Row-major nonzero keeps the old (weak area, detection) visiting order.
+    hits = overlap_matrix(areas, scaled) & (scores >= 0.05)[None, :]
+    det_idx = np.nonzero(hits)[1]
+
+    # Class ids past the label map (or below 1) become "unknown"
+    class_idx = detections["classes"].astype(np.int64) - 1
+    class_idx = np.where((class_idx >= 0) & (class_idx < len(label_map)), class_idx, len(label_map))
+    class_names = [f"Object's {part}" for part in label_map + ["unknown"]]
+
+    # CONSOLIDATE DETECTIONS
     consolidator = DetectionConsolidator(
         iou_threshold=iou_threshold,
         distance_threshold=distance_threshold,
         min_confidence=min_confidence
     )
     
-    consolidated = consolidator.consolidate_detections(raw_detections)
-    
-    # Save visualization with consolidated detections
-    fig, axis = plt.subplots(1, figsize=(12, 6))
-    axis.imshow(original_image)
-    axis.axis("off")
-
-    for det in consolidated:
-        bbox_coords = det['bbox']
-        axis.add_patch(
-            plt.Rectangle(
-                (bbox_coords[0], bbox_coords[1]),
-                bbox_coords[2] - bbox_coords[0],
-                bbox_coords[3] - bbox_coords[1],
-                fill=False,
-                linewidth=2,
-                color=(1, 0, 0),
-            )
-        )
-        axis.text(
-            bbox_coords[0], 
-            bbox_coords[1] - 10, 
-            f"{det['label']} {det['confidence']:.2%}", 
-            color=(1, 0, 0),
-            fontsize=10,
-            weight='bold'
-        )
+    consolidated = consolidator.consolidate_arrays(
+        scaled[det_idx], scores[det_idx].astype(np.float64), class_idx[det_idx], class_names)
+    stage_cache.put("consolidate", consolidate_key, consolidated)
+    _record_level(record, 3, time.perf_counter() - start)
+
+    return report_detections(original_image, consolidated, message, filename, record)
+
 
-    fig.savefig(f"detection_results/{filename}.png", bbox_inches="tight", pad_inches=0)
-    plt.close(fig)
+def report_detections(original_image, consolidated, message, filename, record=None):
+    """Write the Level 3 figure and text file and append the consolidated result to `message`."""
+    if record is not None:
+        record["num_detections"] = len(consolidated)
+
+    # Save visualization with consolidated detections (drawn and encoded in the background)
+    boxes = [{"bbox": det["bbox"], "label": det["label"], "confidence": det["confidence"]} for det in consolidated]
+    output_writer.submit(f"detection_results/{filename}.png",
+                         lambda: encode_rgb(detection_boxes(original_image, boxes)))
 
     # Format consolidated message
     txt_content = []
@@ -664,8 +918,7 @@ def levelThree(original_image, bbox, message, filename, mica_params):
             txt_content.append(f"  Part Count: {det['part_count']}")
             txt_content.append(f"  Parts: {parts_str}")
 
-    with open(f"detection_results/{filename}.txt", "w") as f:
-        f.write("\n".join(txt_content))
+    output_writer.write_text(f"detection_results/{filename}.txt", "\n".join(txt_content))
 
     return message
 
@@ -673,19 +926,24 @@ def levelThree(original_image, bbox, message, filename, mica_params):
 # ================================================================================================
 # Level Two
 # ================================================================================================
-def levelTwo(filename, original_image, all_fix_map, fixation_map, message, mica_params):
-    # Save overview figure
-    fig, axis = plt.subplots(1, 2, figsize=(12, 6))
-    axis[0].imshow(original_image)
-    axis[0].set_title("Original Image")
-    axis[1].imshow(all_fix_map)
-    axis[1].set_title("Fixation Map")
-    plt.tight_layout()
-    plt.savefig(f"figures/fig_{filename}")
-    plt.close(fig)
+def levelTwo(filename, original_image, all_fix_map, fixation_map, message, mica_params, record=None,
+             interactive=False, image_digest=None):
+    """
+    Find weak camouflage areas and hand them to Level 3.
+
+    interactive=True is the MICA slider path: skip the figures and stop
+    after Level 2 so the answer comes back without running the detector.
+    """
+    start = time.perf_counter()
+
+    if not interactive:
+        # Save overview figure
+        output_writer.submit(f"figures/fig_{filename}.png", lambda: encode_rgb(
+            panels([original_image, all_fix_map], ["Original Image", "Fixation Map"])))
 
     # Bounding boxes from weak fixation
-    bboxes = mask_to_bbox(fixation_map)
+    weak_areas = extract_weak_areas(fixation_map, min_area=WEAK_AREA_MIN_AREA)
+    bboxes = weak_areas["bboxes"].tolist()
 
     open_cv_orImage1 = original_image.copy()
     open_cv_orImage2 = original_image.copy()
@@ -697,7 +955,7 @@ def levelTwo(filename, original_image, all_fix_map, fixation_map, message, mica_
         "weak_area_bbox": [],
     }
 
-    for bbox in bboxes:
+    for bbox, area, centroid in zip(bboxes, weak_areas["areas"].tolist(), weak_areas["centroids"].tolist()):
         starting_point = (bbox[0], bbox[1])
         ending_point = (bbox[2], bbox[3])
         marked_image = cv2.rectangle(open_cv_orImage1, starting_point, ending_point, (255, 0, 0), 2)
@@ -705,197 +963,719 @@ def levelTwo(filename, original_image, all_fix_map, fixation_map, message, mica_
         ci = open_cv_orImage2[bbox[1] : bbox[3], bbox[0] : bbox[2]]
         cropped_images.append(ci)
 
-        data["weak_area_bbox"].append({"x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3]})
+        data["weak_area_bbox"].append({
+            "x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3],
+            "area": area, "cx": round(centroid[0], 2), "cy": round(centroid[1], 2),
+        })
+
+    output_writer.write_text(f"jsons/{filename}.json", json.dumps(data, indent=6))
 
-    with open(f"jsons/{filename}.json", "w") as f:
-        json.dump(data, f, indent=6)
+    if not interactive:
+        # Figure of marked + first crop
+        first_crop = cropped_images[0] if cropped_images else None
+        output_writer.submit(f"bbox_figures/fig_{filename}.png", lambda: encode_rgb(
+            panels([marked_image, first_crop], ["Identified Weak Camo", "Cropped Weak Camo Area"])))
 
-    # Figure of marked + first crop
-    fig, axis = plt.subplots(1, 2, figsize=(12, 6))
-    axis[0].imshow(marked_image)
-    axis[0].set_title("Identified Weak Camo")
-    if cropped_images and cropped_images[0].size != 0:
-        axis[1].imshow(cropped_images[0])
-    axis[1].set_title("Cropped Weak Camo Area")
-    plt.savefig(f"bbox_figures/fig_{filename}")
-    plt.close(fig)
+    if record is not None:
+        record["num_weak_areas"] = len(bboxes)
+    _record_level(record, 2, time.perf_counter() - start)
 
     message += f"Identified {len(bboxes)} weak camouflaged area(s).\n"
-    output = levelThree(original_image, data["weak_area_bbox"], message, filename, mica_params)
+
+    if interactive:
+        if record is not None:
+            record["early_exit"] = "interactive"
+        return message
+
+    if not bboxes:
+        # Nothing for Level 3 to inspect: don't load or run the detector
+        if record is not None:
+            record["early_exit"] = "no_weak_areas"
+        return report_detections(original_image, [], message, filename, record)
+
+    output = levelThree(original_image, data["weak_area_bbox"], message, filename, mica_params, record,
+                        image_digest)
     return output
 
 
 # ================================================================================================
 # Level One
 # ================================================================================================
-def levelOne(filename, binary_map, all_fix_map, fix_image, original_image, message, mica_params):
+def levelOne(filename, binary_map, all_fix_map, fix_image, original_image, message, mica_params, record=None,
+             interactive=False, image_digest=None):
     all_zeros = not binary_map.any()
+    if record is not None:
+        record["object_present"] = not all_zeros
+    _record_level(record, 1, 0.0)
+
     if all_zeros:
+        if record is not None:
+            record["early_exit"] = "no_object"
         message += "No object present.\n"
         return message
 
     message += "Object present.\n"
-    return levelTwo(filename, original_image, all_fix_map, fix_image, message, mica_params)
+    return levelTwo(filename, original_image, all_fix_map, fix_image, message, mica_params, record, interactive,
+                    image_digest)
 
 
 # ================================================================================================
 # GradCAM helper
 # ================================================================================================
-class MultiOutputGradCAM(GradCAM):
-    def __init__(self, model, target_layers, output_index=0, reshape_transform=None):
-        super().__init__(model, target_layers, reshape_transform)
-        self.output_index = output_index
+class MultiTargetGradCAM:
+    """
+    Grad-CAM for several (target layer, output index) pairs from a single forward.
 
-    def forward(self, input_tensor, targets=None, eigen_smooth=False):
-        outputs = self.activations_and_grads(input_tensor)
-        output = outputs[self.output_index]
+    Forward hooks keep each target layer's activation; after the forward, one
+    torch.autograd.grad call per target differentiates output[index].sum() with
+    respect to that activation only, so no parameter gradients are accumulated.
+    Hooks are removed as soon as the forward returns and the graph is released
+    with the last target. CAMs match pytorch_grad_cam.GradCAM for the same targets.
+    """
+
+    def __init__(self, model, targets):
+        self.model = model
+        self.targets = list(targets)
 
-        if targets is None:
-            target_categories = np.argmax(output.cpu().data.numpy(), axis=-1)
-            targets = [ClassifierOutputTarget(category) for category in target_categories]
+    def __call__(self, input_tensor):
+        """Return (outputs, cams): detached model outputs and one Nx H x W CAM array (or None) per target."""
+        activations = {}
 
-        if self.uses_gradients:
-            self.model.zero_grad()
-            loss = output.sum()
-            loss.backward(retain_graph=True)
+        def save_activation(i):
+            def hook(module, inputs, output):
+                activations[i] = output
+            return hook
 
-        cam_per_layer = self.compute_cam_per_layer(input_tensor, targets, eigen_smooth)
-        return self.aggregate_multi_layers(cam_per_layer)
+        handles = [layer.register_forward_hook(save_activation(i))
+                   for i, (layer, _) in enumerate(self.targets)]
+        try:
+            with torch.enable_grad():
+                outputs = self.model(input_tensor)
+        finally:
+            for handle in handles:
+                handle.remove()
+
+        target_size = (input_tensor.shape[3], input_tensor.shape[2])
+        cams = []
+        for i, (_, output_index) in enumerate(self.targets):
+            try:
+                grads, = torch.autograd.grad(outputs[output_index].float().sum(), activations[i],
+                                             retain_graph=i < len(self.targets) - 1)
+                cams.append(self._cam(activations[i], grads, target_size))
+            except Exception as e:
+                print(f"[WARN] Grad-CAM for output {output_index} failed: {e}")
+                cams.append(None)
+
+        return tuple(None if output is None else output.detach().float() for output in outputs), cams
+
+    @staticmethod
+    def _scale(cams, target_size=None):
+        result = []
+        for cam in cams:
+            cam = cam - np.min(cam)
+            cam = cam / (1e-7 + np.max(cam))
+            if target_size is not None:
+                cam = cv2.resize(cam, target_size)
+            result.append(cam)
+        return np.float32(result)
+
+    @classmethod
+    def _cam(cls, activations, grads, target_size):
+        # Upcast first: under bf16 / fp16 autocast the channel weighting would lose precision
+        activations = activations.detach().float().cpu().numpy()
+        grads = grads.float().cpu().numpy()
+        weights = np.mean(grads, axis=(2, 3))
+        cam = np.maximum((weights[:, :, None, None] * activations).sum(axis=1), 0)
+        # Same two-step normalisation as pytorch_grad_cam (per layer, then after aggregation)
+        return cls._scale(np.maximum(cls._scale(cam, target_size), 0))
 
 
 # ================================================================================================
-# Main IAI entry point
+# Pipeline stages (shared by single-image and batch entry points)
 # ================================================================================================
-def iaiDecision(file_path, output_root=None, force_reload=False):
-    try:
-        if force_reload:
-            resource_manager.clear_cache()
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+MANIFEST_EXTENSIONS = (".txt", ".lst", ".csv")
 
-        resource_manager.ensure_output_dirs()
 
-        cods = resource_manager.cods_model
-        _ = resource_manager.detect_fn
+def output_dir_for(file_name, output_root=None):
+    """Return (and create) the per-image output folder: <output_root or outputs>/<file_name>."""
+    out_dir = os.path.join(output_root or "outputs", file_name)
+    os.makedirs(out_dir, exist_ok=True)
+    return out_dir
 
-        file_name = os.path.splitext(os.path.basename(file_path))[0]
 
-        # Output directory per image
-        if output_root:
-            os.makedirs(output_root, exist_ok=True)
-            out_dir = os.path.join(output_root, file_name)
-        else:
-            out_dir = os.path.join("outputs", file_name)
-        os.makedirs(out_dir, exist_ok=True)
+def preprocess_image(original_image):
+    """BGR uint8 image -> 1x3x224x224 float tensor in [0, 1] for the CODS model."""
+    image = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
+    image = cv2.resize(image, (224, 224))
+    image = image.transpose((2, 0, 1))
+    image = image / 255.0
+    return torch.from_numpy(image).float().unsqueeze(0)
 
-        message = f"Decision for {file_name}:\n"
 
-        original_image = cv2.imread(file_path)
-        if original_image is None:
-            raise ValueError(f"Unable to load image from path: {file_path}")
+def forward_with_gradcams(cods, image, precision=None):
+    """
+    One CODS forward on a (batched) input plus fixation / COD Grad-CAM from it.
+
+    Returns (fix_pred, cod_pred2, cams_fix, cams_cod, logits); a CAM is None if it
+    failed. `logits` are the encoder outputs before the MICA adjustment, kept for
+    rethreshold(), and the predictions their MICA-adjusted form, both at the
+    decoders' native resolution (process_prediction resizes them once). The
+    forward runs at `precision` (default: the loaded model's); everything
+    returned is float32.
+    """
+    if isinstance(cods, ExportedGenerator):
+        _, _, cams_fix, cams_cod, logits = _scripted_forward_with_gradcams(cods, image)
+    else:
+        cams_fix, cams_cod, logits = _eager_forward_with_gradcams(cods, image, precision)
+    with torch.no_grad():
+        fix_pred, _, cod_pred2 = cods.adjust_logits(logits)
+    return fix_pred, cod_pred2, cams_fix, cams_cod, logits
+
+
+def _eager_forward_with_gradcams(cods, image, precision=None):
+    """Grad-CAMs and encoder logits from one forward of the eager Generator."""
+    precision = precision or resource_manager.cods_precision
+    logits = []
+    handle = cods.sal_encoder.register_forward_hook(
+        lambda module, inputs, output: logits.extend(None if o is None else o.detach().float() for o in output))
+    try:
+        engine = MultiTargetGradCAM(lambda x: cods(x, heads=INFERENCE_HEADS),
+                                    [(cods.get_x4_layer(), 0), (cods.get_x4_2_layer(), 2)])
+        with autocast(precision, image.device.type):
+            _, (cams_fix, cams_cod) = engine(image)
+    finally:
+        handle.remove()
+    return cams_fix, cams_cod, tuple(logits)
 
-        # Preprocess image for CODS model
-        image = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
-        image = cv2.resize(image, (224, 224))
-        image = image.transpose((2, 0, 1))
-        image = image / 255.0
-        image = torch.from_numpy(image).float().unsqueeze(0)
 
-        HH, WW = original_image.shape[:2]
+def _scripted_forward_with_gradcams(cods, image):
+    """
+    forward_with_gradcams for an exported Generator. It has no hookable layers,
+    so the Grad-CAM target activations come back as outputs; its weights are
+    constants, so the input requires grad to give them a gradient. Backends
+    without gradients (ONNX Runtime) return no CAMs.
+    """
+    if not cods.supports_gradcam:
+        with torch.no_grad():
+            (fix_pred, _, cod_pred2), logits, _ = cods.forward_features(image)
+        return fix_pred, cod_pred2, None, None, tuple(logits)
+
+    with torch.enable_grad():
+        (fix_pred, _, cod_pred2), logits, activations = cods.forward_features(image.detach().requires_grad_(True))
+
+    target_size = (image.shape[3], image.shape[2])
+    cams = []
+    targets = [("x4", fix_pred), ("x4_2", cod_pred2)]
+    for i, (name, output) in enumerate(targets):
+        try:
+            grads, = torch.autograd.grad(output.sum(), activations[name], retain_graph=i < len(targets) - 1)
+            cams.append(MultiTargetGradCAM._cam(activations[name], grads, target_size))
+        except Exception as e:
+            print(f"[WARN] Grad-CAM for {name} failed: {e}")
+            cams.append(None)
 
-        if torch.cuda.is_available():
-            image = image.cuda()
+    return fix_pred.detach(), cod_pred2.detach(), cams[0], cams[1], tuple(logit.detach() for logit in logits)
+
+
+def tiled_predictions(cods, original_image, record=None):
+    """
+    Full-resolution fixation / COD predictions blended from overlapping tiles of
+    `original_image` (tiled_inference.py).
+
+    Returns (fix_pred, cod_pred2, logits) at the image's own size, the logits
+    before the MICA adjustment as for forward_with_gradcams. Grad-CAM and the
+    offramps stay with the whole-frame forward. Exported models only take 224 px
+    inputs, so other tile sizes run on resource_manager.tile_cods_model.
+    """
+    tile_model = resource_manager.tile_cods_model if isinstance(cods, ExportedGenerator) else cods
+    if isinstance(tile_model, ExportedGenerator):
+        def logits_fn(batch):
+            return tile_model.forward_features(batch)[1]
+    else:
+        precision = resource_manager.cods_precision
+
+        def logits_fn(batch):
+            with autocast(precision, batch.device.type):
+                return tile_model.sal_encoder(batch, INFERENCE_HEADS, native=True)
 
-        # Model forward
-        fix_pred, _, cod_pred2 = cods.forward(image)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    capture = cods.offramp_capture
+    if capture is not None:
+        capture.pause()
+    try:
+        logits, count = tiled_logits(logits_fn, original_image, tile=TILE_SIZE, overlap=TILE_OVERLAP,
+                                     batch_size=TILE_BATCH, device=device)
+    finally:
+        if capture is not None:
+            capture.resume()
 
-        # Resize preds to original dims
-        fix_image = process_prediction(fix_pred, WW, HH)
-        bm_image = process_prediction(cod_pred2, WW, HH)
+    with torch.no_grad():
+        fix_pred, _, cod_pred2 = cods.adjust_logits(logits)
+    if record is not None:
+        record["tiles"] = count
+    return fix_pred, cod_pred2, logits
 
-        # Save raw output maps
-        Image.fromarray(bm_image).convert("L").save(os.path.join(out_dir, "binary_image.png"))
-        Image.fromarray(fix_image).convert("L").save(os.path.join(out_dir, "fixation_image.png"))
 
-        # Grad-CAM
-        target_layer_fix = [cods.get_x4_layer()]
-        grad_cam_fix = MultiOutputGradCAM(model=cods, target_layers=target_layer_fix, output_index=0)
+def cached_forward_with_gradcams(cods, image, image_digest, record=None):
+    """
+    forward_with_gradcams through the "cods" stage cache, keyed by the image pixels
+    and the CODS weights + LoRA adapter checksum.
 
-        target_layer_cod = [cods.get_x4_2_layer()]
-        grad_cam_cod = MultiOutputGradCAM(model=cods, target_layers=target_layer_cod, output_index=2)
+    A hit skips the network: predictions are rebuilt from the cached pre-adjustment
+    logits with cods.adjust_logits (so model-side MICA parameters still apply) and
+    the cached offramp maps are queued for writing.
+    """
+    capture = cods.offramp_capture
+    key = digest("cods", image_digest, resource_manager.cods_checksum)
+    cached = stage_cache.get("cods", key)
+    if cached is not None and capture is not None:
+        if not set(capture.layers) <= set(cached["offramps"] or {}):
+            cached = None
+
+    if cached is None:
+        fix_pred, cod_pred2, cams_fix, cams_cod, logits = forward_with_gradcams(cods, image)
+        stage_cache.put("cods", key, {
+            "logits": tuple(None if logit is None else logit.cpu().numpy() for logit in logits),
+            "cams": (cams_fix, cams_cod),
+            "offramps": capture.last_maps if capture is not None else None,
+        })
+        return fix_pred, cod_pred2, cams_fix, cams_cod, logits
+
+    _note_cache_hit(record, "cods")
+    logits = tuple(None if logit is None else torch.from_numpy(logit).to(image.device) for logit in cached["logits"])
+    with torch.no_grad():
+        fix_pred, _, cod_pred2 = cods.adjust_logits(logits)
+    if capture is not None:
+        capture.submit({name: cached["offramps"][name] for name in capture.layers})
+    cams_fix, cams_cod = cached["cams"]
+    return fix_pred, cod_pred2, cams_fix, cams_cod, logits
+
+
+def finish_decision(file_name, original_image, image, fix_pred, cod_pred2,
+                    grayscale_cam_fix, grayscale_cam_cod, out_dir, mica, record=None, image_digest=None):
+    """
+    Everything after the model forward for one image: save output maps and
+    Grad-CAM overlays, apply MICA thresholding and run the decision hierarchy.
 
-        grayscale_cam_fix = None
-        grayscale_cam_cod = None
+    `image` is the 1x3x224x224 model input, the predictions and CAMs are this
+    image's slice of the (possibly batched) outputs; in tiled mode the
+    predictions are already at the image's size. `image_digest` is
+    digest(original_image) when the caller already has it.
+    """
+    HH, WW = original_image.shape[:2]
 
-        try:
-            grayscale_cam_fix = grad_cam_fix(input_tensor=image)
-        except Exception as e:
-            print(f"[WARN] grad_cam_fix failed: {e}")
+    # Resize preds to original dims (one interpolation from the decoder resolution)
+    input_size = None if TILED_INFERENCE else tuple(image.shape[2:])
+    fix_image = process_prediction(fix_pred, WW, HH, input_size)
+    bm_image = process_prediction(cod_pred2, WW, HH, input_size)
 
-        try:
-            grayscale_cam_cod = grad_cam_cod(input_tensor=image)
-        except Exception as e:
-            print(f"[WARN] grad_cam_cod failed: {e}")
+    # Save raw output maps (encoded and written in the background)
+    output_writer.submit(os.path.join(out_dir, "binary_image.png"),
+                         lambda: encode_pil(Image.fromarray(bm_image).convert("L")))
+    output_writer.submit(os.path.join(out_dir, "fixation_image.png"),
+                         lambda: encode_pil(Image.fromarray(fix_image).convert("L")))
 
+    if grayscale_cam_fix is not None or grayscale_cam_cod is not None:
+        # Only runs with CAMs (not on the ONNX backend) need the normalized input and pytorch_grad_cam
         input_image = image.squeeze(0).permute(1, 2, 0).detach().cpu().numpy()
         denom = (input_image.max() - input_image.min()) + 1e-8
         input_image = (input_image - input_image.min()) / denom
         input_image = input_image.astype(np.float32)
 
-        if grayscale_cam_fix is not None:
-            heatmap_fix = cam_overlay(input_image, grayscale_cam_fix[0], use_rgb=True)
-            cv2.imwrite(os.path.join(out_dir, "gradcam_fix.png"), cv2.cvtColor(heatmap_fix, cv2.COLOR_RGB2BGR))
+        cam_overlay = _lazy_import("pytorch_grad_cam.utils.image").show_cam_on_image
 
-        if grayscale_cam_cod is not None:
-            heatmap_cod = cam_overlay(input_image, grayscale_cam_cod[0], use_rgb=True)
-            cv2.imwrite(os.path.join(out_dir, "gradcam_cod.png"), cv2.cvtColor(heatmap_cod, cv2.COLOR_RGB2BGR))
+    def encode_cam(cam):
+        heatmap = cam_overlay(input_image, cam[0], use_rgb=True)
+        return encode_image(".png", cv2.cvtColor(heatmap, cv2.COLOR_RGB2BGR))
 
-        # MICA thresholding
-        mica = load_mica_params()
-        thresh = compute_binary_threshold(mica_params=mica, base_thresh=0.5)
-        bm_thresh_255 = int(round(255 * thresh))
+    for cam, name in ((grayscale_cam_fix, "gradcam_fix.png"), (grayscale_cam_cod, "gradcam_cod.png")):
+        path = os.path.join(out_dir, name)
+        if cam is not None:
+            output_writer.submit(path, lambda cam=cam: encode_cam(cam))
+        else:
+            # No CAM this run (failed, or a backend without gradients): don't leave an older overlay behind
+            output_writer.remove(path)
+
+    message, _ = threshold_and_decide(file_name, original_image, fix_image, bm_image, out_dir, mica, record,
+                                      image_digest=image_digest)
+    return message
+
+
+def threshold_and_decide(file_name, original_image, fix_image, bm_image, out_dir, mica, record=None,
+                         interactive=False, image_digest=None):
+    """
+    MICA-threshold the uint8 prediction maps, write the segmented overlay and run
+    the decision hierarchy (Levels 1-2 only when `interactive`).
 
-        trans_img = np.transpose(np.where(bm_image > bm_thresh_255, 1, 0))
-        img_np = np.asarray(trans_img, dtype=np.uint8)
+    Returns (message, maps), maps holding the binary mask and the masked, weak
+    and all fixation maps (the last two None when no object is present).
+    """
+    message = f"Decision for {file_name}:\n"
+
+    # MICA thresholding
+    thresh = compute_binary_threshold(mica_params=mica, base_thresh=0.5)
+    bm_thresh_255 = int(round(255 * thresh))
 
-        masked_fix_map = apply_mask(Image.fromarray(fix_image), img_np)
+    # Not cached: the full-resolution maps are cheaper to rebuild through the lookup
+    # tables than to hash for a cache key, and would fill memory at every threshold
+    mask = binary_mask(bm_image, bm_thresh_255)
+    masked_fix_map = apply_mask(fix_image, mask)
 
+    if mask.any():
         weak_fix_map = findAreasOfWeakCamouflage(masked_fix_map)
         all_fix_map = processFixationMap(masked_fix_map)
+    else:
+        # Level 1 stops at "No object present"; skip the colormaps
+        weak_fix_map = all_fix_map = None
+
+    # Segmented overlay: blended and encoded once in the background, written to both places
+    segmented_path = os.path.join("results", f"segmented_{file_name}.jpg")
+    output_writer.submit(
+        [segmented_path, os.path.join(out_dir, "segmented_overlay.jpg")],
+        lambda: encode_image(".jpg", create_segmented_overlay(original_image, fix_image, mask, alpha=0.6)),
+    )
+    print(f"[INFO] Writing segmented output to: {segmented_path}")
+
+    # Run decision hierarchy (now with consolidation)
+    message = levelOne(file_name, mask, all_fix_map, weak_fix_map, original_image, message, mica, record,
+                       interactive, image_digest)
+    maps = {
+        "binary_mask": mask,
+        "masked_fix_map": masked_fix_map,
+        "weak_fix_map": weak_fix_map,
+        "all_fix_map": all_fix_map,
+    }
+    return message, maps
 
-        # Create segmented overlay
-        binary_mask_for_overlay = np.where(bm_image > bm_thresh_255, 1, 0).astype(np.uint8)
-        
-        segmented_output = create_segmented_overlay(
-            original_image=original_image,
-            rank_map=fix_image,
-            binary_mask=binary_mask_for_overlay,
-            alpha=0.6
-        )
-        
-        results_dir = "results"
-        os.makedirs(results_dir, exist_ok=True)
-        segmented_path = os.path.join(results_dir, f"segmented_{file_name}.jpg")
-        cv2.imwrite(segmented_path, segmented_output)
-        print(f"[INFO] Saved segmented output to: {segmented_path}")
 
-        cv2.imwrite(os.path.join(out_dir, "segmented_overlay.jpg"), segmented_output)
+# ================================================================================================
+# MICA re-threshold fast path
+# ================================================================================================
+# Pre-adjustment logits and inputs of the last image run through iaiDecision
+_last_decision = {}
+
+
+def _remember_decision(file_path, file_name, original_image, out_dir, logits, input_size):
+    _last_decision.clear()
+    _last_decision.update(
+        file_path=os.path.abspath(file_path),
+        file_name=file_name,
+        original_image=original_image,
+        out_dir=out_dir,
+        logits=logits,
+        input_size=tuple(input_size) if input_size is not None else None,
+        maps_key=None,
+        maps=None,
+    )
+
+
+def rethreshold(mica_params=None, image_path=None, record=None):
+    """
+    Re-apply MICA parameters to the last image from iaiDecision without re-running the model.
+
+    The cached pre-adjustment logits go through the Generator's own MICA adjustment
+    and the usual thresholding, so Levels 1-2 match a full run with the same
+    parameters; Level 3 and the figures are skipped. The uint8 maps are
+    reused while the model's adjustment parameters are unchanged.
+
+    Returns (message, maps) as threshold_and_decide. Raises LookupError if nothing
+    (or a different image than `image_path`) is cached.
+    """
+    if not _last_decision:
+        raise LookupError("No cached image to re-threshold; run iaiDecision first")
+    if image_path is not None and os.path.abspath(image_path) != _last_decision["file_path"]:
+        raise LookupError(f"Cached image is {_last_decision['file_path']}, not {image_path}")
+
+    start = time.perf_counter()
+    cods = resource_manager.cods_model
+    entry = _last_decision
+    original_image = entry["original_image"]
+    HH, WW = original_image.shape[:2]
+
+    maps_key = (cods.sensitivity, cods.bias)
+    if entry["maps_key"] != maps_key:
+        with torch.no_grad():
+            fix_pred, _, cod_pred2 = cods.adjust_logits(entry["logits"])
+        entry["maps"] = (process_prediction(fix_pred, WW, HH, entry["input_size"]),
+                         process_prediction(cod_pred2, WW, HH, entry["input_size"]))
+        entry["maps_key"] = maps_key
+    fix_image, bm_image = entry["maps"]
+
+    mica = mica_params if mica_params is not None else load_mica_params()
+    message, maps = threshold_and_decide(entry["file_name"], original_image, fix_image, bm_image,
+                                         entry["out_dir"], mica, record, interactive=True)
+    print(f"[INFO] Re-threshold took {time.perf_counter() - start:.3f}s")
+    return message, maps
 
-        # Run decision hierarchy (now with consolidation)
-        output = levelOne(file_name, img_np, all_fix_map, weak_fix_map, original_image, message, mica)
 
+# ================================================================================================
+# Main IAI entry point
+# ================================================================================================
+def iaiDecision(file_path, output_root=None, force_reload=False, mica_params=None, record=None,
+                cods_backend=None, precision=None):
+    """
+    Run the full hierarchy on one image and return the decision message.
+
+    The EfficientDet detector is only loaded if Level 2 finds a weak area. Pass a
+    dict as `record` to get back which levels ran (levels_run, early_exit,
+    level_seconds) and the per-level counts; if the run fails, the message
+    starts with "Error occurred" and record["error"] holds the exception's.
+    `cods_backend` (one of CODS_BACKENDS) and `precision` (one of PRECISIONS)
+    switch how the Generator runs from this call on.
+    """
+    global CODS_BACKEND, CODS_PRECISION
+    try:
+        if cods_backend is not None:
+            if cods_backend not in CODS_BACKENDS:
+                raise ValueError(f"Unknown CODS backend '{cods_backend}' (expected one of {', '.join(CODS_BACKENDS)})")
+            CODS_BACKEND = cods_backend
+        if precision is not None:
+            if precision not in PRECISIONS:
+                raise ValueError(f"Unknown precision '{precision}' (expected one of {', '.join(PRECISIONS)})")
+            CODS_PRECISION = precision
+
+        if force_reload:
+            resource_manager.clear_cache()
+
+        resource_manager.ensure_output_dirs()
+
+        cods = resource_manager.cods_model
+        if record is None:
+            record = {}
+
+        file_name = os.path.splitext(os.path.basename(file_path))[0]
+
+        # Output directory per image
+        out_dir = output_dir_for(file_name, output_root)
+
+        original_image = cv2.imread(file_path)
+        if original_image is None:
+            raise ValueError(f"Unable to load image from path: {file_path}")
+
+        # Preprocess image for CODS model
+        image = preprocess_image(original_image)
+
+        if torch.cuda.is_available():
+            image = image.cuda()
+
+        # Model forward + Grad-CAM (or their cached results for these pixels and weights)
+        image_digest = digest(original_image)
+        fix_pred, cod_pred2, grayscale_cam_fix, grayscale_cam_cod, logits = cached_forward_with_gradcams(
+            cods, image, image_digest, record)
+        if TILED_INFERENCE:
+            # Maps from native-resolution tiles; the 224 px forward above still gives the Grad-CAMs
+            fix_pred, cod_pred2, logits = tiled_predictions(cods, original_image, record)
+        _remember_decision(file_path, file_name, original_image, out_dir, logits,
+                           None if TILED_INFERENCE else image.shape[2:])
+
+        mica = mica_params if mica_params is not None else load_mica_params()
+
+        output = finish_decision(file_name, original_image, image, fix_pred, cod_pred2,
+                                 grayscale_cam_fix, grayscale_cam_cod, out_dir, mica, record, image_digest)
+
+        # Offramp PNGs are written in the background; make sure they are on disk before returning
+        if cods.offramp_capture is not None:
+            cods.offramp_capture.flush()
+        print(f"[INFO] Levels run: {record.get('levels_run')} (early exit: {record.get('early_exit', 'none')})")
         return output
 
     except Exception as e:
         error_message = f"An error occurred: {str(e)}\nTraceback:\n{traceback.format_exc()}"
         print(error_message)
+        if record is not None:
+            record["error"] = str(e)
         return f"Error occurred: {str(e)}"
 
 
+# ================================================================================================
+# Batch / directory entry point
+# ================================================================================================
+def collect_image_paths(source):
+    """
+    Resolve a batch source into an ordered list of image paths.
+
+    - directory: every image file directly inside it (sorted)
+    - manifest (.txt/.lst/.csv): one path per line (first CSV column), '#' comments
+      allowed, relative paths resolved against the manifest's folder
+    - anything else: treated as a glob pattern
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, f) for f in os.listdir(source)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    if os.path.isfile(source) and source.lower().endswith(MANIFEST_EXTENSIONS):
+        base_dir = os.path.dirname(os.path.abspath(source))
+        paths = []
+        with open(source, "r") as f:
+            for line in f:
+                entry = line.strip().split(",")[0].strip()
+                if not entry or entry.startswith("#"):
+                    continue
+                if not entry.lower().endswith(IMAGE_EXTENSIONS):
+                    continue  # header row or non-image entry
+                if not os.path.isabs(entry) and not os.path.exists(entry):
+                    entry = os.path.join(base_dir, entry)
+                paths.append(entry)
+        return paths
+
+    return sorted(p for p in glob.glob(source) if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def output_names(image_paths):
+    """
+    Output name for each of `image_paths`: its file name without extension, or,
+    for the second and later paths sharing one (same name in another folder, or
+    another extension), that name with a _2, _3, ... suffix no other image has,
+    so their outputs don't overwrite each other.
+    """
+    stems = [os.path.splitext(os.path.basename(p))[0] for p in image_paths]
+    taken = set(stems)
+    seen = set()
+    names = []
+    for file_path, stem in zip(image_paths, stems):
+        name = stem
+        if stem in seen:
+            n = 2
+            while f"{stem}_{n}" in taken:
+                n += 1
+            name = f"{stem}_{n}"
+            taken.add(name)
+            print(f"[WARN] Another image is already named '{stem}'; outputs for {file_path} go to '{name}'")
+        seen.add(stem)
+        names.append(name)
+    return names
+
+
+def _summary_row(file_path, file_name, record, status, seconds, error=""):
+    return {
+        "image": file_name,
+        "path": file_path,
+        "status": status,
+        "object_present": record.get("object_present", ""),
+        "num_weak_areas": record.get("num_weak_areas", ""),
+        "num_detections": record.get("num_detections", ""),
+        "levels_run": "-".join(str(level) for level in record.get("levels_run", [])),
+        "early_exit": record.get("early_exit", ""),
+        "seconds": round(seconds, 3),
+        "error": error,
+    }
+
+
+def iaiDecisionBatch(source, output_root=None, batch_size=8, mica_params=None, summary_path=None):
+    """
+    Run the decision hierarchy over a directory, glob or manifest of images.
+
+    Preprocessed inputs are stacked into Nx3x224x224 batches for one CODS forward
+    and Grad-CAM from that same forward; each image then goes through the regular
+    per-image post-processing, so outputs land in the usual outputs/<name> layout.
+    Images sharing a file name get a numbered suffix (see output_names). A summary
+    row per image is written to <output_root or outputs>/batch_summary.csv.
+
+    Returns the list of summary rows.
+    """
+    image_paths = collect_image_paths(source)
+    if not image_paths:
+        raise ValueError(f"No images found for batch source: {source}")
+
+    resource_manager.ensure_output_dirs()
+    cods = resource_manager.cods_model
+
+    mica = mica_params if mica_params is not None else load_mica_params()
+    batch_size = max(1, int(batch_size))
+    rows = []
+
+    print(f"[INFO] Batch: {len(image_paths)} image(s), batch size {batch_size}")
+    items = list(zip(image_paths, output_names(image_paths)))
+
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+
+        # Load + preprocess; unreadable files get an error row and are left out of the forward
+        loaded = []
+        for file_path, file_name in chunk:
+            original_image = cv2.imread(file_path)
+            if original_image is None:
+                loaded.append((file_path, file_name, None, None))
+            else:
+                loaded.append((file_path, file_name, original_image, preprocess_image(original_image)))
+
+        batch_items = [item for item in loaded if item[2] is not None]
+        if batch_items:
+            batch_start = time.perf_counter()
+            try:
+                images = torch.cat([item[3] for item in batch_items], dim=0)
+                if torch.cuda.is_available():
+                    images = images.cuda()
+
+                fix_preds, cod_preds, cams_fix, cams_cod, _ = forward_with_gradcams(cods, images)
+            except Exception as e:
+                # A failed forward (out of memory, a bad input) fails this chunk only
+                traceback.print_exc()
+                for file_path, file_name, original_image, _ in loaded:
+                    error = str(e) if original_image is not None else f"Unable to load image from path: {file_path}"
+                    rows.append(_summary_row(file_path, file_name, {}, "error", 0.0, error))
+                continue
+            shared_seconds = (time.perf_counter() - batch_start) / len(batch_items)
+
+        i = 0
+        for file_path, file_name, original_image, _ in loaded:
+            if original_image is None:
+                rows.append(_summary_row(file_path, file_name, {}, "error", 0.0,
+                                         f"Unable to load image from path: {file_path}"))
+                continue
+
+            record = {}
+            image_start = time.perf_counter()
+            try:
+                out_dir = output_dir_for(file_name, output_root)
+                if TILED_INFERENCE:
+                    fix_pred, cod_pred, _ = tiled_predictions(cods, original_image, record)
+                else:
+                    fix_pred, cod_pred = fix_preds[i:i + 1], cod_preds[i:i + 1]
+                message = finish_decision(
+                    file_name, original_image, images[i:i + 1], fix_pred, cod_pred,
+                    cams_fix[i:i + 1] if cams_fix is not None else None,
+                    cams_cod[i:i + 1] if cams_cod is not None else None,
+                    out_dir, mica, record,
+                )
+                print(message)
+                status, error = "ok", ""
+            except Exception as e:
+                traceback.print_exc()
+                status, error = "error", str(e)
+            i += 1
+
+            seconds = shared_seconds + (time.perf_counter() - image_start)
+            rows.append(_summary_row(file_path, file_name, record, status, seconds, error))
+
+    if cods.offramp_capture is not None:
+        cods.offramp_capture.flush()
+    write_errors = flush_outputs()
+    if write_errors:
+        print(f"[ERROR] {len(write_errors)} output file(s) could not be written")
+
+    if summary_path is None:
+        summary_path = os.path.join(output_root or "outputs", "batch_summary.csv")
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+    with open(summary_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    failed = sum(1 for r in rows if r["status"] != "ok")
+    print(f"[INFO] Batch done: {len(rows) - failed} ok, {failed} failed. Summary: {summary_path}")
+    return rows
+
+
 # ================================================================================================
 # Optional utilities
 # ================================================================================================
 def preload_resources():
     _ = resource_manager.cods_model
-    _ = resource_manager.detect_fn
+    _ = resource_manager.detector
     _ = resource_manager.RdBl
     _ = resource_manager.blGrRdBl
     resource_manager.ensure_output_dirs()
@@ -903,6 +1683,156 @@ def preload_resources():
 
 def clear_resources():
     resource_manager.clear_cache()
+    stage_cache.clear(memory_only=True)
+    _last_decision.clear()
+
+
+# ================================================================================================
+# Persistent inference server
+# ================================================================================================
+def _request_mica_params(request):
+    """MICA params carried by a request, or None to fall back to mica_params.json."""
+    if "sensitivity" not in request and "bias" not in request:
+        return None
+    return {
+        "sensitivity": float(request.get("sensitivity", 1.5)),
+        "bias": float(request.get("bias", 0.0)),
+    }
+
+
+def _decision_response(result, record):
+    """Response body for an iaiDecision / rethreshold result; not ok if the run failed."""
+    if "error" in record:
+        return {"ok": False, "error": record["error"], "result": result, "record": record}
+    return {"ok": True, "result": result, "record": record}
+
+
+def _handle_request(request):
+    """Dispatch one server request and return the JSON-serializable response body."""
+    command = request.get("command", "run")
+
+    if command == "ping":
+        return {"ok": True, "result": "pong"}
+
+    if command == "clear":
+        clear_resources()
+        return {"ok": True, "result": "cleared"}
+
+    if command == "flush":
+        write_errors = flush_outputs()
+        return {"ok": not write_errors, "result": "flushed", "write_errors": write_errors}
+
+    if command == "run":
+        image_path = request.get("image_path")
+        if not image_path:
+            return {"ok": False, "error": "Missing 'image_path'"}
+
+        record = {}
+        result = iaiDecision(
+            image_path,
+            output_root=request.get("output_dir"),
+            force_reload=bool(request.get("force_reload", False)),
+            mica_params=_request_mica_params(request),
+            record=record,
+            cods_backend=request.get("cods_backend"),
+            precision=request.get("precision"),
+        )
+        return _decision_response(result, record)
+
+    if command == "rethreshold":
+        image_path = request.get("image_path")
+        mica_params = _request_mica_params(request)
+        record = {}
+        try:
+            result, _ = rethreshold(mica_params=mica_params, image_path=image_path, record=record)
+            record["rethreshold"] = True
+        except LookupError:
+            # Nothing cached for this image (new image, or the server restarted): do a full run
+            if not image_path:
+                return {"ok": False, "error": "No cached image to re-threshold and no 'image_path' given"}
+            result = iaiDecision(image_path, output_root=request.get("output_dir"),
+                                 mica_params=mica_params, record=record)
+            record["rethreshold"] = False
+        return _decision_response(result, record)
+
+    if command == "batch":
+        source = request.get("source")
+        if not source:
+            return {"ok": False, "error": "Missing 'source'"}
+
+        rows = iaiDecisionBatch(
+            source,
+            output_root=request.get("output_dir"),
+            batch_size=int(request.get("batch_size", 8)),
+            mica_params=_request_mica_params(request),
+        )
+        return {"ok": True, "result": rows}
+
+    return {"ok": False, "error": f"Unknown command: {command}"}
+
+
+def serve(stream_in=None, stream_out=None, startup_report=False):
+    """
+    Long-lived server mode: keeps resource_manager warm and answers requests
+    one JSON object per line.
+
+    Request:  {"id": 1, "command": "run", "image_path": "...", "sensitivity": 1.5, "bias": 0.0}
+              {"id": 2, "command": "batch", "source": "<dir|glob|manifest>", "batch_size": 8}
+              {"id": 3, "command": "rethreshold", "image_path": "...", "sensitivity": 2.0, "bias": 0.5}
+    Commands: run (default), rethreshold, batch, ping, clear, flush, shutdown
+    Response: {"id": 1, "ok": true, "result": "<decision message>", "elapsed": 0.84}
+
+    Output files are written in the background. By default a response is only
+    sent once the request's files are on disk (failed writes are listed under
+    "write_errors"); with "wait_outputs": false it is sent as soon as the
+    decision is made, and a later "flush" request waits for the files.
+
+    stdout is reserved for protocol lines; everything the pipeline prints is
+    redirected to stderr while a request is being handled.
+    """
+    stream_in = stream_in or sys.stdin
+    stream_out = stream_out or sys.stdout
+
+    def send(payload):
+        stream_out.write(json.dumps(payload) + "\n")
+        stream_out.flush()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        preload_resources()
+    if startup_report:
+        print(startup_profile.report(), file=sys.stderr)
+    send({"event": "ready", "load_time": round(time.perf_counter() - start, 3)})
+
+    for line in stream_in:
+        line = line.strip()
+        if not line:
+            continue
+
+        request_id = None
+        start = time.perf_counter()
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if request.get("command") == "shutdown":
+                send({"id": request_id, "ok": True, "result": "shutdown"})
+                break
+
+            with contextlib.redirect_stdout(sys.stderr):
+                response = _handle_request(request)
+                if request.get("wait_outputs", True):
+                    write_errors = flush_outputs()
+                    if write_errors:
+                        response["write_errors"] = write_errors
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            response = {"ok": False, "error": str(e)}
+
+        response["id"] = request_id
+        response["elapsed"] = round(time.perf_counter() - start, 3)
+        send(response)
+
+    flush_outputs()
 
 
 # ================================================================================================
@@ -912,42 +1842,146 @@ def parse_args(argv):
     """
     Usage:
       python IAI_Decision_Hierarchy.py <image_path> [output_dir] [--force-reload] [--clear]
+                                       [--sensitivity S] [--bias B]
+      python IAI_Decision_Hierarchy.py --batch <dir|glob|manifest> [--output-dir DIR] [--batch-size N]
+      python IAI_Decision_Hierarchy.py --serve
+    Add --startup-profile to any mode to report import/model-load times on stderr,
+    and --offramp [x1,x2,...] to write intermediate feature maps to offramp_output_images/.
     """
-    if len(argv) < 2:
+    parser = argparse.ArgumentParser(description="CODS XAI decision hierarchy")
+    parser.add_argument("image_path", nargs="?", help="Image to run the decision hierarchy on")
+    parser.add_argument("output_dir", nargs="?", default=None, help="Root for per-image output folders")
+    parser.add_argument("--force-reload", action="store_true", help="Reload models before running")
+    parser.add_argument("--clear", action="store_true", help="Release models after running")
+    parser.add_argument("--sensitivity", type=float, default=None, help="MICA sensitivity (d')")
+    parser.add_argument("--bias", type=float, default=None, help="MICA response bias (beta)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Keep models loaded and answer JSON-line requests on stdin/stdout")
+    parser.add_argument("--batch", metavar="SOURCE", default=None,
+                        help="Directory, glob pattern or manifest file of images to process")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per CODS forward in batch mode")
+    parser.add_argument("--summary", default=None, help="Batch summary CSV path")
+    parser.add_argument("--output-dir", dest="output_root", default=None,
+                        help="Root for per-image output folders (same as the positional output_dir)")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="Print where cold-start time went (imports, model loads) to stderr")
+    parser.add_argument("--min-weak-area", type=int, default=0, metavar="PIXELS",
+                        help="Ignore weak camouflage areas smaller than this (default keeps all)")
+    parser.add_argument("--detector-backend", choices=["saved_model", "xla", "tflite"], default="saved_model",
+                        help="How EfficientDet D7 is executed (xla/tflite need 'python detector_backend.py convert')")
+    parser.add_argument("--detector-threads", type=int, default=None,
+                        help="CPU threads for the detector (overrides the execution profile)")
+    parser.add_argument("--profile", default=None, metavar="NAME",
+                        help="Execution profile (thread pools, channels_last, denormals) from "
+                             "execution_profile.py; default is the active one ('python execution_profile.py show')")
+    parser.add_argument("--cods-backend", choices=CODS_BACKENDS, default="auto",
+                        help="How the CODS Generator runs: frozen TorchScript if exported (auto), eager, "
+                             "INT8 on CPU (needs 'python quantize_cods.py') or ONNX Runtime on CPU "
+                             "(needs 'python cods_onnx.py export'; no Grad-CAM overlays)")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="fp32",
+                        help="Autocast precision of the CODS forward (bf16 needs AVX512-BF16/AMX on CPU; "
+                             "falls back to fp32 where unsupported). Grad-CAM is computed in fp32")
+    parser.add_argument("--eager-cods", dest="cods_backend", action="store_const", const="eager",
+                        help="Same as --cods-backend eager")
+    parser.add_argument("--int8", dest="cods_backend", action="store_const", const="int8",
+                        help="Same as --cods-backend int8")
+    parser.add_argument("--tiled", action="store_true",
+                        help="Build full-resolution CODS maps from overlapping native-resolution tiles "
+                             "(for large images with small targets)")
+    parser.add_argument("--tile-size", type=int, default=224,
+                        help=f"Tile size in pixels for --tiled (a multiple of {TILE_MULTIPLE})")
+    parser.add_argument("--tile-overlap", type=float, default=0.25,
+                        help="Fraction of each tile shared with its neighbours for --tiled")
+    parser.add_argument("--tile-batch", type=int, default=8, help="Tiles per CODS forward for --tiled")
+    parser.add_argument("--writer-threads", type=int, default=2,
+                        help="Background threads encoding and writing the output files")
+    parser.add_argument("--max-pending-writes", type=int, default=16,
+                        help="Output files queued before the pipeline waits for the writer")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Recompute every stage instead of reusing cached results")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Also keep stage results on disk in this directory, across runs "
+                             "(default: memory only)")
+    parser.add_argument("--offramp", metavar="LAYERS", nargs="?", const="all", default=None,
+                        help="Write intermediate feature maps; optional comma-separated layer names "
+                             "(x1,x2,x3,x4,x2_2,x3_2,x4_2,ref_pred). Off by default")
+    args = parser.parse_args(argv[1:])
+
+    args.output_dir = args.output_root or args.output_dir
+    if args.tile_size <= 0 or args.tile_size % TILE_MULTIPLE:
+        parser.error(f"--tile-size must be a positive multiple of {TILE_MULTIPLE} (got {args.tile_size})")
+    if args.offramp is None:
+        args.offramp_layers = False
+    elif args.offramp == "all":
+        args.offramp_layers = None
+    else:
+        args.offramp_layers = [name.strip() for name in args.offramp.split(",") if name.strip()]
+    if not args.serve and args.batch is None and args.image_path is None:
         return None
-
-    image_path = argv[1]
-    output_dir = None
-    force_reload = False
-    do_clear = False
-
-    if len(argv) >= 3 and not argv[2].startswith("--"):
-        output_dir = argv[2]
-
-    for a in argv[2:]:
-        if a == "--force-reload":
-            force_reload = True
-        if a == "--clear":
-            do_clear = True
-
-    return image_path, output_dir, force_reload, do_clear
+    return args
 
 
 if __name__ == "__main__":
-    parsed = parse_args(sys.argv)
-    if parsed is None:
+    args = parse_args(sys.argv)
+    if args is None:
         print("Error: Missing required arguments. Usage: python script.py <image_path> [output_dir] [--force-reload] [--clear]",
               file=sys.stderr)
         sys.exit(1)
 
-    image_path, output_dir, force_reload, do_clear = parsed
-
+    resource_manager.configure_offramp(args.offramp_layers)
+    stage_cache.enabled = not args.no_cache
+    WEAK_AREA_MIN_AREA = args.min_weak_area
+    DETECTOR_BACKEND = args.detector_backend
+    DETECTOR_THREADS = args.detector_threads
+    EXECUTION_PROFILE = args.profile
+    TILED_INFERENCE = args.tiled
+    TILE_SIZE = args.tile_size
+    TILE_OVERLAP = args.tile_overlap
+    TILE_BATCH = args.tile_batch
+    CODS_BACKEND = args.cods_backend
+    CODS_PRECISION = args.precision
+    output_writer.workers = max(1, args.writer_threads)
+    output_writer.max_pending = max(1, args.max_pending_writes)
+    if args.cache_dir:
+        stage_cache.root = args.cache_dir
+
+    if args.serve:
+        try:
+            serve(startup_report=args.startup_profile)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            clear_resources()
+        sys.exit(0)
+
+    mica_params = None
+    if args.sensitivity is not None or args.bias is not None:
+        defaults = load_mica_params()
+        mica_params = {
+            "sensitivity": args.sensitivity if args.sensitivity is not None else defaults["sensitivity"],
+            "bias": args.bias if args.bias is not None else defaults["bias"],
+        }
+
+    write_errors = []
     try:
-        final_result = iaiDecision(image_path, output_root=output_dir, force_reload=force_reload)
-        print(final_result)
+        if args.batch is not None:
+            iaiDecisionBatch(args.batch, output_root=args.output_dir, batch_size=args.batch_size,
+                             mica_params=mica_params, summary_path=args.summary)
+        else:
+            final_result = iaiDecision(args.image_path, output_root=args.output_dir,
+                                       force_reload=args.force_reload, mica_params=mica_params)
+            print(final_result)
+            sys.stdout.flush()
     except Exception:
         traceback.print_exc(file=sys.stderr)
         sys.exit(1)
     finally:
-        if do_clear:
-            clear_resources()
\ No newline at end of file
+        # The decision is out; wait for its files before the process (and its writer threads) exits
+        write_errors = flush_outputs()
+        if args.startup_profile:
+            print(startup_profile.report(), file=sys.stderr)
+        if args.clear:
+            clear_resources()
+
+    if write_errors:
+        sys.exit(1)
@@ -0,0 +1,288 @@
+"""
+cods_export.py - Frozen TorchScript export of the CODS Generator for inference
+
+Traces the Generator (with any LoRA adapters applied) into an inference-only
+TorchScript module and freezes it: weights become constants, BatchNorm is
+folded into the preceding convolutions, and the per-layer Python dispatch,
+the MICA adjustment and the final upsampling run as one graph. The MICA
+sensitivity / bias are tensor inputs, so one artifact serves every setting.
+
+The frozen graph still supports Grad-CAM: forward_features also returns the
+layer4_1 / layer4_2 activations, and gradients reach them when the input
+requires grad. The offramp maps (channel means of OFFRAMP_LAYERS) come back
+as outputs too, since the traced graph has no hooks.
+
+Export, then check parity and latency against the eager model:
+    python cods_export.py export
+    python cods_export.py check images/*.jpg
+
+Integration in IAI_Decision_Hierarchy.py _load_cods_model():
+    from cods_export import load_scripted_generator
+    cods = load_scripted_generator(checksum, device)   # None if missing or stale
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from model.offramp_capture import OFFRAMP_LAYERS, OfframpCapture
+
+
+SCRIPTED_MODEL_PATH = "./models/Resnet/Model_50_gen.frozen.pt"
+INPUT_SIZE = 224
+
+
+# ============================================================================
+# Exported module
+# ============================================================================
+
+class InferenceGenerator(nn.Module):
+    """Generator forward with MICA parameters as inputs; the module that gets traced."""
+
+    def __init__(self, generator):
+        super().__init__()
+        self.sal_encoder = generator.sal_encoder
+
+    def forward(self, x, sensitivity, bias):
+        """(fix_pred, init_pred, ref_pred), MICA-adjusted and upsampled to the input size."""
+        return self.forward_features(x, sensitivity, bias)[0]
+
+    def forward_features(self, x, sensitivity, bias):
+        """
+        Returns (preds, logits, activations, offramps):
+        preds as forward, logits the encoder outputs before the MICA adjustment
+        at the decoders' native (1/4) resolution,
+        activations the Grad-CAM target layers {"x4", "x4_2"}, offramps the
+        channel-averaged map of the first batch item per OFFRAMP_LAYERS name.
+        """
+        fix_pred, init_pred, ref_pred, features = self.sal_encoder.forward_features(x, native=True)
+        logits = (fix_pred, init_pred, ref_pred)
+
+        # Same arithmetic as Generator.adjust_logits: one upsampling, straight to the input size
+        scale = sensitivity / 1.5
+        shift = torch.sigmoid(bias * 0.2) - 0.5
+        size = (x.shape[2], x.shape[3])
+        preds = tuple(F.interpolate(logit * scale + shift, size=size, mode="bilinear", align_corners=True)
+                      for logit in logits)
+
+        activations = {"x4": features["x4"], "x4_2": features["x4_2"]}
+        offramps = {name: features[name][0].float().mean(dim=0) for name in OFFRAMP_LAYERS}
+        return preds, logits, activations, offramps
+
+
+def trace_generator(cods, device=None):
+    """Trace `cods` (an eval-mode Generator) on a 1x3x224x224 input and freeze it."""
+    device = device or next(cods.parameters()).device
+    cods.disable_offramp_capture()
+    module = InferenceGenerator(cods).eval()
+
+    example = (torch.rand(1, 3, INPUT_SIZE, INPUT_SIZE, device=device),
+               torch.tensor(1.5, device=device), torch.tensor(0.0, device=device))
+    with torch.no_grad():
+        traced = torch.jit.trace_module(module, {"forward": example, "forward_features": example}, strict=False)
+    return torch.jit.freeze(traced, preserved_attrs=["forward_features"])
+
+
+def export_generator(cods, checksum, path=SCRIPTED_MODEL_PATH, device=None):
+    """
+    trace_generator() and save the result to `path` with `checksum` (weights +
+    adapter) recorded for staleness checks.
+    """
+    frozen = trace_generator(cods, device)
+    torch.jit.save(frozen, path, _extra_files={"source_checksum": checksum})
+    print(f"[INFO] Frozen TorchScript Generator written to {path}")
+    return frozen
+
+
+# ============================================================================
+# Loading
+# ============================================================================
+
+class ExportedGenerator:
+    """
+    Stands in for Generator where IAI_Decision_Hierarchy uses it (MICA parameters,
+    adjust_logits, offramp capture) for an exported model; subclasses run it.
+    """
+
+    # Whether forward_features can give Grad-CAM gradients
+    supports_gradcam = True
+
+    def __init__(self, device):
+        self.device = device
+        self.current_filename = ""
+        self.offramp_capture = None
+        self.sensitivity = 1.5
+        self.bias = 0.0
+
+    def set_mica_parameters(self, sensitivity, bias):
+        self.sensitivity = sensitivity
+        self.bias = bias
+
+    def _mica_inputs(self):
+        return (torch.tensor(float(self.sensitivity), device=self.device),
+                torch.tensor(float(self.bias), device=self.device))
+
+    def _publish_offramps(self, offramps):
+        capture = self.offramp_capture
+        if capture is not None and capture.enabled:
+            capture.publish({name: offramps[name].detach().cpu().numpy() for name in capture.layers})
+
+    def adjust_logits(self, logits, size=None):
+        """Generator.adjust_logits for cached encoder logits (size=None keeps their resolution)."""
+        sensitivity, bias = self._mica_inputs()
+        shift = torch.sigmoid(bias * 0.2) - 0.5
+        preds = []
+        for logit in logits:
+            pred = None if logit is None else logit * (sensitivity / 1.5) + shift
+            if pred is not None and size is not None:
+                pred = F.interpolate(pred, size=size, mode="bilinear", align_corners=True)
+            preds.append(pred)
+        return tuple(preds)
+
+    def enable_offramp_capture(self, layers=None, output_root="offramp_output_images"):
+        self.disable_offramp_capture()
+        self.offramp_capture = OfframpCapture(self, layers=layers, output_root=output_root, attach=False)
+        return self.offramp_capture
+
+    def disable_offramp_capture(self):
+        if self.offramp_capture is not None:
+            self.offramp_capture.close()
+            self.offramp_capture = None
+
+
+class ScriptedGenerator(ExportedGenerator):
+    """ExportedGenerator backed by the frozen TorchScript module."""
+
+    def __init__(self, module, device):
+        super().__init__(device)
+        self.module = module
+
+    def __call__(self, x):
+        return self.module(x, *self._mica_inputs())
+
+    def forward_features(self, x):
+        """(preds, logits, activations) from one forward; offramp maps go to the capture, if enabled."""
+        preds, logits, activations, offramps = self.module.forward_features(x, *self._mica_inputs())
+        self._publish_offramps(offramps)
+        return preds, logits, activations
+
+
+def load_scripted_generator(checksum, device, path=SCRIPTED_MODEL_PATH):
+    """The exported Generator as a ScriptedGenerator, or None if it is missing or was built from other weights."""
+    if not os.path.exists(path):
+        return None
+
+    extra_files = {"source_checksum": ""}
+    module = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    source_checksum = extra_files["source_checksum"]
+    if isinstance(source_checksum, bytes):
+        source_checksum = source_checksum.decode()
+    if source_checksum != checksum:
+        print(f"[WARN] {path} was exported from other weights or LoRA adapters; using the eager model. "
+              f"Re-run 'python cods_export.py export' to refresh it.")
+        return None
+
+    print(f"[INFO] Using frozen TorchScript Generator {path}")
+    return ScriptedGenerator(module, device)
+
+
+# ============================================================================
+# Parity and latency check
+# ============================================================================
+
+def _latency(fn, x, runs):
+    with torch.no_grad():
+        fn(x)  # warm-up (TorchScript profiling runs optimise on the first calls)
+        fn(x)
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn(x)
+    return (time.perf_counter() - start) / runs
+
+
+def check(eager, scripted, inputs, runs=10, tolerance=1e-3):
+    """
+    Compare predictions and Grad-CAM target gradients of `scripted` against `eager`
+    on each input (1x3xHxW tensors) and time both; return True if every
+    prediction is within `tolerance`.
+    """
+    passed = True
+    print(f"{'input':<8}{'fix':>11}{'init':>11}{'ref':>11}{'grad x4':>11}{'grad x4_2':>11}")
+    for i, x in enumerate(inputs):
+        activations = {}
+        handles = [eager.get_x4_layer().register_forward_hook(lambda m, a, out: activations.__setitem__("x4", out)),
+                   eager.get_x4_2_layer().register_forward_hook(lambda m, a, out: activations.__setitem__("x4_2", out))]
+        try:
+            with torch.enable_grad():
+                eager_preds = eager(x)
+        finally:
+            for handle in handles:
+                handle.remove()
+        eager_grads = [torch.autograd.grad(eager_preds[0].sum(), activations["x4"], retain_graph=True)[0],
+                       torch.autograd.grad(eager_preds[2].sum(), activations["x4_2"])[0]]
+
+        with torch.enable_grad():
+            preds, _, scripted_acts = scripted.forward_features(x.detach().requires_grad_(True))
+        scripted_grads = [torch.autograd.grad(preds[0].sum(), scripted_acts["x4"], retain_graph=True)[0],
+                          torch.autograd.grad(preds[2].sum(), scripted_acts["x4_2"])[0]]
+
+        pred_diffs = [float((a.detach() - b.detach()).abs().max()) for a, b in zip(eager_preds, preds)]
+        grad_diffs = [float((a - b).abs().max() / (a.abs().max() + 1e-12)) for a, b in zip(eager_grads, scripted_grads)]
+        passed &= max(pred_diffs) <= tolerance
+        print(f"{i:<8}" + "".join(f"{d:>11.2e}" for d in pred_diffs + grad_diffs)
+              + ("" if max(pred_diffs) <= tolerance else "  FAIL"))
+
+    x = inputs[0]
+    eager_time = _latency(eager, x, runs)
+    scripted_time = _latency(scripted, x, runs)
+    print(f"[INFO] Latency (batch 1): eager {eager_time * 1e3:.1f} ms, frozen TorchScript {scripted_time * 1e3:.1f} ms "
+          f"({eager_time / scripted_time:.2f}x)")
+    print(f"[INFO] Parity {'passed' if passed else 'FAILED'} (max abs prediction difference <= {tolerance}; "
+          f"gradient differences are relative)")
+    return passed
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the CODS Generator as a frozen TorchScript module")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Trace, freeze and save the Generator")
+    export.add_argument("--output", default=SCRIPTED_MODEL_PATH)
+    checker = sub.add_parser("check", help="Compare the exported module with the eager model (parity + latency)")
+    checker.add_argument("images", nargs="*", help="Images to compare on (random inputs if none)")
+    checker.add_argument("--model", default=SCRIPTED_MODEL_PATH)
+    checker.add_argument("--runs", type=int, default=10, help="Timed runs per model")
+    args = parser.parse_args(argv)
+
+    # Builds the eager model exactly as the pipeline does (checkpoint + LoRA adapters)
+    from IAI_Decision_Hierarchy import resource_manager, preprocess_image
+    eager, checksum = resource_manager.load_eager_cods_model()
+    device = next(eager.parameters()).device
+
+    if args.command == "export":
+        export_generator(eager, checksum, path=args.output, device=device)
+        return 0
+
+    scripted = load_scripted_generator(checksum, device, path=args.model)
+    if scripted is None:
+        print(f"[ERROR] No up-to-date export at {args.model}; run 'python cods_export.py export' first")
+        return 1
+
+    import cv2
+    if args.images:
+        inputs = [preprocess_image(cv2.imread(path)).to(device) for path in args.images]
+    else:
+        inputs = [torch.rand(1, 3, INPUT_SIZE, INPUT_SIZE, device=device) for _ in range(3)]
+    return 0 if check(eager, scripted, inputs, runs=args.runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+cods_onnx.py - ONNX export and ONNX Runtime CPU backend for the CODS Generator
+
+Exports the Generator (with LoRA adapters applied) to ONNX with inputs
+image [N, 3, 224, 224], sensitivity [] and bias [] and outputs
+
+    fix_pred, cod_pred1, cod_pred2      MICA-adjusted, upsampled predictions
+    logit_fix, logit_init, logit_ref    encoder outputs before the adjustment
+    offramp_<name>                      channel-mean maps (first batch item)
+
+and runs it with ONNX Runtime on the CPU (all graph optimizations, optional
+thread count). The same .onnx file can later be loaded in-process from C#
+through Microsoft.ML.OnnxRuntime.
+
+ONNX Runtime has no gradients, so this backend gives predictions, logits and
+offramps but no Grad-CAM overlays. onnxruntime (and onnx for the export) are
+optional dependencies, only imported here.
+
+    python cods_onnx.py export
+    python cods_onnx.py check images/*.jpg
+    python cods_onnx.py bench --batch-sizes 1 2 4 8 16
+
+Integration in IAI_Decision_Hierarchy.py _load_cods_model() (--cods-backend onnx):
+    from cods_onnx import load_onnx_generator
+    cods = load_onnx_generator(checksum)   # None if missing, stale or onnxruntime absent
+"""
+
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from cods_export import ExportedGenerator, InferenceGenerator, INPUT_SIZE
+from model.offramp_capture import OFFRAMP_LAYERS
+
+
+ONNX_MODEL_PATH = "./models/Resnet/Model_50_gen.onnx"
+OPSET = 17
+PRED_NAMES = ("fix_pred", "cod_pred1", "cod_pred2")
+LOGIT_NAMES = ("logit_fix", "logit_init", "logit_ref")
+OFFRAMP_NAMES = tuple(f"offramp_{name}" for name in OFFRAMP_LAYERS)
+
+
+# ============================================================================
+# Export
+# ============================================================================
+
+class _OnnxGraph(nn.Module):
+    """InferenceGenerator.forward_features flattened to a tuple of tensors for torch.onnx."""
+
+    def __init__(self, cods):
+        super().__init__()
+        self.inference = InferenceGenerator(cods)
+
+    def forward(self, image, sensitivity, bias):
+        preds, logits, _, offramps = self.inference.forward_features(image, sensitivity, bias)
+        return tuple(preds) + tuple(logits) + tuple(offramps[name] for name in OFFRAMP_LAYERS)
+
+
+def export_onnx(cods, checksum, path=ONNX_MODEL_PATH, opset=OPSET):
+    """
+    Export an eval-mode Generator to `path` with a dynamic batch axis; the
+    weights + adapter `checksum` goes to <path>.json for staleness checks.
+    """
+    cods.disable_offramp_capture()
+    graph = _OnnxGraph(cods).eval().cpu()
+    example = (torch.rand(1, 3, INPUT_SIZE, INPUT_SIZE), torch.tensor(1.5), torch.tensor(0.0))
+    batch_outputs = PRED_NAMES + LOGIT_NAMES
+
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False  # newer torch defaults to the dynamo exporter
+    with torch.no_grad():
+        torch.onnx.export(
+            graph, example, path,
+            input_names=["image", "sensitivity", "bias"],
+            output_names=list(batch_outputs + OFFRAMP_NAMES),
+            dynamic_axes={name: {0: "batch"} for name in ("image",) + batch_outputs},
+            opset_version=opset,
+            do_constant_folding=True,
+            **kwargs,
+        )
+
+    with open(f"{path}.json", "w") as f:
+        json.dump({"source_checksum": checksum, "opset": opset}, f, indent=2)
+    print(f"[INFO] ONNX Generator written to {path}")
+    return path
+
+
+# ============================================================================
+# ONNX Runtime backend
+# ============================================================================
+
+class OnnxGenerator(ExportedGenerator):
+    """ExportedGenerator backed by an ONNX Runtime CPU session."""
+
+    supports_gradcam = False
+
+    def __init__(self, session):
+        super().__init__(torch.device("cpu"))
+        self.session = session
+        self._output_names = list(PRED_NAMES + LOGIT_NAMES + OFFRAMP_NAMES)
+
+    def _run(self, x, output_names):
+        feeds = {
+            "image": np.ascontiguousarray(x.detach().cpu().numpy(), dtype=np.float32),
+            "sensitivity": np.array(self.sensitivity, dtype=np.float32),
+            "bias": np.array(self.bias, dtype=np.float32),
+        }
+        return [torch.from_numpy(out) for out in self.session.run(output_names, feeds)]
+
+    def __call__(self, x):
+        return tuple(self._run(x, list(PRED_NAMES)))
+
+    def forward_features(self, x):
+        """(preds, logits, None) from one session run; offramp maps go to the capture, if enabled."""
+        outputs = self._run(x, self._output_names)
+        preds, logits, offramps = outputs[:3], outputs[3:6], outputs[6:]
+        self._publish_offramps(dict(zip(OFFRAMP_LAYERS, offramps)))
+        return tuple(preds), tuple(logits), None
+
+
+def create_session(path=ONNX_MODEL_PATH, num_threads=None):
+    """ONNX Runtime CPU session with every graph optimization enabled."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def load_onnx_generator(checksum, path=ONNX_MODEL_PATH, num_threads=None):
+    """The exported Generator as an OnnxGenerator, or None if unavailable or built from other weights."""
+    if not os.path.exists(path):
+        print(f"[WARN] No ONNX model at {path}; run 'python cods_onnx.py export'. Using the PyTorch model.")
+        return None
+
+    meta_path = f"{path}.json"
+    source_checksum = None
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            source_checksum = json.load(f).get("source_checksum")
+    if source_checksum != checksum:
+        print(f"[WARN] {path} was exported from other weights or LoRA adapters; using the PyTorch model. "
+              f"Re-run 'python cods_onnx.py export' to refresh it.")
+        return None
+
+    try:
+        session = create_session(path, num_threads)
+    except ImportError:
+        print("[WARN] onnxruntime is not installed; using the PyTorch model.")
+        return None
+
+    print(f"[INFO] Using ONNX Runtime Generator {path}")
+    return OnnxGenerator(session)
+
+
+# ============================================================================
+# Parity check and benchmark
+# ============================================================================
+
+def check(eager, onnx_model, inputs, tolerance=1e-3):
+    """Compare ONNX Runtime predictions and logits with the eager model; True if all are within `tolerance`."""
+    passed = True
+    print(f"{'input':<8}" + "".join(f"{name:>12}" for name in PRED_NAMES + LOGIT_NAMES))
+    for i, x in enumerate(inputs):
+        with torch.no_grad():
+            logits = eager.sal_encoder(x, native=True)
+            preds = eager.adjust_logits(logits, tuple(x.shape[2:]))
+        onnx_preds, onnx_logits, _ = onnx_model.forward_features(x)
+
+        diffs = [float((a.cpu() - b).abs().max()) for a, b in zip(tuple(preds) + tuple(logits),
+                                                                   tuple(onnx_preds) + tuple(onnx_logits))]
+        ok = max(diffs) <= tolerance
+        passed &= ok
+        print(f"{i:<8}" + "".join(f"{d:>12.2e}" for d in diffs) + ("" if ok else "  FAIL"))
+
+    print(f"[INFO] Parity {'passed' if passed else 'FAILED'} (max abs difference <= {tolerance})")
+    return passed
+
+
+def _latency(fn, x, runs):
+    with torch.no_grad():
+        fn(x)
+        fn(x)
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn(x)
+    return (time.perf_counter() - start) / runs
+
+
+def benchmark(models, batch_sizes=(1, 2, 4, 8, 16), runs=5):
+    """Latency (ms per batch and per image) of each {name: callable(x)} model for each batch size."""
+    names = list(models)
+    print(f"{'batch':<7}" + "".join(f"{name + ' ms':>16}{'/img':>9}" for name in names))
+    results = []
+    for batch in batch_sizes:
+        x = torch.rand(batch, 3, INPUT_SIZE, INPUT_SIZE)
+        row = {"batch": batch}
+        for name in names:
+            row[name] = _latency(models[name], x, runs) * 1e3
+        results.append(row)
+        print(f"{batch:<7}" + "".join(f"{row[name]:>16.1f}{row[name] / batch:>9.1f}" for name in names))
+    return results
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the CODS Generator to ONNX and run it with ONNX Runtime")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Export the Generator to ONNX")
+    export.add_argument("--output", default=ONNX_MODEL_PATH)
+    export.add_argument("--opset", type=int, default=OPSET)
+    checker = sub.add_parser("check", help="Compare ONNX Runtime outputs with the eager model")
+    checker.add_argument("images", nargs="*", help="Images to compare on (random inputs if none)")
+    bench = sub.add_parser("bench", help="Latency of eager, TorchScript and ONNX Runtime per batch size")
+    bench.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    bench.add_argument("--runs", type=int, default=5, help="Timed runs per model and batch size")
+    for sub_parser in (checker, bench):
+        sub_parser.add_argument("--model", default=ONNX_MODEL_PATH)
+        sub_parser.add_argument("--threads", type=int, default=None, help="ONNX Runtime intra-op threads")
+    args = parser.parse_args(argv)
+
+    # Builds the eager model exactly as the pipeline does (checkpoint + merged LoRA adapters), on the CPU
+    from IAI_Decision_Hierarchy import resource_manager, preprocess_image
+    eager, checksum = resource_manager.load_eager_cods_model()
+    eager = eager.cpu().eval()
+
+    if args.command == "export":
+        export_onnx(eager, checksum, path=args.output, opset=args.opset)
+        return 0
+
+    onnx_model = load_onnx_generator(checksum, path=args.model, num_threads=args.threads)
+    if onnx_model is None:
+        print(f"[ERROR] No usable ONNX model at {args.model}")
+        return 1
+
+    if args.command == "check":
+        import cv2
+        if args.images:
+            inputs = [preprocess_image(cv2.imread(path)) for path in args.images]
+        else:
+            inputs = [torch.rand(1, 3, INPUT_SIZE, INPUT_SIZE) for _ in range(3)]
+        return 0 if check(eager, onnx_model, inputs) else 1
+
+    from cods_export import trace_generator
+    scripted = trace_generator(eager, torch.device("cpu"))
+    mica = (torch.tensor(1.5), torch.tensor(0.0))
+    benchmark({
+        "eager": eager,
+        "scripted": lambda x: scripted(x, *mica),
+        "onnxruntime": onnx_model,
+    }, batch_sizes=args.batch_sizes, runs=args.runs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
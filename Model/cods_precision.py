@@ -0,0 +1,193 @@
+"""
+cods_precision.py - Reduced-precision (bfloat16 / float16) CODS inference
+
+Runs the Generator forward under torch.autocast, so convolutions and matmuls
+execute in bfloat16 (CPUs with AVX512-BF16 / AMX, and GPUs) or float16, and
+their activations take half the memory. That matters most for the two-branch
+ResNet-50, whose activations dominate a worker's footprint.
+
+Grad-CAM stays in float32 where it is sensitive: the backward starts from the
+float32 sum of each output, and the activations and gradients are upcast before
+the channel weighting and normalisation. Predictions and logits leave the
+forward as float32, so everything downstream is unchanged.
+
+Compare the precisions (latency, activation memory, deviation from fp32):
+    python cods_precision.py report images/*.jpg
+
+Integration in IAI_Decision_Hierarchy.py forward_with_gradcams() (--precision):
+    from cods_precision import autocast
+    with autocast(resource_manager.cods_precision, image.device.type):
+        ...forward + Grad-CAM...
+"""
+
+import sys
+import time
+import argparse
+import contextlib
+
+import numpy as np
+import torch
+
+
+PRECISIONS = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+# ============================================================================
+# Autocast
+# ============================================================================
+
+def _cpu_supports(dtype):
+    check = {torch.bfloat16: "_is_mkldnn_bf16_supported", torch.float16: "_is_mkldnn_fp16_supported"}[dtype]
+    try:
+        return bool(getattr(torch.ops.mkldnn, check)())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_precision(precision, device_type="cpu"):
+    """
+    The precision that will actually run on `device_type`: `precision` itself,
+    or "fp32" (with a warning) if the hardware has no fast kernels for it.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}' (expected one of {', '.join(PRECISIONS)})")
+    if precision == "fp32":
+        return precision
+
+    dtype = PRECISIONS[precision]
+    if device_type == "cuda":
+        supported = dtype != torch.bfloat16 or torch.cuda.is_bf16_supported()
+    else:
+        supported = _cpu_supports(dtype)
+    if not supported:
+        print(f"[WARN] No {precision} kernels on this {device_type.upper()}; using fp32")
+        return "fp32"
+    return precision
+
+
+def autocast(precision, device_type="cpu"):
+    """Context manager running the enclosed forward at `precision` (a no-op for fp32)."""
+    if precision == "fp32":
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device_type, dtype=PRECISIONS[precision])
+
+
+# ============================================================================
+# Report
+# ============================================================================
+
+def activation_bytes(model, image, precision):
+    """Bytes of every leaf module's output for one forward: the activation memory autograd keeps for Grad-CAM."""
+    total = [0]
+
+    def count(module, inputs, output):
+        for out in (output if isinstance(output, (tuple, list)) else (output,)):
+            if torch.is_tensor(out):
+                total[0] += out.numel() * out.element_size()
+
+    handles = [m.register_forward_hook(count) for m in model.modules() if not list(m.children())]
+    try:
+        with torch.no_grad(), autocast(precision, image.device.type):
+            model(image)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return total[0]
+
+
+def _run(forward, image, runs):
+    if image.device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = forward(image)
+    if image.device.type == "cuda":
+        torch.cuda.synchronize()
+    peak = torch.cuda.max_memory_allocated() if image.device.type == "cuda" else None
+    return result, (time.perf_counter() - start) / runs, peak
+
+
+def report(model, forward, inputs, precisions=("fp32", "bf16", "fp16"), runs=3):
+    """
+    For each precision (the first is the reference): latency of forward +
+    Grad-CAM (`forward(image, precision)` -> (fix_pred, cod_pred2, cam_fix,
+    cam_cod, logits)), activation memory, peak CUDA memory, and the max / mean
+    deviation of the sigmoid maps and CAMs from the reference.
+    """
+    device_type = inputs[0].device.type
+    results = {}
+    reference = []
+    for precision in precisions:
+        if resolve_precision(precision, device_type) != precision:
+            continue
+        run = lambda image: forward(image, precision)
+        run(inputs[0])  # warm-up
+
+        row = {"ms": 0.0, "activation_mb": activation_bytes(model, inputs[0], precision) / 2 ** 20,
+               "peak_cuda_mb": None, "pred_max": 0.0, "pred_mean": 0.0, "cam_mean": 0.0}
+        for i, image in enumerate(inputs):
+            (fix_pred, cod_pred2, cam_fix, cam_cod, _), seconds, peak = _run(run, image, runs)
+            row["ms"] += seconds * 1e3 / len(inputs)
+            if peak is not None:
+                row["peak_cuda_mb"] = max(row["peak_cuda_mb"] or 0.0, peak / 2 ** 20)
+
+            maps = [fix_pred.sigmoid().cpu().numpy(), cod_pred2.sigmoid().cpu().numpy()]
+            cams = [cam for cam in (cam_fix, cam_cod) if cam is not None]
+            if precision == precisions[0]:
+                reference.append((maps, cams))
+                continue
+            ref_maps, ref_cams = reference[i]
+            pred_diffs = [np.abs(a - b) for a, b in zip(maps, ref_maps)]
+            row["pred_max"] = max(row["pred_max"], max(float(d.max()) for d in pred_diffs))
+            row["pred_mean"] += float(np.mean([d.mean() for d in pred_diffs])) / len(inputs)
+            if cams and len(cams) == len(ref_cams):
+                row["cam_mean"] += float(np.mean([np.abs(a - b).mean() for a, b in zip(cams, ref_cams)])) / len(inputs)
+        results[precision] = row
+
+    print(f"{'precision':<11}{'ms/img':>9}{'act MB':>9}{'peak MB':>9}{'pred max':>11}{'pred mean':>11}{'CAM mean':>11}")
+    for precision, row in results.items():
+        peak = f"{row['peak_cuda_mb']:>9.0f}" if row["peak_cuda_mb"] is not None else f"{'-':>9}"
+        print(f"{precision:<11}{row['ms']:>9.1f}{row['activation_mb']:>9.1f}{peak}"
+              f"{row['pred_max']:>11.2e}{row['pred_mean']:>11.2e}{row['cam_mean']:>11.2e}")
+    print(f"[INFO] Deviations are absolute differences of the sigmoid maps / normalised CAMs from {precisions[0]}")
+    return results
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare CODS latency, memory and accuracy per precision")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reporter = sub.add_parser("report", help="Latency, activation memory and deviation from fp32 per precision")
+    reporter.add_argument("images", nargs="*", help="Images to run (random inputs if none)")
+    reporter.add_argument("--precisions", nargs="+", choices=list(PRECISIONS), default=list(PRECISIONS))
+    reporter.add_argument("--runs", type=int, default=3, help="Timed runs per image and precision")
+    reporter.add_argument("--json", default=None, help="Also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    # The eager model exactly as the pipeline loads it; Grad-CAM through the pipeline's own forward
+    import IAI_Decision_Hierarchy as iai
+    model, _ = iai.resource_manager.load_eager_cods_model()
+    device = next(model.parameters()).device
+
+    if args.images:
+        import cv2
+        inputs = [iai.preprocess_image(cv2.imread(path)).to(device) for path in args.images]
+    else:
+        inputs = [torch.rand(1, 3, 224, 224, device=device) for _ in range(3)]
+
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+    results = report(model, lambda image, precision: iai.forward_with_gradcams(model, image, precision),
+                     inputs, precisions=precisions, runs=args.runs)
+    if args.json:
+        import json
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""
+detector_backend.py - Execution backends for the EfficientDet D7 part detector
+
+Every backend is called the same way, detector(image) -> {"boxes", "scores",
+"classes"} as numpy arrays (normalized [y1, x1, y2, x2] boxes, descending
+score order), so Level 3 does not depend on how the model is executed:
+
+    saved_model  the exported SavedModel, called eagerly on /CPU:0 (reference)
+    xla          the serving function retraced with a fixed 1x1536x1536x3 input
+                 and run with XLA auto-clustering (only while it runs)
+    tflite       a converted .tflite model in the TFLite interpreter; float ops
+                 run on XNNPACK, its default CPU delegate
+
+D7 resizes every input to fit 1536x1536 (aspect preserved, zero padded) before
+the backbone, so the fixed-size backends letterbox the image the same way on
+the host and map the boxes back; nothing is lost by fixing the shape.
+
+Convert once, then check the result against the SavedModel:
+    python detector_backend.py convert --backend tflite
+    python detector_backend.py parity --backend tflite images/*.jpg
+
+Integration in IAI_Decision_Hierarchy.py LazyResourceManager:
+    from detector_backend import load_detector
+    detector = load_detector(DETECTOR_BACKEND, num_threads=DETECTOR_THREADS)
+"""
+
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+import cv2
+import numpy as np
+
+
+SAVED_MODEL_PATH = "models/d7_f/saved_model"
+FIXED_MODEL_PATH = "models/d7_f/fixed_1536"
+TFLITE_MODEL_PATH = "models/d7_f/d7_1536.tflite"
+INPUT_SIZE = 1536
+OUTPUT_KEYS = ("detection_boxes", "detection_scores", "detection_classes")
+BACKENDS = ("saved_model", "xla", "tflite")
+
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+def configure_threads(tf, num_threads, inter_op_threads=1):
+    """Set TF's intra/inter-op pools; only possible before TF executes its first op."""
+    if not num_threads:
+        return
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads or 1)
+    except RuntimeError as e:
+        print(f"[WARN] Detector thread count not applied (TensorFlow already initialised): {e}")
+
+
+@contextlib.contextmanager
+def autoclustering(tf):
+    """
+    XLA auto-clustering for the functions called inside the block only.
+
+    The JIT setting is process-wide, so it is switched on for the block and
+    restored after; TF keeps the functions run with and without it apart, so
+    neither is re-optimized on the next call.
+    """
+    previous = tf.config.optimizer.get_jit()
+    tf.config.optimizer.set_jit("autoclustering")
+    try:
+        yield
+    finally:
+        tf.config.optimizer.set_jit(previous or False)
+
+
+def letterbox(image, size=INPUT_SIZE):
+    """
+    Resize `image` so its longer side is `size` and zero-pad it to size x size
+    (bottom/right), as D7's own preprocessing does.
+
+    Returns (canvas, (scale_y, scale_x)) where the scales convert boxes
+    normalized to the canvas into boxes normalized to the image.
+    """
+    height, width = image.shape[:2]
+    ratio = size / float(max(height, width))
+    new_h = max(int(round(height * ratio)), 1)
+    new_w = max(int(round(width * ratio)), 1)
+    resized = image if (new_h, new_w) == (height, width) else \
+        cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    canvas = np.zeros((size, size, image.shape[2]), dtype=np.uint8)
+    canvas[:new_h, :new_w] = resized
+    return canvas, (size / float(new_h), size / float(new_w))
+
+
+def _unletterbox(detections, scales):
+    scale_y, scale_x = scales
+    boxes = detections["boxes"] * np.array([scale_y, scale_x, scale_y, scale_x], dtype=np.float32)
+    detections["boxes"] = np.clip(boxes, 0.0, 1.0)
+    return detections
+
+
+def _to_numpy(outputs):
+    """First batch item of the detector's output dict as {"boxes", "scores", "classes"}."""
+    return {
+        "boxes": np.asarray(outputs["detection_boxes"].numpy()[0]),
+        "scores": np.asarray(outputs["detection_scores"].numpy()[0]),
+        "classes": np.asarray(outputs["detection_classes"].numpy()[0]),
+    }
+
+
+def artifact_path(backend):
+    """File whose size/mtime identifies the model a backend runs (for cache keys)."""
+    if backend == "tflite":
+        return TFLITE_MODEL_PATH
+    if backend == "xla":
+        return os.path.join(FIXED_MODEL_PATH, "saved_model.pb")
+    return os.path.join(SAVED_MODEL_PATH, "saved_model.pb")
+
+
+# ============================================================================
+# Backends
+# ============================================================================
+
+class SavedModelDetector:
+    """The exported SavedModel called eagerly on the CPU (reference backend)."""
+
+    name = "saved_model"
+
+    def __init__(self, tf, path=SAVED_MODEL_PATH):
+        self.tf = tf
+        with tf.device("/CPU:0"):
+            self.model = tf.saved_model.load(path)
+
+    def __call__(self, image):
+        input_tensor = self.tf.convert_to_tensor(image)[self.tf.newaxis, ...]
+        return _to_numpy(self.model(input_tensor))
+
+
+class XLADetector:
+    """Fixed-signature SavedModel (see convert_fixed) run with XLA auto-clustering."""
+
+    name = "xla"
+
+    def __init__(self, tf, path=FIXED_MODEL_PATH):
+        self.tf = tf
+        with tf.device("/CPU:0"):
+            self.model = tf.saved_model.load(path)
+        self.serve = self.model.signatures["serving_default"]
+
+    def __call__(self, image):
+        canvas, scales = letterbox(image)
+        # Auto-clustering rather than jit_compile=True: the post-processing NMS ops
+        # have no XLA kernels, so only the compilable backbone/heads get fused.
+        # Scoped to this call, so other TF graphs in the process (and the
+        # reference detector in parity()) are not compiled with XLA.
+        with autoclustering(self.tf):
+            outputs = self.serve(input_tensor=self.tf.constant(canvas[np.newaxis]))
+        return _unletterbox(_to_numpy(outputs), scales)
+
+
+class TFLiteDetector:
+    """Converted .tflite model (see convert_tflite) in the TFLite interpreter."""
+
+    name = "tflite"
+
+    def __init__(self, tf, path=TFLITE_MODEL_PATH, num_threads=None):
+        # The default op resolver applies the XNNPACK delegate to float ops
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self.runner = self.interpreter.get_signature_runner("serving_default")
+
+    def __call__(self, image):
+        canvas, scales = letterbox(image)
+        outputs = self.runner(input_tensor=canvas[np.newaxis])
+        detections = {
+            "boxes": outputs["detection_boxes"][0],
+            "scores": outputs["detection_scores"][0],
+            "classes": outputs["detection_classes"][0],
+        }
+        return _unletterbox(detections, scales)
+
+
+def load_detector(backend="saved_model", num_threads=None, inter_op_threads=1):
+    """Import TensorFlow and load the detector for `backend` (one of BACKENDS)."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown detector backend '{backend}'. Choose from {list(BACKENDS)}")
+
+    import tensorflow as tf
+    configure_threads(tf, num_threads, inter_op_threads)
+
+    path = artifact_path(backend)
+    if backend != "saved_model" and not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run 'python detector_backend.py convert --backend {backend}'")
+
+    if backend == "tflite":
+        return TFLiteDetector(tf, num_threads=num_threads)
+    if backend == "xla":
+        return XLADetector(tf)
+    return SavedModelDetector(tf)
+
+
+# ============================================================================
+# Conversion
+# ============================================================================
+
+def convert_fixed(tf, src=SAVED_MODEL_PATH, dst=FIXED_MODEL_PATH, size=INPUT_SIZE):
+    """Re-export the SavedModel with a fixed [1, size, size, 3] uint8 serving signature."""
+    model = tf.saved_model.load(src)
+
+    class FixedInput(tf.Module):
+        def __init__(self, detector):
+            super().__init__()
+            self.detector = detector
+
+        @tf.function(input_signature=[tf.TensorSpec([1, size, size, 3], tf.uint8, name="input_tensor")])
+        def serve(self, input_tensor):
+            outputs = self.detector(input_tensor)
+            return {key: outputs[key] for key in OUTPUT_KEYS}
+
+    module = FixedInput(model)
+    tf.saved_model.save(module, dst, signatures={"serving_default": module.serve})
+    print(f"[INFO] Fixed-input SavedModel written to {dst}")
+    return dst
+
+
+def convert_tflite(tf, src=FIXED_MODEL_PATH, dst=TFLITE_MODEL_PATH):
+    """Convert the fixed-signature SavedModel to a float .tflite model."""
+    if not os.path.exists(os.path.join(src, "saved_model.pb")):
+        convert_fixed(tf, dst=src)
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(src, signature_keys=["serving_default"])
+    # NMS and a few pre-processing ops have no builtin kernel; fall back to TF ops for those
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+    tflite_model = converter.convert()
+
+    with open(dst, "wb") as f:
+        f.write(tflite_model)
+    print(f"[INFO] TFLite model written to {dst} ({len(tflite_model) / 1e6:.1f} MB)")
+    return dst
+
+
+# ============================================================================
+# Parity check
+# ============================================================================
+
+def _iou(boxes_a, boxes_b):
+    """Pairwise IoU of [y1, x1, y2, x2] boxes, shape (len(a), len(b))."""
+    y1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    x1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    y2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    x2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(y2 - y1, 0, None) * np.clip(x2 - x1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
+
+
+def compare_detections(reference, candidate, min_score=0.3, min_iou=0.5):
+    """
+    Match candidate to reference detections (same class, greedy by reference score).
+
+    Returns {"reference", "matched", "extra", "mean_iou", "max_score_diff"}.
+    """
+    ref_keep = reference["scores"] >= min_score
+    cand_keep = candidate["scores"] >= min_score
+    ref_boxes, ref_scores, ref_classes = (reference[k][ref_keep] for k in ("boxes", "scores", "classes"))
+    cand_boxes, cand_scores, cand_classes = (candidate[k][cand_keep] for k in ("boxes", "scores", "classes"))
+
+    ious = _iou(ref_boxes, cand_boxes) if len(ref_boxes) and len(cand_boxes) else np.zeros((len(ref_boxes), 0))
+    ious = np.where(ref_classes[:, None] == cand_classes[None, :], ious, 0.0)
+
+    used = np.zeros(len(cand_boxes), dtype=bool)
+    matched_ious, score_diffs = [], []
+    for i in np.argsort(-ref_scores, kind="stable"):
+        row = np.where(used, 0.0, ious[i]) if len(cand_boxes) else ious[i]
+        if row.size and row.max() >= min_iou:
+            j = int(row.argmax())
+            used[j] = True
+            matched_ious.append(float(row[j]))
+            score_diffs.append(abs(float(ref_scores[i]) - float(cand_scores[j])))
+
+    return {
+        "reference": int(len(ref_boxes)),
+        "matched": len(matched_ious),
+        "extra": int((~used).sum()),
+        "mean_iou": float(np.mean(matched_ious)) if matched_ious else 1.0,
+        "max_score_diff": max(score_diffs) if score_diffs else 0.0,
+    }
+
+
+def _timed(detector, image, runs):
+    detector(image)  # warm-up (graph tracing, XLA compilation, delegate setup)
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = detector(image)
+    return result, (time.perf_counter() - start) / runs
+
+
+def parity(backend, image_paths, num_threads=None, runs=3, min_score=0.3, min_iou=0.5,
+           min_recall=0.95, max_score_diff=0.05):
+    """Compare `backend` against the SavedModel on each image; return True if every image passes."""
+    reference = load_detector("saved_model", num_threads=num_threads)
+    candidate = load_detector(backend, num_threads=num_threads)
+
+    print(f"{'image':<32}{'ref':>5}{'match':>7}{'extra':>7}{'mIoU':>7}{'dScore':>8}{'ref ms':>9}{backend + ' ms':>12}")
+    passed = True
+    for path in image_paths:
+        # The BGR frame from cv2.imread, exactly what levelThree hands the detector
+        image = cv2.imread(path)
+        ref_out, ref_time = _timed(reference, image, runs)
+        cand_out, cand_time = _timed(candidate, image, runs)
+        stats = compare_detections(ref_out, cand_out, min_score=min_score, min_iou=min_iou)
+
+        recall = stats["matched"] / stats["reference"] if stats["reference"] else 1.0
+        ok = recall >= min_recall and stats["max_score_diff"] <= max_score_diff
+        passed &= ok
+        print(f"{os.path.basename(path)[:31]:<32}{stats['reference']:>5}{stats['matched']:>7}{stats['extra']:>7}"
+              f"{stats['mean_iou']:>7.3f}{stats['max_score_diff']:>8.3f}{ref_time * 1e3:>9.0f}{cand_time * 1e3:>12.0f}"
+              f"{'' if ok else '  FAIL'}")
+
+    print(f"[INFO] Parity {'passed' if passed else 'FAILED'} (recall >= {min_recall}, score diff <= {max_score_diff})")
+    return passed
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert and check EfficientDet D7 detector backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    convert = sub.add_parser("convert", help="Write the model file a backend needs")
+    convert.add_argument("--backend", choices=["xla", "tflite"], default="tflite")
+
+    check = sub.add_parser("parity", help="Compare a backend's boxes/scores and latency against the SavedModel")
+    check.add_argument("images", nargs="+", help="Images to run both detectors on")
+    check.add_argument("--backend", choices=BACKENDS, default="tflite")
+    check.add_argument("--threads", type=int, default=None, help="CPU threads for both detectors")
+    check.add_argument("--runs", type=int, default=3, help="Timed runs per image after one warm-up")
+    check.add_argument("--min-score", type=float, default=0.3, help="Ignore detections below this score")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        import tensorflow as tf
+        if args.backend == "xla":
+            convert_fixed(tf)
+        else:
+            convert_tflite(tf)
+        return 0
+
+    ok = parity(args.backend, args.images, num_threads=args.threads, runs=args.runs, min_score=args.min_score)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
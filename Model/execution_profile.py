@@ -0,0 +1,278 @@
+"""
+execution_profile.py - Named CPU execution profiles for PyTorch (CODS) and TensorFlow (D7)
+
+Left alone, PyTorch and TensorFlow each size their thread pools to every
+logical core, so the CODS forward and the D7 detector run by one iaiDecision
+call oversubscribe the same cores. A profile fixes, per framework:
+
+    torch_threads / torch_interop_threads   PyTorch intra- / inter-op pools
+    tf_intra_threads / tf_inter_threads     TensorFlow intra- / inter-op pools
+    channels_last                           NHWC weights for the ResNet and decoders
+    flush_denormal                          flush denormal floats to zero (SSE3)
+
+None leaves that setting at the framework default. Built-in profiles are
+"default" (change nothing) and "balanced" (both frameworks on the physical
+cores, one inter-op thread each, denormal flushing); more live in
+models/execution_profiles.json, whose "active" entry is used unless
+--profile names another. LazyResourceManager applies the profile when it
+loads each model.
+
+Find the fastest profile on this machine and make it active:
+    python execution_profile.py autotune images/*.jpg [--detector]
+    python execution_profile.py show
+
+Integration in IAI_Decision_Hierarchy.py LazyResourceManager:
+    profile = get_profile(EXECUTION_PROFILE)
+    apply_torch_profile(profile)                   # before the CODS model loads
+    cods = apply_channels_last(cods, profile)
+    load_detector(..., num_threads=profile["tf_intra_threads"], inter_op_threads=profile["tf_inter_threads"])
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+
+import torch
+
+
+PROFILES_PATH = "./models/execution_profiles.json"
+PROFILE_KEYS = ("torch_threads", "torch_interop_threads", "tf_intra_threads", "tf_inter_threads",
+                "channels_last", "flush_denormal")
+
+
+def physical_cores():
+    """Physical core count (psutil if installed, else half the logical cores when SMT is likely)."""
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return cores
+    except ImportError:
+        pass
+    logical = os.cpu_count() or 1
+    return max(1, logical // 2) if logical >= 4 else logical
+
+
+def builtin_profiles():
+    cores = physical_cores()
+    return {
+        "default": {},
+        "balanced": {"torch_threads": cores, "torch_interop_threads": 1,
+                     "tf_intra_threads": cores, "tf_inter_threads": 1,
+                     "channels_last": False, "flush_denormal": True},
+    }
+
+
+# ============================================================================
+# Profile storage
+# ============================================================================
+
+def _read(path):
+    if not os.path.exists(path):
+        return {"active": None, "profiles": {}}
+    with open(path, "r") as f:
+        data = json.load(f)
+    return {"active": data.get("active"), "profiles": data.get("profiles", {})}
+
+
+def load_profiles(path=PROFILES_PATH):
+    """All profiles by name (built-in, then saved ones) and the name of the active one."""
+    data = _read(path)
+    profiles = builtin_profiles()
+    profiles.update(data["profiles"])
+    return profiles, data["active"] or "default"
+
+
+def get_profile(name=None, path=PROFILES_PATH):
+    """Profile `name` (default: the active one) with every PROFILE_KEYS entry present."""
+    profiles, active = load_profiles(path)
+    name = name or active
+    if name not in profiles:
+        print(f"[WARN] Unknown execution profile '{name}' (have {', '.join(profiles)}); using 'default'")
+        name = "default"
+    profile = {key: profiles[name].get(key) for key in PROFILE_KEYS}
+    profile["name"] = name
+    return profile
+
+
+def save_profile(name, profile, path=PROFILES_PATH, activate=True):
+    """Store `profile` under `name` in the profiles file, optionally making it the active one."""
+    data = _read(path)
+    data["profiles"][name] = {key: profile.get(key) for key in PROFILE_KEYS}
+    if activate:
+        data["active"] = name
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"[INFO] Execution profile '{name}' saved to {path}{' (active)' if activate else ''}")
+
+
+# ============================================================================
+# Applying a profile
+# ============================================================================
+
+def apply_torch_profile(profile):
+    """Apply the PyTorch thread pools and denormal flushing of `profile`."""
+    if profile.get("torch_threads"):
+        torch.set_num_threads(profile["torch_threads"])
+    if profile.get("torch_interop_threads"):
+        try:
+            torch.set_num_interop_threads(profile["torch_interop_threads"])
+        except RuntimeError as e:
+            # Only settable once, before any inter-op parallel work has started
+            if torch.get_num_interop_threads() != profile["torch_interop_threads"]:
+                print(f"[WARN] PyTorch inter-op thread count not applied: {e}")
+    if profile.get("flush_denormal") is not None:
+        if not torch.set_flush_denormal(bool(profile["flush_denormal"])) and profile["flush_denormal"]:
+            print("[WARN] Denormal flushing is not supported on this CPU")
+
+
+def apply_channels_last(model, profile):
+    """Convert an eager model's conv weights to channels_last (NHWC) if `profile` asks for it."""
+    if profile.get("channels_last") and isinstance(model, torch.nn.Module):
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def describe(profile):
+    return ", ".join(f"{key}={profile.get(key)}" for key in PROFILE_KEYS if profile.get(key) is not None) or "framework defaults"
+
+
+# ============================================================================
+# Auto-tuning
+# ============================================================================
+
+def _latency(fn, inputs, runs):
+    for image in inputs[:1]:
+        fn(image)  # warm-up
+    start = time.perf_counter()
+    for _ in range(runs):
+        for image in inputs:
+            fn(image)
+    return (time.perf_counter() - start) / (runs * len(inputs))
+
+
+def _thread_candidates():
+    logical = os.cpu_count() or 1
+    cores = physical_cores()
+    return sorted({cores, logical, max(1, cores // 2)}, reverse=True)
+
+
+def tune_torch(model, forward, inputs, runs=3):
+    """
+    Time forward(image) (CODS forward + Grad-CAM) for every thread count,
+    memory format and denormal setting; return (best settings, all results).
+    """
+    results = []
+    for threads, channels_last, flush in itertools.product(_thread_candidates(), (False, True), (False, True)):
+        torch.set_num_threads(threads)
+        torch.set_flush_denormal(flush)
+        model.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+        ms = _latency(forward, inputs, runs) * 1e3
+        settings = {"torch_threads": threads, "channels_last": channels_last, "flush_denormal": flush}
+        results.append((ms, settings))
+        print(f"[INFO] CODS  threads={threads:<3} channels_last={channels_last!s:<5} "
+              f"flush_denormal={flush!s:<5} {ms:8.1f} ms")
+
+    model.to(memory_format=torch.contiguous_format)
+    torch.set_flush_denormal(False)
+    return min(results, key=lambda r: r[0])[1], results
+
+
+def tune_tensorflow(image_path, backend="saved_model", runs=3):
+    """
+    Time the detector for each intra/inter-op thread count, one subprocess per
+    setting (TensorFlow pools are fixed once it starts); return the best settings.
+    """
+    best = None
+    for intra, inter in itertools.product(_thread_candidates(), (1, 2)):
+        command = [sys.executable, os.path.abspath(__file__), "detector-latency", image_path,
+                   "--backend", backend, "--intra", str(intra), "--inter", str(inter), "--runs", str(runs)]
+        done = subprocess.run(command, capture_output=True, text=True)
+        lines = done.stdout.strip().splitlines()
+        if done.returncode != 0 or not lines:
+            print(f"[WARN] Detector timing failed for intra={intra} inter={inter}: {done.stderr.strip()[-300:]}")
+            continue
+        ms = float(lines[-1])
+        print(f"[INFO] D7    intra={intra:<3} inter={inter:<3} {ms:8.1f} ms")
+        if best is None or ms < best[0]:
+            best = (ms, {"tf_intra_threads": intra, "tf_inter_threads": inter})
+    return best[1] if best else {}
+
+
+def _detector_latency(args):
+    import cv2
+    from detector_backend import load_detector
+
+    detector = load_detector(args.backend, num_threads=args.intra, inter_op_threads=args.inter)
+    # The BGR frame from cv2.imread, exactly what levelThree hands the detector
+    image = cv2.imread(args.image)
+    print(f"{_latency(detector, [image], args.runs) * 1e3:.1f}")
+    return 0
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage and auto-tune CPU execution profiles")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("show", help="List the profiles and the active one")
+    tune = sub.add_parser("autotune", help="Time the settings on this machine and save the fastest profile")
+    tune.add_argument("images", nargs="*", help="Images to time on (random inputs if none)")
+    tune.add_argument("--name", default="tuned", help="Name to save the profile under")
+    tune.add_argument("--runs", type=int, default=3, help="Timed runs per setting")
+    tune.add_argument("--detector", action="store_true",
+                      help="Also tune TensorFlow's pools for D7 (slow: one model load per setting)")
+    tune.add_argument("--detector-backend", default="saved_model")
+    tune.add_argument("--no-activate", action="store_true", help="Save without making it the active profile")
+    latency = sub.add_parser("detector-latency", help=argparse.SUPPRESS)
+    latency.add_argument("image")
+    latency.add_argument("--backend", default="saved_model")
+    latency.add_argument("--intra", type=int, required=True)
+    latency.add_argument("--inter", type=int, required=True)
+    latency.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "detector-latency":
+        return _detector_latency(args)
+
+    if args.command == "show":
+        profiles, active = load_profiles()
+        for name in profiles:
+            print(f"{'*' if name == active else ' '} {name:<12} {describe(get_profile(name))}")
+        return 0
+
+    # The eager model and forward + Grad-CAM exactly as the pipeline runs them
+    import IAI_Decision_Hierarchy as iai
+    model, _ = iai.resource_manager.load_eager_cods_model()
+    if next(model.parameters()).is_cuda:
+        print("[WARN] The CODS model is on the GPU; thread and memory-format timings reflect the CPU side only")
+    device = next(model.parameters()).device
+    if args.images:
+        import cv2
+        inputs = [iai.preprocess_image(cv2.imread(path)).to(device) for path in args.images]
+    else:
+        inputs = [torch.rand(1, 3, 224, 224, device=device)]
+
+    profile = {"torch_interop_threads": 1}
+    best, _ = tune_torch(model, lambda image: iai.forward_with_gradcams(model, image, "fp32"), inputs, runs=args.runs)
+    profile.update(best)
+    if args.detector:
+        if not args.images:
+            print("[ERROR] --detector needs at least one image")
+            return 1
+        profile.update(tune_tensorflow(args.images[0], backend=args.detector_backend, runs=args.runs))
+
+    print(f"[INFO] Fastest: {describe(profile)}")
+    save_profile(args.name, profile, activate=not args.no_activate)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
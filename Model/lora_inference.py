@@ -8,11 +8,16 @@ Integration point in IAI_Decision_Hierarchy.py _load_cods_model():
     from lora_inference import apply_lora_to_model
     cods = apply_lora_to_model(cods)
 
+By default the adapters are merged into the base conv weights, so inference
+runs plain convolutions; unmerge_lora() restores them exactly, e.g. before
+apply_lora_to_model() loads a different adapter file into the same model.
+
 Author: Debra Hogue - MURDOC/MICA Project
 """
 
 import os
 import math
+import hashlib
 import torch
 import torch.nn as nn
 from typing import Dict, Optional
@@ -37,6 +42,7 @@ class LoRAConv2d(nn.Module):
         alpha : float
             Scaling factor; effective weight = alpha/rank * lora_B(lora_A(x)).
         """
+        super().__init__()
         self.original_conv = original_conv
         self.rank = rank
         self.scaling = alpha / rank
@@ -61,10 +67,43 @@ class LoRAConv2d(nn.Module):
         nn.init.kaiming_uniform_(self.lora_A.weight, a=math.sqrt(5))
         nn.init.zeros_(self.lora_B.weight)
 
+        # Copy of the base weight while the adapter is merged into it
+        self.base_weight = None
+
+    @property
+    def merged(self):
+        return self.base_weight is not None
+
     def forward(self, x):
         """Compute frozen conv output plus scaled LoRA residual."""
+        if self.merged:
+            return self.original_conv(x)
         return self.original_conv(x) + self.lora_B(self.lora_A(x)) * self.scaling
 
+    def delta_weight(self):
+        """The adapter as a kernel of the base conv's shape: scaling * B @ A.
+
+        Exact because lora_B is 1x1 and lora_A has the base conv's kernel,
+        stride, padding and dilation.
+        """
+        lora_b = self.lora_B.weight[:, :, 0, 0]
+        return torch.einsum("or,rihw->oihw", lora_b, self.lora_A.weight) * self.scaling
+
+    def merge(self):
+        """Fold the adapter into original_conv.weight (keeping a copy of the base weight)."""
+        if self.merged:
+            return
+        weight = self.original_conv.weight
+        self.base_weight = weight.data.clone()
+        weight.data += self.delta_weight().to(weight.dtype)
+
+    def unmerge(self):
+        """Restore original_conv.weight to the exact base weight."""
+        if not self.merged:
+            return
+        self.original_conv.weight.data.copy_(self.base_weight)
+        self.base_weight = None
+
 
 # ============================================================================
 # Internal helpers
@@ -90,6 +129,16 @@ def _inject_lora(decoder, rank=4, alpha=4.0):
     return lora_layers
 
 
+def _lora_layers(module):
+    """Existing LoRAConv2d wrappers in `module` (name -> layer)."""
+    return {name: m for name, m in module.named_modules() if isinstance(m, LoRAConv2d)}
+
+
+def _mergeable(layer):
+    # A grouped lora_A followed by a dense 1x1 lora_B mixes groups: no grouped kernel equivalent
+    return layer.original_conv.groups == 1
+
+
 def _load_lora_state(lora_layers, path):
     """Copy saved lora_A/lora_B weights from a checkpoint into the injected LoRA layers.
 
@@ -112,7 +161,30 @@ def _load_lora_state(lora_layers, path):
 # Public API
 # ============================================================================
 
-def apply_lora_to_model(model, lora_path=None, rank=4, alpha=4.0):
+def default_lora_path():
+    """Adapter file apply_lora_to_model loads when no path is given."""
+    return os.path.join("training_sessions", "lora_adapters", "latest.pth")
+
+
+def adapter_checksum(lora_path=None):
+    """
+    SHA-256 of the LoRA adapter file, or None if there is none.
+
+    Identifies the adapter version baked into the model, e.g. for cache keys.
+    """
+    if lora_path is None:
+        lora_path = default_lora_path()
+    if not os.path.exists(lora_path):
+        return None
+
+    sha = hashlib.sha256()
+    with open(lora_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def apply_lora_to_model(model, lora_path=None, rank=4, alpha=4.0, merge=True):
     """
     Apply LoRA adapters to a loaded Generator model.
 
@@ -129,6 +201,8 @@ def apply_lora_to_model(model, lora_path=None, rank=4, alpha=4.0):
         Must match the rank used during training (default 4).
     alpha : float
         Must match alpha used during training (default 4.0).
+    merge : bool
+        Fold the adapters into the base conv weights (see merge_lora).
 
     Returns
     -------
@@ -136,16 +210,22 @@ def apply_lora_to_model(model, lora_path=None, rank=4, alpha=4.0):
         Model with LoRA adapters applied (or unchanged if no file found).
     """
     if lora_path is None:
-        lora_path = os.path.join("training_sessions", "lora_adapters", "latest.pth")
+        lora_path = default_lora_path()
+
+    # Switching adapters: put back the wrappers (and base weights) of the previous ones
+    unmerge_lora(model)
+    decoder = model.sal_encoder.sal_dec
 
     if not os.path.exists(lora_path):
+        for name, layer in _lora_layers(decoder).items():
+            _replace_module(decoder, name, layer.original_conv)
         print(f"[INFO] No LoRA adapters at {lora_path}. Using base model.")
         return model
 
     try:
         print(f"[INFO] Loading LoRA adapters from: {lora_path}")
 
-        lora_layers = _inject_lora(model.sal_encoder.sal_dec, rank=rank, alpha=alpha)
+        lora_layers = _lora_layers(decoder) or _inject_lora(decoder, rank=rank, alpha=alpha)
         loaded, metadata = _load_lora_state(lora_layers, lora_path)
 
         total_params = sum(
@@ -155,8 +235,42 @@ def apply_lora_to_model(model, lora_path=None, rank=4, alpha=4.0):
         session = metadata.get("session_id", "unknown")
         print(f"[INFO] LoRA applied: {loaded} layers, {total_params:,} params (session: {session})")
 
+        if merge:
+            print(f"[INFO] LoRA merged into {merge_lora(model)} base conv layers")
+
     except Exception as e:
         print(f"[WARN] Failed to load LoRA adapters: {e}")
         print("[WARN] Continuing with base model.")
 
-    return model
\ No newline at end of file
+    return model
+
+
+def merge_lora(model):
+    """
+    Fold every LoRA adapter in `model` into its base conv and put the plain
+    Conv2d back in the decoder, so inference pays nothing for the adapters.
+
+    The wrappers are kept on the model for unmerge_lora(). Returns the number
+    of layers merged; grouped convs cannot be folded and stay wrapped.
+    """
+    merged = getattr(model, "_merged_lora", None) or {}
+    for name, layer in _lora_layers(model).items():
+        if not _mergeable(layer):
+            continue
+        layer.merge()
+        _replace_module(model, name, layer.original_conv)
+        merged[name] = layer
+    model._merged_lora = merged
+    return len(merged)
+
+
+def unmerge_lora(model):
+    """Undo merge_lora(): restore the exact base weights and re-insert the LoRA wrappers."""
+    merged = getattr(model, "_merged_lora", None)
+    if not merged:
+        return 0
+    for name, layer in merged.items():
+        layer.unmerge()
+        _replace_module(model, name, layer)
+    model._merged_lora = {}
+    return len(merged)
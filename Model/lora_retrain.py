@@ -230,7 +230,8 @@ class LoRATrainer:
         print(f"[INFO] Device: {self.device}")
         print(f"[INFO] Loading base model: {self.config.model_path}")
 
-        self.model = Generator(self.config.channel)
+        # Base weights come from model_path below, so skip the ImageNet initialisation
+        self.model = Generator(self.config.channel, pretrained_backbone=False)
 
         if os.path.exists(self.config.model_path):
             state = torch.load(self.config.model_path, map_location="cpu")
@@ -1,18 +1,16 @@
 import torch
 import torch.nn as nn
-import torchvision.models as models
 from model.ResNet import B2_ResNet
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 from torch.nn import Parameter, Softmax
 import torch.nn.functional as F
 from model.HolisticAttention import HA
-from torch.autograd import Variable
 from torch.distributions import Normal, Independent, kl
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-from torchvision.utils import save_image
-import datetime
+
+# Output heads of Saliency_feat_encoder / Generator, in output order
+HEADS = ("fix", "init", "ref")
 
 class Generator(nn.Module):
     """Top-level MICA detection model.
@@ -21,16 +19,38 @@ class Generator(nn.Module):
     to the three output prediction maps before bilinear upsampling to input resolution.
     """
 
-    def __init__(self, channel):
-        """Initialize the Generator with a Saliency_feat_encoder and default MICA parameters."""
+    def __init__(self, channel, pretrained_backbone=True):
+        """Initialize the Generator with a Saliency_feat_encoder and default MICA parameters.
+
+        Pass pretrained_backbone=False when a full checkpoint is loaded right after
+        construction; it skips fetching the ImageNet ResNet-50 weights.
+        """
         super(Generator, self).__init__()
-        self.sal_encoder = Saliency_feat_encoder(channel)
+        self.sal_encoder = Saliency_feat_encoder(channel, pretrained_backbone)
         self.current_filename = ""
-        
+        self.offramp_capture = None
+
         # MICA parameters
         self.sensitivity = 1.5  # d' parameter
         self.bias = 0.0         # β parameter
-    
+
+    def enable_offramp_capture(self, layers=None, output_root="offramp_output_images"):
+        """Start writing intermediate feature maps (offramps) in the background; off by default.
+
+        layers: names from model.offramp_capture.OFFRAMP_LAYERS, or None for all of them.
+        """
+        from model.offramp_capture import OfframpCapture
+
+        self.disable_offramp_capture()
+        self.offramp_capture = OfframpCapture(self.sal_encoder, layers=layers, output_root=output_root)
+        return self.offramp_capture
+
+    def disable_offramp_capture(self):
+        """Remove the offramp hooks after writing any maps still queued."""
+        if self.offramp_capture is not None:
+            self.offramp_capture.close()
+            self.offramp_capture = None
+
     def set_mica_parameters(self, sensitivity, bias):
         """Set MICA detection parameters"""
         self.sensitivity = sensitivity
@@ -57,21 +77,34 @@ class Generator(nn.Module):
         # Return the appropriate layer from your model
         return self.sal_encoder.resnet.layer4_2  # Or whatever layer exists
 
-    def forward(self, x):
-        """Run encoder, apply MICA adjustments, and upsample all predictions to input size."""
-        fix_pred, cod_pred1, cod_pred2 = self.sal_encoder(x)
-        
-        # Apply MICA adjustments
-        fix_pred = self.apply_mica_adjustment(fix_pred)
-        cod_pred1 = self.apply_mica_adjustment(cod_pred1)
-        cod_pred2 = self.apply_mica_adjustment(cod_pred2)
-        
-        # Upsample as before
-        fix_pred = F.upsample(fix_pred, size=(x.shape[2], x.shape[3]), mode='bilinear', align_corners=True)
-        cod_pred1 = F.upsample(cod_pred1, size=(x.shape[2], x.shape[3]), mode='bilinear', align_corners=True)
-        cod_pred2 = F.upsample(cod_pred2, size=(x.shape[2], x.shape[3]), mode='bilinear', align_corners=True)
-        
-        return fix_pred, cod_pred1, cod_pred2
+    def forward(self, x, heads=HEADS, size=None):
+        """Run encoder, apply MICA adjustments, and upsample all predictions to `size` (default input size).
+
+        heads: the outputs the caller needs (names from HEADS); the others are
+        returned as None and their decoder passes are skipped.
+        The encoder's native-resolution logits are upsampled once, straight to `size`.
+        """
+        size = size or (x.shape[2], x.shape[3])
+        return self.adjust_logits(self.sal_encoder(x, heads, native=True), size)
+
+    def adjust_logits(self, logits, size=None):
+        """Apply MICA adjustments to raw encoder logits and upsample them to `size` (H, W).
+
+        Lets callers that kept the encoder output re-apply new MICA parameters without
+        re-running the network. Skipped heads (None) stay None; with size=None the
+        predictions keep the logits' resolution.
+        """
+        preds = []
+        for logit in logits:
+            if logit is None:
+                preds.append(None)
+                continue
+            # Apply MICA adjustments, then upsample as before
+            pred = self.apply_mica_adjustment(logit)
+            if size is not None:
+                pred = F.upsample(pred, size=size, mode='bilinear', align_corners=True)
+            preds.append(pred)
+        return tuple(preds)
 
 class PAM_Module(nn.Module):
     """ Position attention module"""
@@ -354,7 +387,7 @@ class Saliency_feat_encoder(nn.Module):
     """
 
     # resnet based encoder decoder
-    def __init__(self, channel):
+    def __init__(self, channel, pretrained_backbone=True):
         """Build backbone, decoders, and holistic attention; load ImageNet weights at train time."""
         super(Saliency_feat_encoder, self).__init__()
         self.resnet = B2_ResNet()
@@ -370,18 +403,32 @@ class Saliency_feat_encoder(nn.Module):
         self.HA = HA()
         
         self.current_filename = ""
+        self.sal_dec_head = None  # head sal_dec is decoding ("init" / "ref"), for the offramp hook
 
-        if self.training:
+        if self.training and pretrained_backbone:
             self.initialize_weights()
     
     def set_filename(self, filename):
         """Set the current image filename used as the offramp output subdirectory name."""
         self.current_filename = filename
 
-    def forward(self, x):
+    def forward(self, x, heads=HEADS, native=False):
         """Run two-pass inference: initial predictions → holistic attention → refined predictions.
 
-        Returns (fix_pred, init_pred, ref_pred) each upsampled 4× to near-input resolution.
+        Returns (fix_pred, init_pred, ref_pred) each upsampled 4× to near-input resolution,
+        or at the decoders' native 1/4 resolution with native=True (for callers that resize
+        once to their own output size).
+        Heads not in `heads` are None: init_pred then skips the first sal_dec pass, ref_pred
+        the holistic-attention branch (fix_pred always runs, the branch depends on it).
+        """
+        fix_pred, init_pred, ref_pred, _ = self.forward_features(x, heads, native)
+        return fix_pred, init_pred, ref_pred
+
+    def forward_features(self, x, heads=HEADS, native=False):
+        """Same as forward, plus a dict of the intermediate maps (keys as in OFFRAMP_LAYERS).
+
+        Used by the TorchScript export, which cannot use forward hooks to reach them.
+        Maps of a skipped branch are left out.
         """
         x = self.resnet.conv1(x)
         x = self.resnet.bn1(x)
@@ -391,31 +438,28 @@ class Saliency_feat_encoder(nn.Module):
         x2 = self.resnet.layer2(x1)  # 512 x 32 x 32
         x3 = self.resnet.layer3_1(x2)  # 1024 x 16 x 16
         x4 = self.resnet.layer4_1(x3)  # 2048 x 8 x 8
-                
-        # Saving intermediate feature maps as images
-        self.save_feature_maps(x1, 'x1')
-        self.save_feature_maps(x2, 'x2')
-        self.save_feature_maps(x3, 'x3')
-        self.save_feature_maps(x4, 'x4')
         
         fix_pred = self.cod_dec(x1,x2,x3,x4)
-        init_pred = self.sal_dec(x1,x2,x3,x4)
-
-        x2_2 = self.HA(1-self.upsample05(fix_pred).sigmoid(), x2)
-        x3_2 = self.resnet.layer3_2(x2_2)  # 1024 x 16 x 16
-        x4_2 = self.resnet.layer4_2(x3_2)  # 2048 x 8 x 8
-        ref_pred = self.sal_dec(x1,x2_2,x3_2,x4_2)
-        
-        # Saving intermediate feature maps as images
-        self.save_feature_maps(x2_2, 'x2_2')
-        self.save_feature_maps(x3_2, 'x3_2')
-        self.save_feature_maps(x4_2, 'x4_2')
-        self.save_feature_maps(ref_pred, 'ref_pred')
-                
-        return self.upsample4(fix_pred),self.upsample4(init_pred),self.upsample4(ref_pred)
+        self.sal_dec_head = "init"
+        init_pred = self.sal_dec(x1,x2,x3,x4) if "init" in heads else None
+        features = {"x1": x1, "x2": x2, "x3": x3, "x4": x4}
+
+        ref_pred = None
+        if "ref" in heads:
+            x2_2 = self.HA(1-self.upsample05(fix_pred).sigmoid(), x2)
+            x3_2 = self.resnet.layer3_2(x2_2)  # 1024 x 16 x 16
+            x4_2 = self.resnet.layer4_2(x3_2)  # 2048 x 8 x 8
+            self.sal_dec_head = "ref"
+            ref_pred = self.sal_dec(x1,x2_2,x3_2,x4_2)
+            features.update({"x2_2": x2_2, "x3_2": x3_2, "x4_2": x4_2, "ref_pred": ref_pred})
+
+        preds = [None if name not in heads else pred if native else self.upsample4(pred)
+                 for name, pred in zip(HEADS, (fix_pred, init_pred, ref_pred))]
+        return preds[0], preds[1], preds[2], features
 
     def initialize_weights(self):
         """Load ImageNet-pretrained ResNet-50 weights, mapping dual-branch keys to single-branch names."""
+        import torchvision.models as models
         res50 = models.resnet50(pretrained=True)
         pretrained_dict = res50.state_dict()
         all_params = {}
@@ -433,26 +477,3 @@ class Saliency_feat_encoder(nn.Module):
                 all_params[k] = v
         assert len(all_params.keys()) == len(self.resnet.state_dict().keys())
         self.resnet.load_state_dict(all_params)
-  
-    def save_feature_maps(self, feature_map, feature_name):
-        """Save a channel-averaged, min-max normalized feature map as a viridis PNG for visualization.
-
-        Output path: offramp_output_images/{current_filename}/{feature_name}.png
-        """
-        # timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = self.current_filename
-        save_dir = f"offramp_output_images/{filename}"
-        os.makedirs(save_dir, exist_ok=True)
-        
-        # Convert to numpy and take the first item in the batch
-        feature_map_np = feature_map.detach().cpu().numpy()[0]
-        
-        # Aggregate across channels
-        aggregated_feature = np.mean(feature_map_np, axis=0)
-        
-        # Normalize to [0, 1] range
-        aggregated_feature = (aggregated_feature - aggregated_feature.min()) / (aggregated_feature.max() - aggregated_feature.min())
-        
-        # Save the aggregated feature map
-        save_path = os.path.join(save_dir, f'{feature_name}.png')
-        plt.imsave(save_path, aggregated_feature, cmap='viridis')
\ No newline at end of file
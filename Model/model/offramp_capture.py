@@ -0,0 +1,153 @@
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+
+
+# Offramp name -> submodule of Saliency_feat_encoder whose output it is.
+# sal_dec runs twice per forward (init_pred, ref_pred); the last call wins, so
+# "ref_pred" holds the refined prediction just like the old inline capture.
+# When the ref head is skipped, the init pass is the last and its map is
+# written as "init_pred" instead.
+SAL_DEC_MAPS = ("init_pred", "ref_pred")
+
+OFFRAMP_LAYERS = {
+    "x1": "resnet.layer1",
+    "x2": "resnet.layer2",
+    "x3": "resnet.layer3_1",
+    "x4": "resnet.layer4_1",
+    "x2_2": "HA",
+    "x3_2": "resnet.layer3_2",
+    "x4_2": "resnet.layer4_2",
+    "ref_pred": "sal_dec",
+}
+
+
+class OfframpCapture:
+    """Opt-in capture of intermediate feature maps ("offramps") for visualization.
+
+    Forward hooks reduce each selected layer output to a channel-averaged map of the
+    first batch item (on the model's device) and hand it to a background thread,
+    which normalizes it and writes offramp_output_images/{current_filename}/{name}.png
+    with the viridis colormap. The forward pass never waits on matplotlib or disk.
+    """
+
+    def __init__(self, encoder, layers=None, output_root="offramp_output_images", max_pending=8, attach=True):
+        """Hook `layers` (names from OFFRAMP_LAYERS, default all) of a Saliency_feat_encoder.
+
+        With attach=False no hooks are registered and maps are handed in through
+        publish() (used by the TorchScript model, which returns them as outputs).
+        """
+        layers = list(OFFRAMP_LAYERS) if layers is None else list(layers)
+        unknown = [name for name in layers if name not in OFFRAMP_LAYERS]
+        if unknown:
+            raise ValueError(f"Unknown offramp layer(s): {unknown}. Choose from {list(OFFRAMP_LAYERS)}")
+
+        self.encoder = encoder
+        self.layers = layers
+        self.output_root = output_root
+        self.enabled = True
+        self.errors = []
+        self.last_maps = None
+
+        # Import matplotlib here rather than in the writer thread: a first import racing
+        # the main thread's matplotlib import can see a partially initialised package
+        from matplotlib import image as mpimg
+        self._imsave = mpimg.imsave
+
+        self._current = None
+        self._handles = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._worker = threading.Thread(target=self._write_loop, name="offramp-writer", daemon=True)
+        self._worker.start()
+        if attach:
+            self._attach()
+
+    def _attach(self):
+        """Register a pre-hook/hook pair on the encoder plus one forward hook per selected layer."""
+        self._handles.append(self.encoder.register_forward_pre_hook(self._begin_forward))
+        self._handles.append(self.encoder.register_forward_hook(self._end_forward))
+        for name in self.layers:
+            module = self.encoder.get_submodule(OFFRAMP_LAYERS[name])
+            self._handles.append(module.register_forward_hook(self._make_layer_hook(name)))
+
+    def _make_layer_hook(self, name):
+        """Return a forward hook that stores the reduced output of one layer under `name`."""
+        def hook(module, inputs, output):
+            if self._current is not None:
+                key = name
+                if name in SAL_DEC_MAPS:
+                    # Named after the head this sal_dec call decoded; only the last call is kept
+                    for other in SAL_DEC_MAPS:
+                        self._current.pop(other, None)
+                    key = f"{self.encoder.sal_dec_head}_pred"
+                with torch.no_grad():
+                    self._current[key] = output.detach()[0].float().mean(dim=0)
+        return hook
+
+    def _begin_forward(self, module, inputs):
+        """Start collecting maps for this forward (skipped while capture is paused)."""
+        self._current = {} if self.enabled else None
+
+    def _end_forward(self, module, inputs, output):
+        """Queue the collected maps for the writer thread (blocks if the writer is behind)."""
+        if not self._current:
+            self._current = None
+            return
+        maps = {name: fmap.cpu().numpy() for name, fmap in self._current.items()}
+        self._current = None
+        self.publish(maps)
+
+    def publish(self, maps):
+        """Keep `maps` ({name: 2-D array} of this forward) as last_maps and queue them for writing."""
+        self.last_maps = maps
+        self.submit(maps)
+
+    def submit(self, maps):
+        """Queue reduced maps ({name: 2-D array}, e.g. a cached last_maps) for writing."""
+        save_dir = os.path.join(self.output_root, getattr(self.encoder, "current_filename", ""))
+        self._queue.put((save_dir, maps))
+
+    def _write_loop(self):
+        """Background thread: normalize each map to [0, 1] and save it as a viridis PNG."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                save_dir, maps = item
+                os.makedirs(save_dir, exist_ok=True)
+                for name, fmap in maps.items():
+                    fmin, fmax = fmap.min(), fmap.max()
+                    if fmax > fmin:
+                        fmap = (fmap - fmin) / (fmax - fmin)
+                    else:
+                        fmap = np.zeros_like(fmap)
+                    self._imsave(os.path.join(save_dir, f"{name}.png"), fmap, cmap="viridis")
+            except Exception as e:
+                self.errors.append(e)
+                print(f"[WARN] Offramp write failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def pause(self):
+        """Stop capturing until resume(); hooks stay registered."""
+        self.enabled = False
+
+    def resume(self):
+        """Resume capturing after pause()."""
+        self.enabled = True
+
+    def flush(self):
+        """Block until every queued map has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Remove all hooks, write what is still queued and stop the writer thread."""
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._queue.put(None)
+        self._worker.join()
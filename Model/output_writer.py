@@ -0,0 +1,220 @@
+"""
+output_writer.py - Bounded background writer for the per-image output artifacts
+
+One iaiDecision call writes a dozen files: the binary / fixation maps, the
+Grad-CAM overlays, the segmented overlay (twice), the Level 2 / Level 3
+figures, the weak-area JSON and the detection text. Encoding and writing them
+no longer happens on the decision path:
+
+    - the pipeline hands each artifact to the writer as an encoder callable
+      (or already encoded bytes / text) and moves on
+    - a small pool of worker threads encodes and writes them; PNG / JPEG
+      encoding releases the GIL, so encodes overlap each other and the next
+      image's forward
+    - the queue is bounded: when the workers fall behind, submit() blocks
+      (back-pressure) instead of holding an unbounded backlog of frames
+    - an artifact destined for several paths is encoded once and written to
+      each of them; a write superseded by a newer one to the same path before
+      it started is dropped without encoding, and writes to one path always
+      land in submission order
+    - each file is written under a temporary name and moved into place with
+      os.replace, so readers never see a half-written file and submit() only
+      waits for the rename, not the write
+    - flush() is the barrier: it waits for everything submitted so far and
+      returns the failures (path and exception) since the previous flush
+
+Arrays handed to an encoder must not be modified after submit().
+
+Integration in IAI_Decision_Hierarchy.py:
+    output_writer.submit([results_path, overlay_path], lambda: encode_image(".jpg", segmented_output))
+    output_writer.write_text(f"jsons/{filename}.json", json.dumps(data, indent=6))
+    errors = output_writer.flush()            # before anyone reads the files
+"""
+
+import io
+import os
+import sys
+import queue
+import threading
+
+import cv2
+
+
+def encode_image(ext, image):
+    """`image` (BGR / gray uint8) encoded by OpenCV as `ext` (".png", ".jpg"), as bytes; what cv2.imwrite writes."""
+    ok, buffer = cv2.imencode(ext, image)
+    if not ok:
+        raise ValueError(f"OpenCV could not encode a {image.shape} {image.dtype} image as {ext}")
+    return buffer.tobytes()
+
+
+def encode_pil(image, format="PNG", **params):
+    """A PIL image encoded as `format`, as bytes; what image.save(path) writes."""
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **params)
+    return buffer.getvalue()
+
+
+class OutputWriter:
+    """Thread pool that encodes and writes output files in the background, with back-pressure."""
+
+    def __init__(self, workers=2, max_pending=16):
+        """
+        workers:     encoder / writer threads
+        max_pending: artifacts queued before submit() blocks
+        """
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.errors = []
+        self._queue = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._generation = {}    # path -> generation of its newest submitted write
+        self._submitted = 0
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._threads = [threading.Thread(target=self._write_loop, name=f"output-writer-{i}", daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    # ------------------------------------------------------------------
+    # Submitting
+    # ------------------------------------------------------------------
+    def submit(self, paths, encode, text=False):
+        """
+        Write the result of `encode()` (bytes, or str if `text`) to each of
+        `paths` (one path or a list) in the background. Blocks while
+        max_pending artifacts are already queued.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        self._start()
+        with self._lock:
+            self._submitted += 1
+            targets = []
+            for path in paths:
+                path = os.path.abspath(path)
+                if any(target == path for target, _ in targets):
+                    continue
+                self._generation[path] = self._submitted
+                targets.append((path, self._submitted))
+        self._queue.put((targets, encode, text))
+
+    def write_bytes(self, paths, data):
+        """Write already encoded `data` to `paths` in the background."""
+        self.submit(paths, lambda: data)
+
+    def write_text(self, paths, text):
+        """Write `text` to `paths` in the background (text mode, as open(path, "w") would)."""
+        self.submit(paths, lambda: text, text=True)
+
+    def remove(self, path):
+        """Delete `path` if it exists, after any write to it submitted earlier."""
+        self.submit(path, None)
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+    def _current(self, targets):
+        with self._lock:
+            return [(path, generation) for path, generation in targets if self._generation.get(path) == generation]
+
+    def _write_loop(self):
+        """Worker thread: encode each artifact once and write it to every path not superseded since."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                targets, encode, text = item
+                if not self._current(targets):
+                    continue
+                data = None if encode is None else encode()
+                for path, generation in targets:
+                    try:
+                        self._write(path, generation, data, text)
+                    except Exception as e:
+                        self._fail(path, e)
+                        self._release(path, generation)
+            except Exception as e:
+                for path, generation in targets:
+                    self._release(path, generation)
+                for path, _ in targets:
+                    self._fail(path, e)
+            finally:
+                self._queue.task_done()
+
+    def _release(self, path, generation):
+        with self._lock:
+            if self._generation.get(path) == generation:
+                del self._generation[path]
+
+    def _write(self, path, generation, data, text):
+        """
+        Write `data` to a temporary file next to `path` without holding the lock,
+        then move it into place under the lock unless a newer write to `path`
+        was submitted meanwhile (or already landed).
+        """
+        if data is None:
+            with self._lock:
+                if self._generation.get(path) == generation:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    del self._generation[path]
+            return
+        if not self._current([(path, generation)]):
+            return
+
+        directory, name = os.path.split(path)
+        os.makedirs(directory or ".", exist_ok=True)
+        # One write at a time per worker thread, so the thread id keeps the name unique
+        temp_path = os.path.join(directory, f".{name}.{threading.get_ident()}.tmp")
+        try:
+            with open(temp_path, "w" if text else "wb") as f:
+                f.write(data)
+            with self._lock:
+                if self._generation.get(path) != generation:
+                    return
+                os.replace(temp_path, path)
+                del self._generation[path]
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _fail(self, path, error):
+        self.errors.append((path, error))
+        # stderr: in --serve mode stdout carries the protocol, and workers run between requests too
+        print(f"[ERROR] Writing {path} failed: {type(error).__name__}: {error}", file=sys.stderr)
+
+    # ------------------------------------------------------------------
+    # Barrier
+    # ------------------------------------------------------------------
+    @property
+    def pending(self):
+        """Artifacts submitted but not yet written."""
+        return self._queue.unfinished_tasks if self._queue is not None else 0
+
+    def flush(self):
+        """
+        Block until everything submitted so far is written. Returns the
+        [(path, exception)] failures since the previous flush.
+        """
+        if self._queue is not None:
+            self._queue.join()
+        errors, self.errors = self.errors, []
+        return errors
+
+    def close(self):
+        """flush() and stop the worker threads (they restart on the next submit)."""
+        errors = self.flush()
+        if self._queue is not None:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._queue = None
+            self._threads = []
+        return errors
@@ -0,0 +1,191 @@
+"""
+postprocess.py - uint8 post-processing of the fixation and weak-camouflage maps
+
+After thresholding, every frame's uint8 fixation map used to go through
+matplotlib colormaps and float64 math: divide by 255, look up the RdBl /
+blGrRdBl colormaps as float RGBA, scale back to bytes, with the binary mask
+applied through two transposes and the segmented overlay blended in float32
+over the whole frame. This module does the same work on uint8 buffers:
+
+    - RdBl and blGrRdBl are precomputed once as 256-entry RGBA uint8 lookup
+      tables, built exactly as matplotlib's LinearSegmentedColormap samples
+      them, so colormapping a map is a single table lookup
+    - masking multiplies the uint8 map by the 0/1 uint8 mask (into a caller's
+      buffer if given), in the map's own (row, column) layout
+    - the overlay blends only within the mask's bounding box, through a
+      256 x 256 table of the float32 blend, so the result is byte-identical
+      to the float version
+
+The outputs are the same bytes the matplotlib path produced, and the
+colormaps no longer import matplotlib.
+
+Compare the lookup tables with matplotlib's colormaps:
+    python postprocess.py check
+
+Integration in IAI_Decision_Hierarchy.py threshold_and_decide():
+    from postprocess import binary_mask, colormap, mask_map, segmented_overlay
+    mask = binary_mask(bm_image, bm_thresh_255)
+    masked_fix_map = mask_map(fix_image, mask)
+    all_fix_map = colormap(masked_fix_map, "blGrRdBl")
+    overlay = segmented_overlay(original_image, fix_image, mask, alpha=0.6)
+"""
+
+import sys
+import argparse
+
+import cv2
+import numpy as np
+
+
+# Colormap name -> colour stops (spaced evenly, as LinearSegmentedColormap.from_list places them)
+COLORMAPS = {
+    "RdBl": ["black", "black", "red", "red"],
+    "blGrRdBl": ["black", "blue", "green", "red", "red"],
+}
+_RGB = {"black": (0.0, 0.0, 0.0), "red": (1.0, 0.0, 0.0), "green": (0.0, 128 / 255, 0.0), "blue": (0.0, 0.0, 1.0)}
+_LUT_SIZE = 256  # matplotlib's default colormap resolution
+
+_colormap_luts = {}
+_blend_luts = {}
+
+
+# ============================================================================
+# Lookup tables
+# ============================================================================
+
+def _segment_lut(stops, n):
+    """matplotlib.colors._create_lookup_table for evenly spaced stops (gamma 1)."""
+    x = np.linspace(0.0, 1.0, len(stops)) * (n - 1)
+    y = np.asarray(stops, dtype=np.float64)
+    xind = (n - 1) * np.linspace(0, 1, n)
+    ind = np.searchsorted(x, xind)[1:-1]
+    distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+    lut = np.concatenate([[y[0]], distance * (y[ind] - y[ind - 1]) + y[ind - 1], [y[-1]]])
+    return np.clip(lut, 0.0, 1.0)
+
+
+def colormap_lut(name):
+    """
+    256 x 4 uint8 RGBA table of colormap `name`: entry v is what
+    (cmap(v / 255.0) * 255).astype(np.uint8) gives for a uint8 value v.
+    """
+    lut = _colormap_luts.get(name)
+    if lut is None:
+        stops = [_RGB[color] for color in COLORMAPS[name]]
+        rgba = np.ones((_LUT_SIZE, 4))
+        for channel in range(3):
+            rgba[:, channel] = _segment_lut([stop[channel] for stop in stops], _LUT_SIZE)
+
+        # The float index matplotlib computes for v / 255.0, then its bytes conversion
+        index = (np.arange(256) / 255.0 * _LUT_SIZE)
+        index[index == _LUT_SIZE] = _LUT_SIZE - 1
+        lut = (rgba[index.astype(int)] * 255).astype(np.uint8)
+        lut.flags.writeable = False
+        _colormap_luts[name] = lut
+    return lut
+
+
+def blend_lut(alpha):
+    """
+    256 x 256 uint8 table of the overlay blend: entry [a, b] is
+    (a * (1 - alpha) + b * alpha).astype(np.uint8) computed in float32.
+    """
+    lut = _blend_luts.get(alpha)
+    if lut is None:
+        # Every step in float32, as the float32 mask array kept it (1 - float32(0.6) is 0.39999998)
+        weight = np.float32(alpha)
+        keep = np.float32(1) - weight
+        a = np.arange(256, dtype=np.float32)[:, None]
+        b = np.arange(256, dtype=np.float32)[None, :]
+        lut = (a * keep + b * weight).astype(np.uint8)
+        lut.flags.writeable = False
+        _blend_luts[alpha] = lut
+    return lut
+
+
+# ============================================================================
+# Post-processing
+# ============================================================================
+
+def _gray(image):
+    image = np.asarray(image)
+    if image.ndim > 2:
+        image = image.squeeze()
+        if image.ndim > 2:
+            image = image[:, :, 0]
+    return image
+
+
+def colormap(image, name, out=None):
+    """
+    H x W x 4 RGBA uint8 of a uint8 map (the first channel of a colour one)
+    through colormap `name`, written into `out` if given.
+    """
+    return np.take(colormap_lut(name), _gray(image), axis=0, out=out)
+
+
+def binary_mask(prediction, threshold):
+    """H x W uint8 mask, 1 where the uint8 `prediction` exceeds `threshold`."""
+    return (prediction > threshold).view(np.uint8)
+
+
+def mask_map(image, mask, out=None):
+    """`image` (uint8, H x W or H x W x C) with pixels outside the 0/1 `mask` zeroed, into `out` if given."""
+    image = np.asarray(image)
+    if image.ndim == 3:
+        mask = mask[:, :, None]
+    return np.multiply(image, mask, out=out, dtype=np.uint8)
+
+
+def segmented_overlay(original_image, rank_map, mask, alpha=0.5):
+    """
+    Copy of the uint8 BGR `original_image` with the JET-coloured uint8 `rank_map`
+    blended in where the 0/1 `mask` is set, as original * (1 - alpha) + jet * alpha.
+    Only the mask's bounding box is coloured and blended.
+    """
+    blended = original_image.copy()
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0 or h == 0:
+        return blended
+
+    box = (slice(y, y + h), slice(x, x + w))
+    jet = cv2.applyColorMap(rank_map[box], cv2.COLORMAP_JET)
+    index = original_image[box].astype(np.uint16)
+    index <<= 8
+    index |= jet
+    np.copyto(blended[box], blend_lut(alpha).ravel()[index], where=mask[box].astype(bool)[:, :, None])
+    return blended
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def check():
+    """Compare every lookup table entry with matplotlib's colormap; True if all match."""
+    from matplotlib.colors import LinearSegmentedColormap
+
+    values = np.arange(256, dtype=np.uint8)[None, :]
+    passed = True
+    for name, colors in COLORMAPS.items():
+        expected = (LinearSegmentedColormap.from_list(name, colors)(values / 255.0) * 255).astype(np.uint8)[0]
+        mismatches = int(np.any(colormap_lut(name) != expected, axis=1).sum())
+        passed &= mismatches == 0
+        print(f"{name:<10} {mismatches} of 256 entries differ from matplotlib")
+    print(f"[INFO] Lookup tables {'match' if passed else 'DO NOT match'} matplotlib")
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="uint8 post-processing of the fixation maps")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check", help="Compare the colormap lookup tables with matplotlib")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        return 0 if check() else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
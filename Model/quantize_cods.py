@@ -0,0 +1,286 @@
+"""
+quantize_cods.py - Post-training INT8 quantization of the CODS Generator for CPU
+
+Fuses and statically quantizes (FX graph mode, x86/fbgemm kernels) the parts
+of the Generator that Grad-CAM never differentiates through:
+
+    resnet.layer1 ... layer4_2          the dual-branch ResNet-50 stages
+    cod_dec / sal_dec conv1..conv3      the per-level dilated feature convs
+
+Everything between the Grad-CAM targets (layer4_1 / layer4_2 outputs) and the
+predictions stays fp32, so CAMs still work: the quantized stages hand back
+float tensors, and the target stages mark theirs as requiring grad.
+
+Activation ranges are calibrated on a folder of images through data.py's
+test_dataset; the accuracy report compares the INT8 predictions with fp32
+(MAE of the sigmoid maps, F-measure of their 0.5 masks) and times both.
+
+    python quantize_cods.py --calib-dir datasets/calib/ --eval-dir datasets/test/
+
+Integration in IAI_Decision_Hierarchy.py _load_cods_model() (--cods-backend int8):
+    from quantize_cods import load_quantized_modules
+    load_quantized_modules(cods, checksum)   # False if missing or stale
+"""
+
+import io
+import os
+import sys
+import copy
+import time
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torchvision.transforms as transforms
+
+
+INT8_MODEL_PATH = "./models/Resnet/Model_50_gen.int8.pt"
+QUANTIZED_MODULES = (
+    "resnet.layer1", "resnet.layer2", "resnet.layer3_1", "resnet.layer4_1", "resnet.layer3_2", "resnet.layer4_2",
+    "cod_dec.conv1", "cod_dec.conv2", "cod_dec.conv3",
+    "sal_dec.conv1", "sal_dec.conv2", "sal_dec.conv3",
+)
+# Grad-CAM target layers: their (dequantized) outputs must be differentiable leaves
+GRADCAM_MODULES = ("resnet.layer4_1", "resnet.layer4_2")
+INPUT_SIZE = 224
+
+
+# ============================================================================
+# Calibration data
+# ============================================================================
+
+def calibration_dataset(image_root, size=INPUT_SIZE):
+    """
+    data.py's test_dataset over `image_root`, feeding tensors the way the
+    pipeline does (resized, [0, 1], no ImageNet normalization).
+    """
+    from data import test_dataset
+
+    dataset = test_dataset(os.path.join(image_root, ""), size)
+    dataset.transform = transforms.Compose([
+        transforms.Resize((size, size)),
+        transforms.ToTensor()])
+    return dataset
+
+
+def _images(dataset, limit=None):
+    """Yield 1x3xHxW tensors from a test_dataset, from its first image."""
+    dataset.index = 0
+    count = dataset.size if limit is None else min(limit, dataset.size)
+    for _ in range(count):
+        image, _, _, _ = dataset.load_data()
+        yield image
+
+
+# ============================================================================
+# Quantization
+# ============================================================================
+
+def _set_backend():
+    engines = torch.backends.quantized.supported_engines
+    backend = "x86" if "x86" in engines else "fbgemm"
+    torch.backends.quantized.engine = backend
+    return backend
+
+
+def quantize_generator(cods, dataset, max_images=None):
+    """
+    Return {module name: quantized GraphModule} for QUANTIZED_MODULES of an
+    eval-mode CPU Generator, calibrated on `dataset`. `cods` is left unchanged.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    backend = _set_backend()
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    model = copy.deepcopy(cods).eval()
+    model.disable_offramp_capture()
+    encoder = model.sal_encoder
+
+    # Example inputs for tracing: each module's input on the first calibration image
+    examples = {}
+    handles = [encoder.get_submodule(name).register_forward_pre_hook(
+        lambda module, inputs, name=name: examples.setdefault(name, inputs)) for name in QUANTIZED_MODULES]
+    with torch.no_grad():
+        model(next(_images(dataset)))
+    for handle in handles:
+        handle.remove()
+
+    prepared = {}
+    for name in QUANTIZED_MODULES:
+        prepared[name] = prepare_fx(encoder.get_submodule(name), qconfig_mapping, examples[name])
+        _set_submodule(encoder, name, prepared[name])
+
+    count = 0
+    with torch.no_grad():
+        for image in _images(dataset, max_images):
+            model(image)
+            count += 1
+    print(f"[INFO] Calibrated {len(prepared)} modules on {count} images ({backend} kernels)")
+
+    return {name: convert_fx(module) for name, module in prepared.items()}
+
+
+def _set_submodule(root, name, module):
+    parent, _, leaf = name.rpartition(".")
+    setattr(root.get_submodule(parent) if parent else root, leaf, module)
+
+
+class QuantizedModule(nn.Module):
+    """
+    Holds one scripted INT8 module in place of the fp32 original. Being a plain
+    nn.Module, it still takes the forward hooks Grad-CAM and offramp capture use.
+    """
+
+    def __init__(self, module):
+        super().__init__()
+        self.module = module
+
+    def forward(self, *inputs):
+        return self.module(*inputs)
+
+
+def _require_grad(module, inputs, output):
+    # Quantized kernels have no autograd: make the dequantized output a leaf Grad-CAM can differentiate to
+    if torch.is_grad_enabled() and not output.requires_grad:
+        return output.detach().requires_grad_(True)
+    return output
+
+
+def apply_quantized_modules(cods, modules):
+    """Swap the quantized modules into `cods` (in place) and keep the Grad-CAM targets differentiable."""
+    encoder = cods.sal_encoder
+    for name, module in modules.items():
+        module = QuantizedModule(module)
+        _set_submodule(encoder, name, module)
+        if name in GRADCAM_MODULES:
+            module.register_forward_hook(_require_grad)
+    return cods
+
+
+def save_quantized_modules(modules, checksum, path=INT8_MODEL_PATH):
+    """Save the converted modules as TorchScript (FX GraphModules with quantized submodules do not unpickle)."""
+    scripted = {}
+    for name, module in modules.items():
+        buffer = io.BytesIO()
+        torch.jit.save(torch.jit.script(module), buffer)
+        scripted[name] = buffer.getvalue()
+    torch.save({"checksum": checksum, "backend": torch.backends.quantized.engine, "modules": scripted}, path)
+    print(f"[INFO] INT8 modules written to {path}")
+
+
+def load_quantized_modules(cods, checksum, path=INT8_MODEL_PATH):
+    """
+    Swap the saved INT8 modules into a CPU Generator. Returns False (leaving
+    `cods` fp32) if there is no artifact or it was built from other weights.
+    """
+    if not os.path.exists(path):
+        print(f"[WARN] No INT8 model at {path}; run 'python quantize_cods.py --calib-dir <images>'. Using fp32.")
+        return False
+
+    saved = torch.load(path, map_location="cpu", weights_only=False)
+    if saved["checksum"] != checksum:
+        print(f"[WARN] {path} was calibrated for other weights or LoRA adapters; using fp32. Re-run quantize_cods.py.")
+        return False
+
+    if saved["backend"] in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = saved["backend"]
+    modules = {name: torch.jit.load(io.BytesIO(data), map_location="cpu") for name, data in saved["modules"].items()}
+    apply_quantized_modules(cods, modules)
+    print(f"[INFO] Using INT8 modules from {path} ({len(saved['modules'])} quantized)")
+    return True
+
+
+# ============================================================================
+# Accuracy report
+# ============================================================================
+
+def f_measure(pred, reference, beta2=0.3):
+    """F-measure (beta^2 = 0.3) of binary mask `pred` against binary mask `reference`; 1.0 if both are empty."""
+    tp = np.logical_and(pred, reference).sum()
+    if not pred.any() and not reference.any():
+        return 1.0
+    precision = tp / (pred.sum() + 1e-8)
+    recall = tp / (reference.sum() + 1e-8)
+    return (1 + beta2) * precision * recall / (beta2 * precision + recall + 1e-8)
+
+
+def _latency(model, image, runs):
+    with torch.no_grad():
+        model(image)
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(image)
+    return (time.perf_counter() - start) / runs
+
+
+def accuracy_report(fp32, int8, dataset, max_images=None, runs=5):
+    """
+    MAE of the INT8 fixation / camouflage sigmoid maps against fp32 and the
+    F-measure of their masks at 0.5 (fp32 mask as reference), plus latency.
+    """
+    outputs = (("fixation", 0), ("camouflage", 2))
+    mae = {name: [] for name, _ in outputs}
+    fm = {name: [] for name, _ in outputs}
+    image = None
+    with torch.no_grad():
+        for image in _images(dataset, max_images):
+            ref_preds, q_preds = fp32(image), int8(image)
+            for name, index in outputs:
+                ref = ref_preds[index].sigmoid()[0, 0].numpy()
+                pred = q_preds[index].sigmoid()[0, 0].numpy()
+                mae[name].append(float(np.abs(pred - ref).mean()))
+                fm[name].append(float(f_measure(pred >= 0.5, ref >= 0.5)))
+
+    report = {name: {"mae": float(np.mean(mae[name])), "f_measure": float(np.mean(fm[name]))} for name, _ in outputs}
+    report["images"] = len(mae["fixation"])
+    report["fp32_ms"] = _latency(fp32, image, runs) * 1e3
+    report["int8_ms"] = _latency(int8, image, runs) * 1e3
+
+    print(f"{'output':<12}{'MAE':>10}{'F-measure':>12}")
+    for name, _ in outputs:
+        print(f"{name:<12}{report[name]['mae']:>10.4f}{report[name]['f_measure']:>12.4f}")
+    print(f"[INFO] {report['images']} images; latency (batch 1): fp32 {report['fp32_ms']:.1f} ms, "
+          f"int8 {report['int8_ms']:.1f} ms ({report['fp32_ms'] / report['int8_ms']:.2f}x)")
+    return report
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate, quantize and evaluate an INT8 CODS Generator")
+    parser.add_argument("--calib-dir", required=True, help="Folder of .jpg images for calibration")
+    parser.add_argument("--eval-dir", default=None, help="Folder of .jpg images for the report (default: calib-dir)")
+    parser.add_argument("--max-images", type=int, default=100, help="Calibration images to use")
+    parser.add_argument("--output", default=INT8_MODEL_PATH)
+    parser.add_argument("--report", default=None, help="Also write the accuracy report as JSON")
+    args = parser.parse_args(argv)
+
+    # Builds the fp32 model exactly as the pipeline does (checkpoint + merged LoRA adapters)
+    from IAI_Decision_Hierarchy import resource_manager
+    if torch.cuda.is_available():
+        print("[WARN] Quantized kernels are CPU-only; calibrating on CPU")
+    fp32, checksum = resource_manager.load_eager_cods_model()
+    fp32 = fp32.cpu().eval()
+
+    calib = calibration_dataset(args.calib_dir)
+    if calib.size == 0:
+        print(f"[ERROR] No .jpg images in {args.calib_dir}")
+        return 1
+    modules = quantize_generator(fp32, calib, max_images=args.max_images)
+    save_quantized_modules(modules, checksum, path=args.output)
+
+    int8 = apply_quantized_modules(copy.deepcopy(fp32), modules)
+    report = accuracy_report(fp32, int8, calibration_dataset(args.eval_dir or args.calib_dir))
+    if args.report:
+        import json
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+raster_figures.py - Level 2 / Level 3 figures drawn straight onto pixel arrays
+
+The overview, weak-area and detection figures used to be matplotlib figures:
+plt.subplots, imshow, Rectangle patches and text, then savefig. Building and
+rasterizing a figure costs hundreds of milliseconds and tens of megabytes per
+image, only to show images that are already arrays. This module draws the
+same content with OpenCV and PIL:
+
+    - panels():          images side by side on a white 1200 x 600 canvas (the
+                         12 x 6 in figures at 100 dpi), each scaled to fit
+                         under its title
+    - detection_boxes(): the image at its own resolution with a red 2 px box and
+                         a bold red "<label> <confidence>" above each detection
+
+Pixels are used exactly as given, as imshow showed them (the BGR frames were
+displayed without conversion, and still are), and the results are RGB arrays.
+Fonts are loaded once per (size, weight) and cached; Arial or DejaVu if
+installed, else PIL's built-in font. Nothing here touches pyplot, so figures
+can be rendered and encoded on the output writer's threads.
+
+Integration in IAI_Decision_Hierarchy.py levelTwo() / report_detections():
+    from raster_figures import panels, detection_boxes, encode_rgb
+    output_writer.submit(path, lambda: encode_rgb(panels([original_image, all_fix_map],
+                                                         ["Original Image", "Fixation Map"])))
+"""
+
+import threading
+import functools
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+
+FIGURE_SIZE = (1200, 600)   # width, height: the 12 x 6 in matplotlib figures at 100 dpi
+TITLE_SIZE = 17             # 12 pt at 100 dpi
+LABEL_SIZE = 14             # 10 pt at 100 dpi
+MARGIN = 20
+RED = (255, 0, 0)
+
+FONT_FILES = {
+    False: ("arial.ttf", "DejaVuSans.ttf"),
+    True: ("arialbd.ttf", "DejaVuSans-Bold.ttf", "arial.ttf", "DejaVuSans.ttf"),
+}
+
+# FreeType faces are shared between the output writer's threads; render text one call at a time
+_text_lock = threading.Lock()
+
+
+# ============================================================================
+# Fonts
+# ============================================================================
+
+@functools.lru_cache(maxsize=None)
+def load_font(size, bold=False):
+    """The first installed font of FONT_FILES[bold] at `size` px, else PIL's default; cached."""
+    for name in FONT_FILES[bold]:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1: fixed-size bitmap font only
+        return ImageFont.load_default()
+
+
+def _draw_texts(canvas, texts):
+    """Draw [(xy, text, size, bold, fill, anchor)] onto an RGB uint8 array in one PIL pass; returns the array."""
+    if not texts:
+        return canvas
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    with _text_lock:
+        for xy, text, size, bold, fill, anchor in texts:
+            font = load_font(size, bold)
+            if isinstance(font, ImageFont.FreeTypeFont):
+                draw.text(xy, text, fill=fill, font=font, anchor=anchor)
+            else:
+                draw.text(xy, text, fill=fill, font=font)
+    return np.asarray(image)
+
+
+# ============================================================================
+# Figures
+# ============================================================================
+
+def _rgb(image):
+    image = np.asarray(image)
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    if image.ndim == 2:
+        return np.repeat(image[:, :, None], 3, axis=2)
+    return image[:, :, :3]
+
+
+def _fit(image, width, height):
+    h, w = image.shape[:2]
+    scale = min(width / w, height / h)
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    if size == (w, h):
+        return image
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+
+
+def panels(images, titles, size=FIGURE_SIZE):
+    """
+    `images` (uint8 gray / RGB / RGBA arrays; None or empty for a blank panel)
+    side by side under `titles` on a white canvas of `size` (width, height).
+    """
+    width, height = size
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    panel_width = width // len(images)
+    top = MARGIN + TITLE_SIZE + MARGIN // 2          # room for the title above the tallest image
+    area_width, area_height = panel_width - 2 * MARGIN, height - top - MARGIN
+    texts = []
+    for i, (image, title) in enumerate(zip(images, titles)):
+        left = i * panel_width
+        y = top
+        if image is not None and np.asarray(image).size != 0:
+            fitted = _fit(_rgb(image), area_width, area_height)
+            h, w = fitted.shape[:2]
+            y = top + (area_height - h) // 2
+            x = left + (panel_width - w) // 2
+            canvas[y:y + h, x:x + w] = fitted
+        # Title baseline just above its image, as matplotlib places axes titles
+        texts.append(((left + panel_width // 2, y - MARGIN // 2), title, TITLE_SIZE, False, (0, 0, 0), "ms"))
+    return _draw_texts(canvas, texts)
+
+
+def detection_boxes(image, detections, color=RED):
+    """
+    Copy of `image` with each detection ({"bbox": [x1, y1, x2, y2], "label",
+    "confidence"}) boxed and labelled "<label> <confidence %>" 10 px above its box
+    (or at the top of the image, for boxes touching it).
+    """
+    canvas = np.ascontiguousarray(_rgb(image)).copy()
+    texts = []
+    for det in detections:
+        x1, y1, x2, y2 = (int(round(v)) for v in det["bbox"][:4])
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, 2)
+        label = f"{det['label']} {det['confidence']:.2%}"
+        texts.append(((x1, max(y1 - 10, LABEL_SIZE)), label, LABEL_SIZE, True, color, "ls"))
+    return _draw_texts(canvas, texts)
+
+
+def encode_rgb(canvas, ext=".png"):
+    """An RGB figure encoded by OpenCV as `ext`, as bytes."""
+    ok, buffer = cv2.imencode(ext, cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise ValueError(f"OpenCV could not encode a {canvas.shape} figure as {ext}")
+    return buffer.tobytes()
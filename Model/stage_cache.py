@@ -0,0 +1,221 @@
+"""
+stage_cache.py - Content-addressed memoization for the IAI pipeline stages
+
+Each stage result is stored under a hash of exactly the inputs that stage
+depends on (image pixels, model + LoRA adapter checksum, detector version,
+consolidation thresholds), in an in-memory LRU optionally backed by an
+on-disk LRU. Re-opening an image or moving a MICA slider then reuses every
+stage upstream of the change; with a cache directory set, across processes
+as well as within one.
+
+The disk tier unpickles whatever it finds in its directory, so it is off
+unless a directory is given (--cache-dir); point it only at a directory
+nothing else writes to.
+
+Integration in IAI_Decision_Hierarchy.py:
+    key = digest("detector", digest(original_image))
+    detections = stage_cache.get_or_compute("detector", key, run_detector)
+
+Values must be picklable and not None (store numpy arrays, not CUDA tensors).
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+
+def digest(*parts):
+    """
+    Stable hex digest of `parts`.
+
+    numpy arrays hash their dtype, shape and raw bytes; bytes are hashed as is;
+    anything else is hashed through its sorted-key JSON form.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(f"{part.dtype.str}{part.shape}".encode())
+            h.update(memoryview(np.ascontiguousarray(part)).cast("B"))
+        elif isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(part)
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class StageCache:
+    """Two-level (memory, disk) LRU cache of stage results addressed by (stage, key)."""
+
+    def __init__(self, root=None, memory_items=32, disk_bytes=1 << 30, enabled=True):
+        """
+        root:         directory for the on-disk tier (one sub-folder per stage); None keeps
+                      results in memory only
+        memory_items: entries kept in memory across all stages
+        disk_bytes:   size budget of the on-disk tier; None keeps results in memory only
+        """
+        self.root = root
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.enabled = enabled
+        self.stats = defaultdict(lambda: {"memory": 0, "disk": 0, "miss": 0})
+
+        self._memory = OrderedDict()
+        self._disk_used = None
+        self._lock = threading.Lock()
+
+    @property
+    def persistent(self):
+        """Whether results are also kept on disk."""
+        return self.root is not None and self.disk_bytes is not None
+
+    def _path(self, stage, key):
+        return os.path.join(self.root, stage, f"{key}.pkl")
+
+    def get(self, stage, key):
+        """Cached value for (stage, key), or None on a miss."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            value = self._memory.get((stage, key))
+            if value is not None:
+                self._memory.move_to_end((stage, key))
+                self.stats[stage]["memory"] += 1
+                return value
+
+        value = self._read_disk(stage, key)
+        if value is None:
+            self.stats[stage]["miss"] += 1
+            return None
+
+        self.stats[stage]["disk"] += 1
+        self._remember(stage, key, value)
+        return value
+
+    def put(self, stage, key, value, persist=True):
+        """
+        Store `value` in memory and, if `persist`, on disk (evicting least recently
+        used entries). Use persist=False for large results that are cheap to rebuild.
+        """
+        if not self.enabled or value is None:
+            return
+        self._remember(stage, key, value)
+        if persist:
+            self._write_disk(stage, key, value)
+
+    def get_or_compute(self, stage, key, compute, persist=True):
+        """Return the cached value, or call compute(), cache its result and return it."""
+        value = self.get(stage, key)
+        if value is None:
+            value = compute()
+            self.put(stage, key, value, persist)
+        return value
+
+    def clear(self, memory_only=False):
+        """Drop the in-memory tier, and the on-disk tier too unless memory_only."""
+        with self._lock:
+            self._memory.clear()
+        if not memory_only and self.persistent:
+            for path, _, _ in self._disk_entries():
+                os.remove(path)
+            self._disk_used = 0
+
+    # ----------------------------------------------------------------------------
+    # Memory tier
+    # ----------------------------------------------------------------------------
+    def _remember(self, stage, key, value):
+        with self._lock:
+            self._memory[(stage, key)] = value
+            self._memory.move_to_end((stage, key))
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    # ----------------------------------------------------------------------------
+    # Disk tier (recency = file mtime, bumped on every hit)
+    # ----------------------------------------------------------------------------
+    def _read_disk(self, stage, key):
+        if not self.persistent:
+            return None
+        path = self._path(stage, key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[WARN] Dropping unreadable cache entry {path}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, stage, key, value):
+        if not self.persistent:
+            return
+        path = self._path(stage, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                # Overwriting an entry frees the old file's bytes
+                try:
+                    replaced = os.path.getsize(path)
+                except OSError:
+                    replaced = 0
+                os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"[WARN] Could not write cache entry {path}: {e}")
+            return
+
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_used += os.path.getsize(path) - replaced
+            if self._disk_used > self.disk_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        """(path, size, mtime) of every cached file."""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for stage in os.listdir(self.root):
+            stage_dir = os.path.join(self.root, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for name in os.listdir(stage_dir):
+                if name.endswith(".pkl"):
+                    path = os.path.join(stage_dir, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict_disk(self):
+        """Remove least recently used files until the tier is at 90% of its budget."""
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        used = sum(size for _, size, _ in entries)
+        target = int(self.disk_bytes * 0.9)
+        for path, size, _ in entries:
+            if used <= target:
+                break
+            try:
+                os.remove(path)
+                used -= size
+            except OSError:
+                pass
+        self._disk_used = used
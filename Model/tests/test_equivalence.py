@@ -0,0 +1,234 @@
+"""
+test_equivalence.py - The optimized pipeline routines against the code they replaced
+
+Each test runs a rewritten routine and the former implementation (kept here
+as a reference) on synthetic arrays and checks that they agree, so the
+outputs that must match the baseline are checked on every run rather than
+only through the `check` / `parity` commands.
+
+Run from Model/:
+    python -m pytest tests
+"""
+
+import cv2
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+import IAI_Decision_Hierarchy as iai
+from postprocess import COLORMAPS, binary_mask, colormap, mask_map, segmented_overlay
+from tiled_inference import tiled_logits
+
+
+def _random_boxes(rng, n, size):
+    """n integer [x1, y1, x2, y2] boxes inside size x size, some of them touching."""
+    corners = rng.integers(0, size, (n, 2, 2))
+    return np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+
+
+# ============================================================================
+# Level 3: weak area x detection overlap (overlap_matrix)
+# ============================================================================
+
+def test_overlap_matrix_matches_pairwise_overlap():
+    rng = np.random.default_rng(0)
+    areas = _random_boxes(rng, 25, 64)
+    boxes = _random_boxes(rng, 40, 64)
+
+    expected = np.array([[iai.overlap([a[0], a[2], a[1], a[3]], [b[0], b[2], b[1], b[3]]) for b in boxes]
+                         for a in areas])
+    np.testing.assert_array_equal(iai.overlap_matrix(areas, boxes), expected)
+
+
+def test_overlap_matches_keep_the_nested_loop_order():
+    rng = np.random.default_rng(1)
+    areas = _random_boxes(rng, 6, 100)
+    boxes = _random_boxes(rng, 30, 100).astype(np.float32)
+    scores = rng.random(30).astype(np.float32)
+
+    # The former levelThree loop: weak areas outer, detections inner, low scores skipped
+    expected = [(i, j) for i, a in enumerate(areas) for j, b in enumerate(boxes)
+                if scores[j] >= 0.05 and iai.overlap([a[0], a[2], a[1], a[3]], [b[0], b[2], b[1], b[3]])]
+
+    hits = iai.overlap_matrix(areas, boxes) & (scores >= 0.05)[None, :]
+    assert list(zip(*(index.tolist() for index in np.nonzero(hits)))) == expected
+
+
+# ============================================================================
+# Level 2: weak areas from one connected-components pass (extract_weak_areas)
+# ============================================================================
+
+def _weak_map(rng, height=120, width=160):
+    """uint8 map of random rectangles and single pixels, a ring with a hole, and diagonal neighbours."""
+    weak = np.zeros((height, width), dtype=np.uint8)
+    for x1, y1, x2, y2 in _random_boxes(rng, 12, min(height, width)):
+        weak[y1:y1 + (y2 - y1) // 3 + 1, x1:x1 + (x2 - x1) // 3 + 1] = rng.integers(1, 256)
+    weak[rng.integers(0, height, 20), rng.integers(0, width, 20)] = 200
+    weak[5:25, 130:150] = 90
+    weak[10:20, 135:145] = 0
+    weak[100, 100] = weak[101, 101] = 255
+    return weak
+
+
+def test_extract_weak_areas_matches_regionprops():
+    measure = pytest.importorskip("skimage.measure")
+    rng = np.random.default_rng(2)
+    weak = _weak_map(rng)
+
+    # The former label / regionprops pass, on the areas themselves (8-connected)
+    props = measure.regionprops(measure.label(weak > 0, connectivity=2))
+    expected_boxes = [[p.bbox[1], p.bbox[0], p.bbox[3], p.bbox[2]] for p in props]
+    expected_centroids = [[p.centroid[1], p.centroid[0]] for p in props]
+
+    areas = iai.extract_weak_areas(weak)
+    assert areas["bboxes"].tolist() == expected_boxes
+    assert areas["areas"].tolist() == [int(p.area) for p in props]
+    np.testing.assert_allclose(areas["centroids"], expected_centroids, atol=1e-9)
+
+
+def test_extract_weak_areas_min_area_and_colour_input():
+    rng = np.random.default_rng(3)
+    weak = _weak_map(rng)
+    everything = iai.extract_weak_areas(weak)
+    large = iai.extract_weak_areas(weak, min_area=10)
+    keep = everything["areas"] >= 10
+    np.testing.assert_array_equal(large["bboxes"], everything["bboxes"][keep])
+
+    # A colour map finds the areas of its non-black pixels
+    colour = np.repeat(weak[:, :, None], 3, axis=2)
+    np.testing.assert_array_equal(iai.extract_weak_areas(colour)["bboxes"], everything["bboxes"])
+
+
+# ============================================================================
+# Tiled inference: feathered blending of overlapping tiles (tiled_logits)
+# ============================================================================
+
+def _pixel_logits(batch):
+    """A per-pixel stand-in for the encoder: every tile's logit is a function of its own pixels."""
+    return batch[:, :1] * 4.0 - batch[:, 2:3], None, batch.mean(dim=1, keepdim=True)
+
+
+def _expected_pixel_logits(image):
+    rgb = image[:, :, ::-1].astype(np.float32) / 255.0
+    return rgb[:, :, 0] * 4.0 - rgb[:, :, 2], rgb.mean(axis=2)
+
+
+def test_tiled_logits_blend_back_to_the_whole_frame_result():
+    rng = np.random.default_rng(4)
+    for height, width, overlap in ((200, 300, 0.25), (480, 640, 0.5), (64, 96, 0.25)):
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        (first, skipped, third), tiles = tiled_logits(_pixel_logits, image, tile=128, overlap=overlap, batch_size=3)
+
+        # Overlapping tiles of the same values must blend back to those values, seams and padding included
+        expected_first, expected_third = _expected_pixel_logits(image)
+        assert skipped is None
+        assert first.shape == (1, 1, height, width)
+        np.testing.assert_allclose(first[0, 0].numpy(), expected_first, atol=1e-5)
+        np.testing.assert_allclose(third[0, 0].numpy(), expected_third, atol=1e-5)
+        assert tiles >= 1
+
+
+def test_tiled_logits_single_tile_is_the_plain_forward():
+    rng = np.random.default_rng(5)
+    image = rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)
+
+    def native(batch):
+        # Decoder-resolution (1/4) logits, as the encoder returns them with native=True
+        return (F.avg_pool2d(batch[:, :1], 4),)
+
+    (blended,), tiles = tiled_logits(native, image, tile=224)
+    batch = torch.from_numpy(image[:, :, ::-1].astype(np.float32).transpose(2, 0, 1).copy()[None] / 255.0)
+    expected = F.interpolate(native(batch)[0], scale_factor=4, mode="bilinear", align_corners=True)
+    assert tiles == 1
+    np.testing.assert_allclose(blended.numpy(), expected.numpy(), atol=1e-6)
+
+
+def test_tiled_logits_rejects_tiles_off_the_stride():
+    with pytest.raises(ValueError):
+        tiled_logits(_pixel_logits, np.zeros((64, 64, 3), dtype=np.uint8), tile=100)
+
+
+# ============================================================================
+# Prediction maps: one resize from the decoder resolution (process_prediction)
+# ============================================================================
+
+def _old_process_prediction(native_logit, WW, HH):
+    """The former chain: upsample4 to the 224 px input, then resize, sigmoid and scale to uint8."""
+    pred = F.interpolate(native_logit, scale_factor=4, mode="bilinear", align_corners=True)
+    pred = F.interpolate(pred, size=[HH, WW], mode="bilinear", align_corners=False)
+    pred = pred.sigmoid().numpy().squeeze()
+    pred = 255 * (pred - pred.min()) / (pred.max() - pred.min() + 1e-8)
+    return pred.astype(np.uint8)
+
+
+@pytest.mark.parametrize("height, width", [(224, 224), (300, 400), (480, 640), (1080, 1920)])
+def test_process_prediction_matches_the_upsample_chain(height, width):
+    torch.manual_seed(height)
+    native_logit = torch.randn(1, 1, 56, 56) * 3
+
+    new = iai.process_prediction(native_logit, width, height, (224, 224))
+    old = _old_process_prediction(native_logit, width, height)
+
+    # float32 rounding of the composed weights may move a value across a uint8 step
+    difference = np.abs(new.astype(np.int16) - old.astype(np.int16))
+    assert new.shape == (height, width)
+    assert difference.max() <= 1
+    assert np.count_nonzero(difference) <= old.size * 1e-3
+
+
+def test_process_prediction_strips_do_not_change_the_map(monkeypatch):
+    torch.manual_seed(0)
+    native_logit = torch.randn(1, 1, 56, 56)
+    whole = iai.process_prediction(native_logit, 333, 257, (224, 224))
+    monkeypatch.setattr(iai, "PREDICTION_STRIP_PIXELS", 333 * 10)
+    np.testing.assert_array_equal(iai.process_prediction(native_logit, 333, 257, (224, 224)), whole)
+
+
+# ============================================================================
+# Post-processing on uint8 buffers: lookup-table colormaps and blend (postprocess.py)
+# ============================================================================
+
+@pytest.mark.parametrize("name", ["RdBl", "blGrRdBl"])
+def test_colormap_matches_matplotlib(name):
+    colors = pytest.importorskip("matplotlib.colors")
+
+    rng = np.random.default_rng(6)
+    fix_image = rng.integers(0, 256, (90, 70), dtype=np.uint8)
+    cmap = colors.LinearSegmentedColormap.from_list(name, COLORMAPS[name])
+
+    # The former findAreasOfWeakCamouflage / processFixationMap conversions
+    expected = (cmap(fix_image / 255.0) * 255).astype(np.uint8)
+    np.testing.assert_array_equal(colormap(fix_image, name), expected)
+    np.testing.assert_array_equal(colormap(fix_image, name), cmap(fix_image / 255.0, bytes=True))
+
+
+def test_mask_map_matches_the_transposed_mask():
+    rng = np.random.default_rng(7)
+    bm_image = rng.integers(0, 256, (60, 80), dtype=np.uint8)
+    fix_image = rng.integers(0, 256, (60, 80), dtype=np.uint8)
+
+    # The former threshold_and_decide / apply_mask: a transposed 0/1 mask times the transposed map
+    old_mask = np.asarray(np.transpose(np.where(bm_image > 128, 1, 0)), dtype=np.uint8)
+    expected = np.transpose(np.broadcast_to(old_mask, fix_image.T.shape) * np.transpose(fix_image))
+
+    mask = binary_mask(bm_image, 128)
+    np.testing.assert_array_equal(mask, np.where(bm_image > 128, 1, 0))
+    np.testing.assert_array_equal(mask_map(fix_image, mask), expected)
+
+
+@pytest.mark.parametrize("alpha", [0.5, 0.6])
+def test_segmented_overlay_matches_the_float_blend(alpha):
+    rng = np.random.default_rng(8)
+    original = rng.integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    rank_map = rng.integers(0, 256, (64, 96), dtype=np.uint8)
+    mask = np.zeros((64, 96), dtype=np.uint8)
+    mask[10:40, 20:70] = rng.integers(0, 2, (30, 50))
+
+    # The former create_segmented_overlay: the whole frame blended in float32
+    heatmap = cv2.applyColorMap(rank_map, cv2.COLORMAP_JET).astype(np.float32)
+    mask_3ch = np.stack([mask] * 3, axis=-1).astype(np.float32)
+    blended = original.astype(np.float32)
+    expected = (blended * (1 - mask_3ch * alpha) + heatmap * (mask_3ch * alpha)).astype(np.uint8)
+
+    np.testing.assert_array_equal(segmented_overlay(original, rank_map, mask, alpha), expected)
@@ -0,0 +1,118 @@
+"""
+tiled_inference.py - Full-resolution CODS inference from overlapping tiles
+
+The pipeline normally squashes the whole frame to 224x224, so on large drone
+imagery a small camouflaged target shrinks to a few pixels and disappears.
+Tiled mode instead cuts the frame into overlapping tiles at native resolution
+(224 px by default), runs them through the Generator in batches, and blends
+the tiles' encoder logits into full-resolution maps:
+
+    - each tile's logits are weighted by a feathered window (linear ramps over
+      the overlap), so seams between tiles do not show
+    - the weighted sums are divided by the summed weights per pixel
+    - frames smaller than a tile are reflect-padded and cropped back
+
+Cost grows linearly with the frame area, and each batch of tiles is one
+forward through the model's intra-op thread pool (or the GPU).
+
+The blended logits replace the 224 px ones: the MICA adjustment, thresholding
+and Levels 1-3 then run on a map at the frame's own resolution.
+
+Integration in IAI_Decision_Hierarchy.py iaiDecision() (--tiled):
+    from tiled_inference import tiled_logits
+    logits = tiled_logits(lambda batch: cods.sal_encoder(batch), original_image, tile=224, overlap=0.25)
+"""
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+TILE_SIZE = 224
+TILE_OVERLAP = 0.25    # fraction of the tile shared with each neighbour
+TILE_BATCH = 8         # tiles per forward
+TILE_MULTIPLE = 32     # the ResNet's total stride: other sizes give decoder maps that don't tile evenly
+
+
+def tile_origins(length, tile, stride):
+    """Start offsets along one axis: every `stride` pixels, with the last tile flush with the end."""
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)
+    return origins
+
+
+def tile_grid(height, width, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """(y, x) top-left corners of overlapping tile x tile windows covering a height x width frame."""
+    stride = max(1, int(round(tile * (1.0 - overlap))))
+    return [(y, x) for y in tile_origins(height, tile, stride) for x in tile_origins(width, tile, stride)]
+
+
+def feather_window(tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    tile x tile blending weights: 1 in the centre, ramping linearly towards each
+    border over the overlap width. Never 0, so every pixel has some weight.
+    """
+    ramp = max(1, int(round(tile * overlap)))
+    i = np.arange(tile, dtype=np.float32)
+    profile = np.minimum(1.0, np.minimum(i + 1, tile - i) / (ramp + 1))
+    return np.outer(profile, profile)
+
+
+def _to_tensor(tiles, device):
+    batch = np.stack(tiles).astype(np.float32) / 255.0
+    return torch.from_numpy(batch.transpose(0, 3, 1, 2)).to(device)
+
+
+def _to_tile(logit, tile):
+    if logit.shape[-2:] != (tile, tile):
+        logit = F.interpolate(logit.float(), size=(tile, tile), mode="bilinear", align_corners=True)
+    return logit.float().cpu().numpy()[:, 0]
+
+
+def tiled_logits(logits_fn, original_image, tile=TILE_SIZE, overlap=TILE_OVERLAP, batch_size=TILE_BATCH,
+                 device=None):
+    """
+    Run `logits_fn` (Nx3xtilextile float tensor in [0, 1] -> tuple of Nx1xhxw
+    logits, None for a skipped head) over overlapping tiles of a BGR uint8 image
+    and blend the results. Logits below tile resolution (the decoders' native
+    1/4) are upsampled to the tile as the encoder's own upsample4 would.
+
+    Returns a tuple of 1x1xHxW float32 tensors (H, W the image size; None where
+    logits_fn gave None) on `device`, and the number of tiles run.
+    """
+    if tile <= 0 or tile % TILE_MULTIPLE:
+        raise ValueError(f"Tile size must be a positive multiple of {TILE_MULTIPLE}, not {tile}")
+    device = device or torch.device("cpu")
+    height, width = original_image.shape[:2]
+    image = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
+    pad_y, pad_x = max(0, tile - height), max(0, tile - width)
+    if pad_y or pad_x:
+        image = cv2.copyMakeBorder(image, 0, pad_y, 0, pad_x, cv2.BORDER_REFLECT_101)
+    padded_h, padded_w = image.shape[:2]
+
+    origins = tile_grid(padded_h, padded_w, tile, overlap)
+    window = feather_window(tile, overlap)
+    weights = np.zeros((padded_h, padded_w), dtype=np.float32)
+    sums = None
+
+    with torch.no_grad():
+        for start in range(0, len(origins), batch_size):
+            group = origins[start:start + batch_size]
+            batch = _to_tensor([image[y:y + tile, x:x + tile] for y, x in group], device)
+            outputs = [None if logit is None else _to_tile(logit, tile) for logit in logits_fn(batch)]
+            if sums is None:
+                sums = [None if output is None else np.zeros((padded_h, padded_w), dtype=np.float32)
+                        for output in outputs]
+            for i, (y, x) in enumerate(group):
+                for total, output in zip(sums, outputs):
+                    if total is not None:
+                        total[y:y + tile, x:x + tile] += window * output[i]
+                weights[y:y + tile, x:x + tile] += window
+
+    blended = tuple(None if total is None else
+                    torch.from_numpy(np.ascontiguousarray((total / weights)[:height, :width]))[None, None].to(device)
+                    for total in sums)
+    return blended, len(origins)
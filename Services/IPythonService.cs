@@ -12,5 +12,8 @@ namespace MURDOC_2024.Services
 
         /// <summary>Runs IAI_Decision_Hierarchy.py with current MICA sensitivity and bias arguments.</summary>
         Task<string> RunIAIModelsWithMICAAsync(string imagePath);
+
+        /// <summary>Re-thresholds the last run image with the current MICA parameters (Levels 1-2, no model re-run).</summary>
+        Task<string> RethresholdAsync(string imagePath);
     }
 }
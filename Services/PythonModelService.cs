@@ -1,8 +1,12 @@
 ﻿using System;
+using System.ComponentModel;
+using System.Globalization;
 using System.IO;
+using System.Threading;
 using System.Threading.Tasks;
 using System.Diagnostics;
 using Newtonsoft.Json;
+using Newtonsoft.Json.Linq;
 
 namespace MURDOC_2024.Services
 {
@@ -15,6 +19,18 @@ namespace MURDOC_2024.Services
         // or repeat the path string here to use it in the constructor.
         private readonly string _pythonHome = @"C:\Users\hogue\AppData\Local\Python\Python39";
 
+        // Long-lived "IAI_Decision_Hierarchy.py --serve" process. Keeps the models
+        // loaded between images; requests are serialized through _serverGate.
+        private readonly SemaphoreSlim _serverGate = new SemaphoreSlim(1, 1);
+        private Process _serverProcess;
+        private int _nextRequestId;
+
+        private static readonly JsonSerializerSettings ServerJsonSettings = new JsonSerializerSettings
+        {
+            // Keep protocol lines pure ASCII regardless of the console code page
+            StringEscapeHandling = StringEscapeHandling.EscapeNonAscii
+        };
+
         public PythonModelService()
         {
             // Add Python Home to the System PATH so Process.Start("python.exe")
@@ -60,11 +76,9 @@ namespace MURDOC_2024.Services
                 Directory.CreateDirectory(outputDir);
 
             // 2. Prepare arguments: Script path, image path, AND OUTPUT DIR
-            string arguments = $"\"{scriptPath}\" \"{imagePath}\"";
+            string arguments = $"\"{scriptPath}\" \"{imagePath}\" --offramp";
 
-            Console.WriteLine($"[PROCESS] Executing: {pythonExe} {arguments}");
-
-            return RunPythonScriptAsync(pythonExe, arguments);
+            return RunInferenceAsync(pythonExe, scriptPath, imagePath, arguments);
         }
 
         /// <summary>
@@ -113,11 +127,199 @@ namespace MURDOC_2024.Services
                 Directory.CreateDirectory(outputDir);
 
             // 3. Pass parameters as command line arguments INCLUDING MICA parameters
-            string arguments = $"\"{scriptPath}\" \"{imagePath}\" --sensitivity {_currentSensitivity} --bias {_currentBias}";
+            string arguments = $"\"{scriptPath}\" \"{imagePath}\" " +
+                $"--sensitivity {_currentSensitivity.ToString(CultureInfo.InvariantCulture)} " +
+                $"--bias {_currentBias.ToString(CultureInfo.InvariantCulture)} " +
+                "--offramp";
+
+            return RunInferenceAsync(pythonExe, scriptPath, imagePath, arguments);
+        }
+
+        /// <summary>
+        /// Sends the image to the persistent Python server, starting it on first use.
+        /// Falls back to a one-shot process (<paramref name="fallbackArguments"/>) if the
+        /// server cannot be started or dies mid-request.
+        /// </summary>
+        private async Task<string> RunInferenceAsync(string pythonExe, string scriptPath, string imagePath, string fallbackArguments)
+        {
+            try
+            {
+                return await RunServerRequestAsync(pythonExe, scriptPath, imagePath).ConfigureAwait(false);
+            }
+            catch (Exception ex) when (ex is IOException || ex is InvalidOperationException || ex is Win32Exception)
+            {
+                Console.WriteLine($"[SERVER] Unavailable ({ex.Message}); falling back to one-shot process.");
+                StopServer();
+            }
+
+            Console.WriteLine($"[PROCESS] Executing: {pythonExe} {fallbackArguments}");
+            return await RunPythonScriptAsync(pythonExe, fallbackArguments).ConfigureAwait(false);
+        }
+
+        /// <summary>
+        /// Re-applies the current MICA parameters to the last image the server ran, using its
+        /// cached model outputs (Levels 1-2 only, no model or detector run). The server does a
+        /// full run instead if it has nothing cached for <paramref name="imagePath"/>; if the
+        /// server is unavailable this falls back to a full one-shot MICA run.
+        /// </summary>
+        public async Task<string> RethresholdAsync(string imagePath)
+        {
+            string pythonExe = "python.exe";
+            string scriptPath = Path.Combine(AppDomain.CurrentDomain.BaseDirectory, @"..\..\..\Model\IAI_Decision_Hierarchy.py");
+
+            try
+            {
+                return await RunServerRequestAsync(pythonExe, scriptPath, imagePath, "rethreshold").ConfigureAwait(false);
+            }
+            catch (Exception ex) when (ex is IOException || ex is InvalidOperationException || ex is Win32Exception)
+            {
+                Console.WriteLine($"[SERVER] Unavailable ({ex.Message}); running the full model instead.");
+                StopServer();
+            }
+
+            return await RunIAIModelsWithMICAAsync(imagePath).ConfigureAwait(false);
+        }
+
+        /// <summary>
+        /// Runs one request ("run" by default) against the persistent server and returns the
+        /// decision message. Throws if the server reports a failure for this image.
+        /// </summary>
+        private async Task<string> RunServerRequestAsync(string pythonExe, string scriptPath, string imagePath, string command = "run")
+        {
+            await _serverGate.WaitAsync().ConfigureAwait(false);
+            try
+            {
+                Process server = await EnsureServerStartedAsync(pythonExe, scriptPath).ConfigureAwait(false);
+
+                int requestId = Interlocked.Increment(ref _nextRequestId);
+                var request = new
+                {
+                    id = requestId,
+                    command = command,
+                    image_path = imagePath,
+                    sensitivity = _currentSensitivity,
+                    bias = _currentBias
+                };
+
+                Console.WriteLine($"[SERVER] Request {requestId} ({command}): {imagePath}");
+                await server.StandardInput.WriteLineAsync(JsonConvert.SerializeObject(request, ServerJsonSettings)).ConfigureAwait(false);
+                await server.StandardInput.FlushAsync().ConfigureAwait(false);
+
+                JObject response = await ReadServerMessageAsync(server, m => (int?)m["id"] == requestId).ConfigureAwait(false);
+
+                if (!(bool)response["ok"])
+                {
+                    throw new Exception($"Python server failed on {imagePath}.\n\n{(string)response["error"]}");
+                }
+
+                return ((string)response["result"] ?? string.Empty).Trim();
+            }
+            finally
+            {
+                _serverGate.Release();
+            }
+        }
+
+        /// <summary>
+        /// Returns the running server process, starting it and waiting for its
+        /// "ready" event (models loaded) if needed. Caller must hold _serverGate.
+        /// </summary>
+        private async Task<Process> EnsureServerStartedAsync(string pythonExe, string scriptPath)
+        {
+            if (_serverProcess != null && !_serverProcess.HasExited)
+                return _serverProcess;
+
+            StopServer();
+
+            var startInfo = new ProcessStartInfo
+            {
+                FileName = pythonExe,
+                Arguments = $"\"{scriptPath}\" --serve --offramp",
+                WorkingDirectory = AppDomain.CurrentDomain.BaseDirectory,
+                UseShellExecute = false,
+                RedirectStandardInput = true,
+                RedirectStandardOutput = true,
+                RedirectStandardError = true,
+                CreateNoWindow = true
+            };
+
+            Console.WriteLine($"[SERVER] Starting: {pythonExe} {startInfo.Arguments}");
+
+            var process = Process.Start(startInfo);
+
+            // Drain stderr continuously so pipeline logging can never fill the pipe
+            process.ErrorDataReceived += (sender, e) =>
+            {
+                if (!string.IsNullOrEmpty(e.Data))
+                    Console.WriteLine($"[PYTHON] {e.Data}");
+            };
+            process.BeginErrorReadLine();
+
+            _serverProcess = process;
+
+            JObject ready = await ReadServerMessageAsync(process, m => (string)m["event"] == "ready").ConfigureAwait(false);
+            double loadTime = ready.Value<double?>("load_time") ?? 0.0;
+            Console.WriteLine($"[SERVER] Ready (models loaded in {loadTime:0.0}s)");
+
+            return process;
+        }
+
+        /// <summary>
+        /// Reads protocol lines from the server until one matches <paramref name="isMatch"/>.
+        /// Throws IOException if the server exits first.
+        /// </summary>
+        private static async Task<JObject> ReadServerMessageAsync(Process server, Func<JObject, bool> isMatch)
+        {
+            while (true)
+            {
+                string line = await server.StandardOutput.ReadLineAsync().ConfigureAwait(false);
+                if (line == null)
+                    throw new IOException("Python server exited unexpectedly.");
+
+                JObject message;
+                try
+                {
+                    message = JObject.Parse(line);
+                }
+                catch (JsonReaderException)
+                {
+                    Console.WriteLine($"[SERVER] Ignoring non-protocol output: {line}");
+                    continue;
+                }
+
+                if (isMatch(message))
+                    return message;
+            }
+        }
 
-            Console.WriteLine($"[PROCESS] Executing: {pythonExe} {arguments}");
+        /// <summary>Asks the server to shut down, killing it if it does not exit promptly.</summary>
+        private void StopServer()
+        {
+            Process server = _serverProcess;
+            _serverProcess = null;
+
+            if (server == null)
+                return;
+
+            try
+            {
+                if (!server.HasExited)
+                {
+                    server.StandardInput.WriteLine(JsonConvert.SerializeObject(new { command = "shutdown" }));
+                    server.StandardInput.Flush();
 
-            return RunPythonScriptAsync(pythonExe, arguments);
+                    if (!server.WaitForExit(5000))
+                        server.Kill();
+                }
+            }
+            catch (Exception ex)
+            {
+                Console.WriteLine($"[SERVER] Error while stopping: {ex.Message}");
+            }
+            finally
+            {
+                server.Dispose();
+            }
         }
 
         // **NOTE: The original synchronous 'public string RunIAIModels(string imagePath)'
@@ -185,10 +387,11 @@ namespace MURDOC_2024.Services
             });
         }
 
-        /// <summary>Releases resources. No-op since all Python execution is via subprocess.</summary>
+        /// <summary>Stops the persistent Python server, if one was started.</summary>
         public void Dispose()
         {
-            // All Python execution uses Process.Start, no embedded engine to shut down
+            StopServer();
+            _serverGate.Dispose();
         }
     }
 }
\ No newline at end of file
@@ -14,6 +14,7 @@ namespace MURDOC_2024.ViewModel
         private readonly IPythonService _pythonService;
         private readonly Action _runModelsAction;
         private readonly Action _resetAction;
+        private readonly Action _rethresholdAction;
 
         // Sensitivity/Bias parameters
         private double _sensitivity = 1.5;  // Default d' value (sensitivity)
@@ -39,14 +40,17 @@ namespace MURDOC_2024.ViewModel
         /// <param name="pythonService">Service for communicating with Python models</param>
         /// <param name="runModelsAction">Action to execute when running models</param>
         /// <param name="resetAction">Action to execute when resetting</param>
+        /// <param name="rethresholdAction">Optional fast path for slider changes (re-threshold without re-running models)</param>
         public MICAControlViewModel(
             IPythonService pythonService,
             Action runModelsAction,
-            Action resetAction)
+            Action resetAction,
+            Action rethresholdAction = null)
         {
             _pythonService = pythonService ?? throw new ArgumentNullException(nameof(pythonService));
             _runModelsAction = runModelsAction;
             _resetAction = resetAction;
+            _rethresholdAction = rethresholdAction;
 
             // Initialize run models command with execute and can-execute delegates
             _runModelsCommand = new RelayCommand(
@@ -276,7 +280,8 @@ namespace MURDOC_2024.ViewModel
 
         /// <summary>
         /// Updates detection parameters in the Python model service asynchronously.
-        /// If AutoUpdate is enabled, automatically re-runs the models.
+        /// If AutoUpdate is enabled, re-thresholds the current result (or re-runs the
+        /// models when no re-threshold action was provided).
         /// Prevents concurrent updates by checking _isUpdating flag.
         /// </summary>
         /// <returns>Completed task</returns>
@@ -294,10 +299,10 @@ namespace MURDOC_2024.ViewModel
                 // Push updated sensitivity (d') and bias (β) parameters to Python service
                 _pythonService.SetDetectionParameters(_sensitivity, _bias);
 
-                // If auto-update is enabled, automatically re-run models with new parameters
+                // If auto-update is enabled, re-threshold the cached result with the new parameters
                 if (_autoUpdate)
                 {
-                    _runModelsAction?.Invoke();
+                    (_rethresholdAction ?? _runModelsAction)?.Invoke();
                 }
             }
             finally
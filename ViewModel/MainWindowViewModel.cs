@@ -156,7 +156,8 @@ namespace MURDOC_2024.ViewModel
             MICAControlVM = new MICAControlViewModel(
                 pythonService: _python,
                 runModelsAction: () => RunModelsCommand(),
-                resetAction: ResetAll
+                resetAction: ResetAll,
+                rethresholdAction: () => RethresholdCommand()
             );
 
             // Session tracking
@@ -914,6 +915,33 @@ namespace MURDOC_2024.ViewModel
             ResetPerImageFeedbackBaseline();
         }
 
+        /// <summary>
+        /// Re-applies the MICA slider values to the current image using the Python server's
+        /// cached model outputs (Levels 1-2 only), so slider changes update in real time.
+        /// Level 3 detections are refreshed by the next full run.
+        /// </summary>
+        private async void RethresholdCommand()
+        {
+            if (IsRunningModels || string.IsNullOrEmpty(SelectedImagePath))
+                return;
+
+            try
+            {
+                string iaiMessage = await _python.RethresholdAsync(GetImageToUse());
+
+                await Task.Run(() => LoadModelOutputs());
+
+                await Application.Current.Dispatcher.InvokeAsync(() =>
+                {
+                    IAIOutputVM.IAIOutputMessage = iaiMessage ?? "Re-threshold completed.";
+                });
+            }
+            catch (Exception ex)
+            {
+                Console.WriteLine($"Error in RethresholdCommand: {ex.Message}");
+            }
+        }
+
         /// <summary>
         /// Command wrapper for async model execution.
         /// Catches and displays any errors that occur.